@@ -0,0 +1,66 @@
+# Throughput of delete_objects and of fanned-out Retrieve calls with and
+# without the worker pool, against the local mock server.
+#
+#   python bench/concurrency.py [latency_ms] [objects]
+#
+# Objects are built before timing starts; building suds objects is CPU work
+# the pool can't overlap and would otherwise hide the network gain.
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from etapi import ExactTargetAPI
+from mockserver import MockServer
+
+def make_api(server, workers):
+    # one account: each run raises the account's concurrency cap
+    api = ExactTargetAPI('bench', 'bench',
+                         log_path=tempfile.gettempdir(), offline=True,
+                         workers=workers)
+    api.init_client()
+    api.client.set_options(location=server.url)
+    return api
+
+def run(server, workers, objs, requests):
+    api = make_api(server, workers)
+
+    start = time.time()
+    api.delete_objects(objs, batch_size=50)
+    deleted = time.time() - start
+
+    rr = api.create('RetrieveRequest')
+    rr.ObjectType = 'List'
+    rr.Properties = ['ID', 'ListName']
+
+    start = time.time()
+    for resp in api.map_calls('Retrieve', [(rr,)] * requests):
+        pass
+    retrieved = time.time() - start
+
+    api.close()
+    return len(objs) / deleted, requests / retrieved
+
+def main(latency_ms=100, count=1000):
+    server = MockServer(latency=latency_ms / 1000.0).start()
+
+    api = make_api(server, 1)
+    objs = []
+    for i in range(count):
+        sub = api.create('Subscriber')
+        sub.SubscriberKey = 'user%d@example.com' % i
+        objs.append(sub)
+
+    try:
+        print '%-8s %16s %18s' % ('workers', 'delete (obj/s)',
+                                  'retrieve (req/s)')
+        for workers in (1, 2, 4, 8, 16):
+            deleted, retrieved = run(server, workers, objs, count / 10)
+            print '%-8d %16.0f %18.1f' % (workers, deleted, retrieved)
+    finally:
+        server.stop()
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,64 @@
+# Decode cost of a DataExtensionObject Retrieve page: suds + _deo_to_list
+# against RowDecoder's formats.
+#
+#   python bench/decode.py [rows] [columns]
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from etapi import ExactTargetAPI, RowDecoder
+
+def retrieve_reply(rows, cols):
+    results = []
+    for i in range(rows):
+        props = ''.join('<Property><Name>%s</Name><Value>value %d</Value>'
+                        '</Property>' % (c, i) for c in cols)
+        results.append('<Results xsi:type="DataExtensionObject"><PartnerKey '
+                       'xsi:nil="true"/><ObjectID xsi:nil="true"/><Type>'
+                       'DataExtensionObject</Type><Properties>%s</Properties>'
+                       '</Results>' % props)
+
+    return ('<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"'
+            ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><soap:Body>'
+            '<RetrieveResponseMsg xmlns="http://exacttarget.com/wsdl/partnerAPI">'
+            '<OverallStatus>MoreDataAvailable</OverallStatus><RequestID>bench'
+            '</RequestID>%s</RetrieveResponseMsg></soap:Body></soap:Envelope>'
+            % ''.join(results))
+
+def timed(fn, runs=3):
+    best = None
+    for i in range(runs):
+        start = time.time()
+        fn()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(rows=2500, columns=10):
+    api = ExactTargetAPI('bench', 'bench', log_path=tempfile.gettempdir(),
+                         offline=True)
+    api.init_client()
+
+    cols = ['Column%d' % i for i in range(columns)]
+    reply = retrieve_reply(rows, cols)
+    rr = api.retrieve_request('DataExtensionObject[bench]', cols)
+
+    def suds_decode():
+        api._deo_to_list(api.client.service.Retrieve(rr, __inject={'reply': reply}))
+
+    baseline = timed(suds_decode)
+    print '%d rows x %d columns, %d KB' % (rows, columns, len(reply) / 1024)
+    print '%-16s %10.1f ms %12.0f rows/s' % ('suds+_deo_to_list',
+                                            baseline * 1000, rows / baseline)
+
+    for row_format in RowDecoder.formats:
+        decoder = RowDecoder(cols, row_format)
+        elapsed = timed(lambda: decoder.decode(reply))
+        print '%-16s %10.1f ms %12.0f rows/s %6.1fx' % (
+            row_format, elapsed * 1000, rows / elapsed, baseline / elapsed)
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
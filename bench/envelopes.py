@@ -0,0 +1,77 @@
+# Per-call CPU to produce the request body: suds factory + marshaller against
+# a compiled EnvelopeTemplate.  Nothing is sent.
+#
+#   python bench/envelopes.py [calls] [rows]
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from etapi import ExactTargetAPI, Page
+
+def per_call(fn, calls):
+    start = time.clock()
+    for i in xrange(calls):
+        fn(i)
+    return (time.clock() - start) / calls
+
+def main(calls=200, rows=100):
+    api = ExactTargetAPI('bench', 'bench', log_path=tempfile.gettempdir(),
+                         offline=True)
+    api.init_client()
+    attribs = {'First Name': 'Jo', 'Last Name': 'Bloggs', 'Order': '1234'}
+    names = tuple(sorted(attribs))
+
+    def factory_tsd(i):
+        ts = api._triggered_send('welcome', 'user%d@example.com' % i,
+                                 'user%d' % i, attribs)
+        api.envelope('Create', api.create_options('Synchronous'), [ts])
+
+    tsd_build = lambda t: (api.create_options('Synchronous'),
+                           [api._triggered_send(t('tsd_key'), t('email'), t('key'),
+                                                dict((k, t('attr:' + k))
+                                                     for k in names))])
+
+    def compiled_tsd(i):
+        tpl = api.template(('TriggeredSend', names), 'Create', tsd_build)
+        values = {'tsd_key': 'welcome', 'email': 'user%d@example.com' % i,
+                  'key': 'user%d' % i}
+        for k in names:
+            values['attr:' + k] = attribs[k]
+        tpl.fill(values)
+
+    batch = [dict(('Column%d' % c, 'value %d' % r) for c in range(10))
+             for r in range(rows)]
+    co = api.create_options('Synchronous')
+
+    def factory_deo(i):
+        api.envelope('Create', co, [api._create_deo('bench', r) for r in batch])
+
+    def compiled_deo(i):
+        api._create_rows_compiled(co, [(api.row_template('bench', co, r), r)
+                                       for r in batch])
+
+    # write the compiled path's request but don't send it
+    def send_envelope(method, body, decode=None):
+        if callable(body):
+            body()
+        return Page('OK', None, [])
+
+    api.send_envelope = send_envelope
+
+    print '%-28s %12s %12s %8s' % ('request', 'factory', 'compiled', 'speedup')
+    for name, slow, fast in (
+            ('triggered send', factory_tsd, compiled_tsd),
+            ('DE upsert, %d rows' % rows, factory_deo, compiled_deo)):
+        # compile outside the timing; the factory path is slow enough that
+        # a few calls are plenty
+        fast(0)
+        slow_t = per_call(slow, max(1, calls / 50))
+        fast_t = per_call(fast, calls)
+        print '%-28s %9.3f ms %9.3f ms %7.0fx' % (name, slow_t * 1000,
+                                                  fast_t * 1000, slow_t / fast_t)
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
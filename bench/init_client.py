@@ -0,0 +1,56 @@
+# Compare cold and warm ExactTargetAPI.init_client() start times.
+#
+#   python bench/init_client.py [runs]
+#
+# Uses the bundled schema in offline mode so no network is involved; the
+# cold run starts from an empty cache directory.  Against the remote schema
+# the uncached and cold numbers also include the download, and the warm one
+# a revalidation request.
+#
+# Unpickling the parsed schema from disk is still tens of milliseconds,
+# about half of a full parse; only the in-process case, a schema this
+# process (or the parent of a forked worker) already loaded, is a matter
+# of milliseconds.
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+import etapi
+from etapi import ExactTargetAPI
+
+def timed_init(cache_path):
+    api = ExactTargetAPI('bench', 'bench', log_path=tempfile.gettempdir(),
+                         cache_path=cache_path, offline=True)
+    start = time.time()
+    api.init_client()
+    return time.time() - start
+
+def timed_fresh_init(cache_path):
+    # forget what this process has already parsed
+    etapi._schema_clients.clear()
+    return timed_init(cache_path)
+
+def main(runs=5):
+    cache_path = tempfile.mkdtemp(prefix='etapi-bench-')
+
+    try:
+        uncached = min(timed_fresh_init(None) for i in range(runs))
+        cold = timed_fresh_init(cache_path)
+        warm = min(timed_fresh_init(cache_path) for i in range(runs))
+        loaded = min(timed_init(cache_path) for i in range(runs))
+    finally:
+        shutil.rmtree(cache_path)
+
+    print 'uncached:   %8.2f ms' % (uncached * 1000)
+    print 'cold:       %8.2f ms' % (cold * 1000)
+    print 'warm:       %8.2f ms (%.1fx faster than uncached)' % (
+        warm * 1000, uncached / warm)
+    print 'in-process: %8.2f ms (%.1fx faster than uncached)' % (
+        loaded * 1000, uncached / loaded)
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,341 @@
+# A local stand-in for the ExactTarget SOAP endpoint.
+#
+# The operations and object types come from the bundled WSDL.  Create,
+# Update and Delete answer with one result per object in the request;
+# Retrieve returns rows of the requested type and properties, paged with
+# MoreDataAvailable / ContinueRequest like ET; Perform answers OK with a
+# task ID, and the ImportResultsSummary of a started task reports it
+# Completed once import_time seconds have passed (Started until then).  All
+# over HTTP/1.1 keep-alive after an optional delay.
+#
+#   server = MockServer(latency=0.05, page_size=2500).start()
+#   server.rows['DataExtensionObject[my_de]'] = 100000
+#   client.set_options(location=server.url)
+#
+# Faults can be injected at random (seeded, so runs repeat): fault_rate
+# answers with a SOAP fault (HTTP 500), throttle_rate with HTTP 503, and
+# error_rate marks individual objects of a write as failed.
+#
+# With compression (the default) gzipped requests are accepted and replies
+# are gzipped for clients that accept it; without, a gzipped request gets
+# HTTP 415.  With record, every request body is kept in received, e.g. for
+# tests to inspect what was sent.
+import os
+import random
+import re
+import threading
+import time
+import zlib
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from xml.etree import cElementTree as ElementTree
+
+BUNDLED_WSDL = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir, 'wsdl', 'etframework-modified.wsdl')
+
+ENVELOPE = ('<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"'
+            ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+            '<soap:Body>%s</soap:Body></soap:Envelope>')
+PARTNER_NS = 'http://exacttarget.com/wsdl/partnerAPI'
+XSD_NS = '{http://www.w3.org/2001/XMLSchema}'
+WSDL_NS = '{http://schemas.xmlsoap.org/wsdl/}'
+
+OBJECTS = re.compile(r'<(?:\w+:)?Objects[\s>]')
+OBJECT_TYPE = re.compile(r'<(?:\w+:)?ObjectType>([^<]*)<')
+PROPERTIES = re.compile(r'<(?:\w+:)?Properties>([^<]*)<')
+CONTINUE = re.compile(r'<(?:\w+:)?ContinueRequest>([^<]*)<')
+VALUES = re.compile(r'<(?:\w+:)?Value>([^<]*)<')
+
+# sample values for the simple schema types
+SAMPLES = {
+    'int': '%d', 'long': '%d', 'short': '%d', 'integer': '%d',
+    'double': '%d.5', 'decimal': '%d.5', 'boolean': 'true',
+    'dateTime': '2015-06-01T10:00:00', 'date': '2015-06-01',
+}
+
+class Schema(object):
+    # what the mock needs from the WSDL: the operations, and for each
+    # object type its simple properties (inherited ones included) with a
+    # sample value format
+
+    def __init__(self, path=BUNDLED_WSDL):
+        root = ElementTree.parse(path).getroot()
+
+        self.operations = set(op.get('name') for op in
+                              root.iter(WSDL_NS + 'operation'))
+
+        enums = {}
+        for st in root.iter(XSD_NS + 'simpleType'):
+            values = [e.get('value') for e in st.iter(XSD_NS + 'enumeration')]
+            if st.get('name') and values:
+                enums[st.get('name')] = values[0]
+
+        self.bases = {}
+        self.fields = {}
+        for ct in root.iter(XSD_NS + 'complexType'):
+            name = ct.get('name')
+            if not name:
+                continue
+            ext = ct.find('.//' + XSD_NS + 'extension')
+            if ext is not None:
+                self.bases[name] = ext.get('base').split(':')[-1]
+
+            fields = {}
+            for el in ct.iter(XSD_NS + 'element'):
+                kind = (el.get('type') or '').split(':')
+                if len(kind) == 2 and kind[0] == 'xsd':
+                    fields[el.get('name')] = SAMPLES.get(kind[1], '%s-%%d'
+                                                         % el.get('name'))
+                elif kind[-1] in enums:
+                    fields[el.get('name')] = enums[kind[-1]]
+            self.fields[name] = fields
+
+    def properties(self, objtype):
+        props = {}
+        while objtype is not None:
+            for k, v in self.fields.get(objtype, {}).items():
+                props.setdefault(k, v)
+            objtype = self.bases.get(objtype)
+        return props
+
+
+def results(action, count, errors=()):
+    out = []
+    for i in range(count):
+        if i in errors:
+            out.append('<Results><StatusCode>Error</StatusCode><StatusMessage>'
+                       'Mock error</StatusMessage><OrdinalID>%d</OrdinalID>'
+                       '<ErrorCode>12000</ErrorCode>' % i)
+        else:
+            out.append('<Results><StatusCode>OK</StatusCode><StatusMessage>OK'
+                       '</StatusMessage><OrdinalID>%d</OrdinalID>' % i)
+            # only CreateResult carries a NewID
+            if action == 'Create':
+                out.append('<NewID>%d</NewID>' % (i + 1))
+        out.append('</Results>')
+    return ''.join(out)
+
+def write_response(action, count, request_id, errors=()):
+    status = 'Error' if errors else 'OK'
+    return ('<%sResponse xmlns="%s">%s<RequestID>%s</RequestID>'
+            '<OverallStatus>%s</OverallStatus></%sResponse>'
+            % (action, PARTNER_NS, results(action, count, errors), request_id,
+               status, action))
+
+def retrieve_response(request_id, status, rows):
+    return ('<RetrieveResponseMsg xmlns="%s"><OverallStatus>%s</OverallStatus>'
+            '<RequestID>%s</RequestID>%s</RetrieveResponseMsg>'
+            % (PARTNER_NS, status, request_id, ''.join(rows)))
+
+def deo_row(props, i):
+    values = ''.join('<Property><Name>%s</Name><Value>%s %d</Value></Property>'
+                     % (p, p, i) for p in props)
+    return ('<Results xsi:type="DataExtensionObject"><PartnerKey xsi:nil="true"/>'
+            '<ObjectID xsi:nil="true"/><Type>DataExtensionObject</Type>'
+            '<Properties>%s</Properties></Results>' % values)
+
+def object_row(objtype, props, fields, i):
+    values = []
+    for p in props:
+        sample = fields.get(p)
+        if sample is not None:
+            value = sample % i if '%' in sample else sample
+            values.append('<%s>%s</%s>' % (p, value, p))
+    return '<Results xsi:type="%s">%s</Results>' % (objtype, ''.join(values))
+
+def perform_response(request_id):
+    # the task ID is the request's number
+    return ('<PerformResponseMsg xmlns="%s"><Results><Result>'
+            '<StatusCode>OK</StatusCode><StatusMessage>OK</StatusMessage>'
+            '<Task><StatusCode>OK</StatusCode><StatusMessage>OK</StatusMessage>'
+            '<ID>%s</ID></Task></Result></Results><OverallStatus>OK'
+            '</OverallStatus><OverallStatusMessage/><RequestID>%s</RequestID>'
+            '</PerformResponseMsg>' % (PARTNER_NS, request_id.split('-')[-1],
+                                       request_id))
+
+def import_summary(props, task_id, status, rows):
+    values = {'TaskResultID': task_id, 'ImportStatus': status,
+              'TotalRows': rows, 'NumberSuccessful': rows,
+              'NumberDuplicated': 0, 'NumberErrors': 0}
+    return ('<Results xsi:type="ImportResultsSummary">%s</Results>'
+            % ''.join('<%s>%s</%s>' % (p, values[p], p)
+                      for p in props if p in values))
+
+def fault_response(message):
+    return ('<soap:Fault><faultcode>soap:Server</faultcode>'
+            '<faultstring>%s</faultstring></soap:Fault>' % message)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # one write per reply: header lines sent one by one stall on Nagle
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            if not server.compression:
+                return self.reply(415, '')
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        if server.record:
+            with server.lock:
+                server.received.append(body)
+        action = self.headers.get('SOAPAction', '').strip('"')
+        request_id = server.next_request_id()
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        roll = server.roll()
+        if roll < server.throttle_rate:
+            return self.reply(503, '')
+        if roll < server.throttle_rate + server.fault_rate:
+            return self.reply(500, fault_response('Mock fault'))
+
+        if action not in server.schema.operations:
+            reply = fault_response('Unknown action %s' % action)
+            return self.reply(500, reply)
+
+        if action == 'Retrieve':
+            reply = server.retrieve(body, request_id)
+            if reply is None:
+                return self.reply(500, fault_response('Unknown request'))
+        elif action == 'Perform':
+            server.started(request_id)
+            reply = perform_response(request_id)
+        else:
+            count = max(1, len(OBJECTS.findall(body)))
+            errors = set(i for i in range(count)
+                         if server.roll() < server.error_rate)
+            reply = write_response(action, count, request_id, errors)
+
+        self.reply(200, reply)
+
+    def reply(self, code, body):
+        body = ENVELOPE % body if body else ''
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        if (body and self.server.compression and
+                'gzip' in self.headers.get('Accept-Encoding', '')):
+            gz = zlib.compressobj(1, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            body = gz.compress(body) + gz.flush()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency=0.0, port=0, page_size=2500, rows=0,
+                 fault_rate=0.0, throttle_rate=0.0, error_rate=0.0, seed=0,
+                 compression=True, record=False, import_time=0.0,
+                 wsdl=BUNDLED_WSDL):
+        HTTPServer.__init__(self, ('127.0.0.1', port), MockHandler)
+        self.schema = Schema(wsdl)
+        self.latency = latency
+        self.page_size = page_size
+        self.fault_rate = fault_rate
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.compression = compression
+        self.record = record
+        self.received = []
+
+        # task ID -> time started, of every Perform
+        self.import_time = import_time
+        self.imports = {}
+
+        # rows Retrieve finds, by object type; default_rows for the rest
+        self.rows = {}
+        self.default_rows = rows
+
+        self.requests = 0
+        self.random = random.Random(seed)
+        self.cursors = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://%s:%d/Service.asmx' % self.server_address
+
+    def next_request_id(self):
+        with self.lock:
+            self.requests += 1
+            return 'mock-%d' % self.requests
+
+    def roll(self):
+        with self.lock:
+            return self.random.random()
+
+    def started(self, request_id):
+        with self.lock:
+            self.imports[request_id.split('-')[-1]] = time.time()
+
+    def import_summaries(self, body, request_id):
+        # the summaries of the started tasks among the filter's values
+        props = PROPERTIES.findall(body)
+        now = time.time()
+        rows = []
+        with self.lock:
+            for task_id in VALUES.findall(body):
+                started = self.imports.get(task_id)
+                if started is None:
+                    continue
+                done = now - started >= self.import_time
+                rows.append(import_summary(props, task_id,
+                                           'Completed' if done else 'Started',
+                                           self.default_rows))
+        return retrieve_response(request_id, 'OK', rows)
+
+    def retrieve(self, body, request_id):
+        # a new query, or the next page of one
+        match = OBJECT_TYPE.search(body)
+        if match and match.group(1) == 'ImportResultsSummary':
+            return self.import_summaries(body, request_id)
+
+        match = CONTINUE.search(body)
+        with self.lock:
+            if match:
+                cursor = self.cursors.pop(match.group(1), None)
+                if cursor is None:
+                    return None
+                objtype, props, offset = cursor
+            else:
+                objtype = OBJECT_TYPE.search(body).group(1)
+                props = PROPERTIES.findall(body)
+                offset = 0
+
+            total = self.rows.get(objtype, self.default_rows)
+            end = min(offset + self.page_size, total)
+            more = end < total
+            if more:
+                self.cursors[request_id] = (objtype, props, end)
+
+        if objtype.startswith('DataExtensionObject'):
+            rows = [deo_row(props, i) for i in xrange(offset, end)]
+        else:
+            fields = self.schema.properties(objtype)
+            rows = [object_row(objtype, props, fields, i)
+                    for i in xrange(offset, end)]
+
+        return retrieve_response(request_id,
+                                 'MoreDataAvailable' if more else 'OK', rows)
+
+    def start(self):
+        t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
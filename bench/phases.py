@@ -0,0 +1,66 @@
+# Where a bulk data extension upsert spends its time, per request phase, as
+# recorded by the api's Instrumentation: CPU-bound jobs show up in build
+# and serialize, network-bound ones in network.  Both paths write their
+# envelopes without suds marshalling, so neither has a build phase ('-').
+#
+#   python bench/phases.py [latency_ms] [rows] [batch_size]
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from etapi import ExactTargetAPI, PHASES
+from mockserver import MockServer
+
+def run(server, rows, batch_size, compiled):
+    api = ExactTargetAPI('bench', 'bench', log_path=tempfile.gettempdir(),
+                         offline=True, compiled=compiled)
+    api.init_client()
+    api.client.set_options(location=server.url)
+
+    # phases that never happened stay None
+    totals = dict((phase, None) for phase in PHASES)
+    sizes = [0, 0]
+
+    @api.instruments.after
+    def add(stats):
+        for phase, seconds in stats.phases():
+            if seconds is not None:
+                totals[phase] = (totals[phase] or 0) + seconds
+        sizes[0] += stats.request_bytes or 0
+        sizes[1] += stats.response_bytes or 0
+
+    data = [{'Email': 'user%d@example.com' % i, 'Name': 'User %d' % i,
+             'Score': str(i)} for i in xrange(rows)]
+
+    start = time.time()
+    api.add_to_data_extension('bench_de', data, batch_size=batch_size)
+    elapsed = time.time() - start
+    api.close()
+    return elapsed, totals, sizes
+
+def seconds(total):
+    if total is None:
+        return '%10s' % '-'
+    return '%9.2fs' % total
+
+def main(latency=50, rows=2000, batch_size=500):
+    server = MockServer(latency / 1000.0)
+    server.start()
+
+    print '%-9s %8s' % ('', 'total') + ''.join('%10s' % p for p in PHASES) \
+        + '%10s %10s' % ('sent KB', 'recv KB')
+    try:
+        for compiled in (False, True):
+            elapsed, totals, sizes = run(server, rows, batch_size, compiled)
+            print '%-9s %7.2fs' % ('compiled' if compiled else 'objects',
+                                   elapsed) + \
+                ''.join(seconds(totals[p]) for p in PHASES) + \
+                '%10d %10d' % (sizes[0] / 1024, sizes[1] / 1024)
+    finally:
+        server.stop()
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,239 @@
+# Repeatable benchmarks of the hot paths against the local mock server,
+# written to a JSON report and optionally checked against an earlier one.
+#
+#   python bench/run.py --report bench/report.json
+#   python bench/run.py --baseline bench/report.json --threshold 1.25
+#
+# Each case runs --repeat times and reports its best and median time.  With
+# --baseline the run fails (exit status 1) when a case's best time is more
+# than threshold times the baseline's.
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+import suds
+
+import etapi
+from etapi import ExactTargetAPI, TriggeredSendBatcher
+from mockserver import MockServer
+
+LOG_PATH = tempfile.gettempdir()
+
+# suds logs the injected faults
+logging.getLogger('suds').addHandler(logging.NullHandler())
+
+def make_api(server, **options):
+    api = ExactTargetAPI('bench', 'bench', log_path=LOG_PATH, offline=True,
+                         **options)
+    api.init_client()
+    api.client.set_options(location=server.url)
+    return api
+
+def init_uncached(server, args):
+    etapi._schema_clients.clear()
+    ExactTargetAPI('bench', 'bench', log_path=LOG_PATH, offline=True,
+                   cache_path=None).init_client()
+    return 1
+
+def init_warm(server, args):
+    etapi._schema_clients.clear()
+    ExactTargetAPI('bench', 'bench', log_path=LOG_PATH, offline=True,
+                   cache_path=args.cache_path).init_client()
+    return 1
+
+def init_in_process(server, args):
+    ExactTargetAPI('bench', 'bench', log_path=LOG_PATH, offline=True,
+                   cache_path=args.cache_path).init_client()
+    return 1
+
+def data_extension_rows(args):
+    return [{'Email': 'user%d@example.com' % i, 'First Name': 'User',
+             'Last Name': str(i), 'Score': str(i % 100)}
+            for i in xrange(args.rows)]
+
+def add_to_data_extension(compiled):
+    def run(server, args):
+        api = make_api(server, workers=args.workers, compiled=compiled)
+        api.add_to_data_extension('bench_de', data_extension_rows(args))
+        api.close()
+        return args.rows
+    return run
+
+def get_data_extension(row_format):
+    def run(server, args):
+        server.rows['DataExtensionObject[bench_de]'] = args.rows
+        api = make_api(server)
+        n = 0
+        for page in api.get_data_extension('bench_de', ['Email', 'First Name',
+                                                        'Last Name', 'Score'],
+                                           row_format=row_format, prefetch=1):
+            n += len(page)
+        api.close()
+        return n
+    return run
+
+def add_subscribers_to_list(server, args):
+    api = make_api(server, workers=args.workers)
+    emails = ['user%d@example.com' % i for i in xrange(args.rows)]
+    api.add_subscribers_to_list([(1234, emails)])
+    api.close()
+    return args.rows
+
+def triggered_send(compiled, sends):
+    def run(server, args):
+        api = make_api(server, compiled=compiled)
+        for i in xrange(sends):
+            api.add_to_triggered_send_definition('welcome',
+                                                 'user%d@example.com' % i,
+                                                 'user%d' % i,
+                                                 {'First Name': 'User'})
+        api.close()
+        return sends
+    return run
+
+def triggered_send_batched(server, args):
+    api = make_api(server, workers=args.workers)
+    batcher = TriggeredSendBatcher(api, max_wait=0.05)
+    pending = [batcher.send('welcome', 'user%d@example.com' % i, 'user%d' % i,
+                            {'First Name': 'User'})
+               for i in xrange(args.rows)]
+    batcher.close()
+    for p in pending:
+        p.get()
+    api.close()
+    return args.rows
+
+def retrieve_with_faults(server, args):
+    # paging through a server that faults a tenth of the time
+    server.rows['DataExtensionObject[bench_de]'] = args.rows
+    server.fault_rate = 0.1
+    try:
+        api = make_api(server)
+        n = 0
+        for page in api.get_data_extension('bench_de', ['Email'],
+                                           row_format='tuple', backoff=0.01,
+                                           retries=50):
+            n += len(page)
+        api.close()
+    finally:
+        server.fault_rate = 0.0
+    return n
+
+CASES = [
+    ('init_client.uncached', init_uncached),
+    ('init_client.warm_cache', init_warm),
+    ('init_client.in_process', init_in_process),
+    ('add_to_data_extension.objects', add_to_data_extension(False)),
+    ('add_to_data_extension.compiled', add_to_data_extension(True)),
+    ('get_data_extension.suds', get_data_extension(None)),
+    ('get_data_extension.tuples', get_data_extension('tuple')),
+    ('get_data_extension.faults', retrieve_with_faults),
+    ('add_subscribers_to_list', add_subscribers_to_list),
+    ('add_to_triggered_send_definition.suds', triggered_send(False, 3)),
+    ('add_to_triggered_send_definition.compiled', triggered_send(True, 200)),
+    ('add_to_triggered_send_definition.batched', triggered_send_batched),
+]
+
+def measure(fn, server, args):
+    times = []
+    ops = 0
+    for i in range(args.repeat):
+        start = time.time()
+        ops = fn(server, args)
+        times.append(time.time() - start)
+
+    times.sort()
+    best = times[0]
+    return {'best_s': best, 'median_s': times[len(times) // 2],
+            'ops': ops, 'ops_per_s': ops / best if best else None}
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold):
+    # names of the cases slower than threshold times the baseline
+    slower = []
+    for name, r in sorted(results.items()):
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            continue
+        ratio = r['best_s'] / base['best_s']
+        flag = ''
+        if ratio > threshold:
+            slower.append(name)
+            flag = '  REGRESSION'
+        print '%-45s %6.2fx%s' % (name, ratio, flag)
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=5,
+                        help='mock server latency in ms')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', help='run cases whose name contains this')
+    parser.add_argument('--report', help='write the JSON report here')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    args = parser.parse_args()
+
+    server = MockServer(latency=args.latency / 1000.0, seed=1).start()
+    args.cache_path = tempfile.mkdtemp(prefix='etapi-bench-')
+    results = {}
+
+    try:
+        # fill the schema cache and this process's schema
+        init_warm(server, args)
+
+        print '%-45s %10s %10s %12s' % ('case', 'best (s)', 'median (s)',
+                                        'ops/s')
+        for name, fn in CASES:
+            if args.only and args.only not in name:
+                continue
+            r = results[name] = measure(fn, server, args)
+            print '%-45s %10.3f %10.3f %12.1f' % (name, r['best_s'],
+                                                  r['median_s'], r['ops_per_s'])
+    finally:
+        server.stop()
+        shutil.rmtree(args.cache_path)
+
+    report = {
+        'created': datetime.datetime.utcnow().isoformat() + 'Z',
+        'commit': commit(),
+        'python': platform.python_version(),
+        'suds': suds.__version__,
+        'platform': platform.platform(),
+        'settings': {'latency_ms': args.latency, 'rows': args.rows,
+                     'workers': args.workers, 'repeat': args.repeat},
+        'results': results,
+    }
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+# Cost of adding tenants to a ClientPool: time to log each one in, memory
+# held per tenant and the time to route a call to one.
+#
+#   python bench/tenants.py [tenants]
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from etapi import ClientPool
+
+def rss_mb():
+    # peak resident size; Linux reports it in KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def main(tenants=50):
+    pool = ClientPool(workers=4, log_path=tempfile.gettempdir(), offline=True)
+    for i in xrange(tenants):
+        pool.add('tenant-%d' % i, 'user-%d' % i, 'secret')
+
+    start = time.time()
+    pool.get('tenant-0')
+    first = time.time() - start
+    base = rss_mb()
+
+    start = time.time()
+    for i in xrange(1, tenants):
+        pool.get('tenant-%d' % i)
+    rest = (time.time() - start) / max(1, tenants - 1)
+    grown = rss_mb() - base
+
+    calls = 100000
+    start = time.time()
+    for i in xrange(calls):
+        pool['tenant-%d' % (i % tenants)]
+    route = (time.time() - start) / calls
+
+    print 'first tenant (schema load)  %8.1f ms' % (first * 1000)
+    print 'each further tenant         %8.2f ms' % (rest * 1000)
+    print 'memory for %3d more tenants %8.1f MB' % (tenants - 1, grown)
+    print 'routing a call to a tenant  %8.2f us' % (route * 1e6)
+    pool.close()
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -1,26 +1,188 @@
 import uuid
+import collections
+import datetime
+import fcntl
+import gc
+import hashlib
+import httplib
+import json
 import logging
 import os
+import re
+import socket
 import sys
+import tempfile
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+import zlib
+import Queue
+
+from bisect import bisect_left, bisect_right
+
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
+from xml.etree import cElementTree as ElementTree
+from xml.sax.saxutils import escape
 
 import suds
-from suds.client import Client
+from suds import TypeNotFound
+from suds.cache import ObjectCache
+from suds.client import Client, SoapClient
+from suds.plugin import DocumentPlugin, MessagePlugin, PluginContainer
+from suds.sax import Namespace
+from suds.transport import Reply, Request, Transport, TransportError
+from suds.transport.https import HttpAuthenticated
 from suds.wsse import Security, UsernameToken
 from urllib2 import URLError
 
 DEFAULT_EVURL = 'https://webservice.exacttarget.com/etframework.wsdl'
 
+# schema shipped with the package, used in offline mode
+BUNDLED_WSDL = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir, 'wsdl', 'etframework-modified.wsdl')
+
+# where parsed schemas are pickled between processes
+DEFAULT_CACHE_PATH = os.path.join(tempfile.gettempdir(), 'etapi-schema')
+
+# elements of a Retrieve reply read by RowDecoder
+PARTNER_URI = 'http://exacttarget.com/wsdl/partnerAPI'
+PARTNER_NS = '{%s}' % PARTNER_URI
+RESULTS_TAG = PARTNER_NS + 'Results'
+PROPERTY_TAG = PARTNER_NS + 'Property'
+NAME_TAG = PARTNER_NS + 'Name'
+VALUE_TAG = PARTNER_NS + 'Value'
+STATUS_TAG = PARTNER_NS + 'OverallStatus'
+REQUEST_ID_TAG = PARTNER_NS + 'RequestID'
+
+# objects whose fields are never subtyped or needed when nil, so
+# CompactPlugin can drop xsi:type and nil elements below them
+COMPACT_TYPES = ('DataExtensionObject', 'Subscriber')
+
+# requests smaller than this aren't worth compressing, and the zlib level
+# used; XML this repetitive compresses well even at the fastest level
+COMPRESS_MIN_BYTES = 2048
+COMPRESS_LEVEL = 1
+
+# longest wait between retries of a faulted request, in seconds
+MAX_BACKOFF = 60
+
+# phases of a request recorded by Instrumentation, and histogram buckets
+# for their timings (seconds) and the payload sizes (bytes)
+PHASES = ('wait', 'build', 'serialize', 'network', 'parse')
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+                10, 30, 60)
+SIZE_BUCKETS = (1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20,
+                4 << 20, 16 << 20)
+
+# status fields and results in a raw reply, for requests made by call_xml
+RAW_FIELDS = re.compile(r'<(?:\w+:)?(OverallStatus|RequestID)>([^<]*)<')
+RAW_RESULTS = re.compile(r'<(?:\w+:)?Results[\s>]')
+
+# request outcomes as seen by the RateLimiter
+OK, THROTTLED, FAULT = 'ok', 'throttled', 'fault'
+
+# fault text ET uses when an account is over its request limits
+THROTTLE_MARKERS = ('throttl', 'too many', 'rate limit', 'server busy',
+                    'server too busy')
+
+# object and payload limits for a single Create call
+MAX_BATCH_OBJECTS = 2500
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+MAX_SUBSCRIBER_BATCH = 400
+
+# subscribers per TriggeredSend and TriggeredSends per Create call
+MAX_TS_SUBSCRIBERS = 500
+MAX_TS_OBJECTS = 100
+
+# fields that identify an object for Delete and Update
+KEY_FIELDS = ('ObjectID', 'ID', 'CustomerKey')
+
+# values in one IN filter; longer lists are split over several Retrieves
+MAX_IN_VALUES = 500
+
+# parsed clients already loaded by this process, keyed on schema url and
+# cache location; forked workers inherit them for free
+_schema_clients = {}
+_schema_clients_lock = threading.Lock()
+
+# stub prototypes and generated object models per schema, shared by all
+# its clients
+_schema_stub_types = {}
+_schema_models = {}
+
+# content hashes of local schemas by (path, mtime, size), and of remote
+# ones by url as (digest, time last revalidated)
+_schema_digests = {}
+_remote_digests = {}
+
+# one error log handler per file, however many instances log to it
+_log_handlers = {}
+
+# request limiters per ET account, shared by every instance in the process
+# so several ExactTargetAPI objects can't exceed the account limit
+_account_limiters = {}
+_account_limiters_lock = threading.Lock()
+
 class ExactTargetAPI:
-    def __init__(self, username, password, schema_url=None, log_path=None):
+    def __init__(self, username, password, schema_url=None, log_path=None,
+                 cache_path=DEFAULT_CACHE_PATH, offline=False, workers=1,
+                 concurrency=None, transport=None, cache_ttl=300,
+                 cache_size=1024, compiled=False, rate=None, limiter=None,
+                 instruments=None, pool=None, compress=False, compact=True,
+                 schema_check_interval=3600):
         self.username = username
         self.password = password
+        self.cache_path = cache_path
+        self.offline = offline
+
+        # reference objects (lists, templates, folders...) looked up by name
+        self.lookups = LookupCache(cache_size, cache_ttl)
+
+        # send fixed-shape hot-path requests from precompiled envelopes
+        self.compiled = compiled
+        self.templates = {}
+
+        # number of SOAP calls fanned out at once, and the cap for all
+        # instances logged into this account
+        self.workers = workers
+        self.concurrency = concurrency or workers
+        self.transport = transport
+        self.local = threading.local()
+
+        # gzip request bodies (responses are always accepted compressed),
+        # and leave redundant markup out of requests
+        self.compress = compress
+        self.compact = compact
+
+        # a worker pool may be shared between instances; close() then
+        # leaves it running
+        self.pool = pool
+        self.shared_pool = pool is not None
+
+        # requests per second for the account, or a limiter to share, e.g. a
+        # FileRateLimiter for several processes
+        self.rate = rate
+        self.limiter = limiter
+
+        # per-request timings and sizes; pass one in to share it between
+        # instances or to add hooks before init_client()
+        self.instruments = instruments or Instrumentation()
 
         # it's possible to provide your own modified schema
         if(schema_url):
             self.schema_url = schema_url
+        elif offline:
+            self.schema_url = local_url(BUNDLED_WSDL)
         else:
             self.schema_url = DEFAULT_EVURL
 
+        # seconds a remote schema's digest is trusted before init_client
+        # revalidates it with the server
+        self.schema_check_interval = schema_check_interval
+
         # configure logging for ET errors
         if log_path is not None:
             log_path = os.path.join(log_path, 'ExactTargetAPI.error')
@@ -29,35 +191,253 @@ class ExactTargetAPI:
 
         # create an error logger
         self.logger = logging.getLogger('ExactTargetAPI')
-        fh = logging.FileHandler(log_path)
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        fh.setFormatter(formatter)
-        self.logger.addHandler(fh)
+        log_path = os.path.abspath(log_path)
+        with _schema_clients_lock:
+            if log_path not in _log_handlers:
+                fh = logging.FileHandler(log_path)
+                formatter = logging.Formatter(
+                    '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+                fh.setFormatter(formatter)
+                self.logger.addHandler(fh)
+                _log_handlers[log_path] = fh
+
+        try:
+            self.tty = os.isatty(sys.stdout.fileno())
+        except (AttributeError, ValueError):
+            self.tty = False
 
     def log(self, msg, level=logging.DEBUG):
-        if sys.stdout.fileno() is not None and os.isatty(sys.stdout.fileno()):
+        if self.tty:
             print msg
         else:
             self.logger.log(level, msg)
 
-    def init_client(self):
-        try:
-            # create the SOAP client
-            self.client = Client(self.schema_url)
-        except URLError as e:
-            self.log(e, logging.CRITICAL)
+    def schema_cache(self):
+        # parsed schemas are keyed on the WSDL url by suds, so the location
+        # also gets the WSDL's content hash; a changed schema, local or
+        # remote, then gets a fresh cache instead of a stale type model.
+        # Loading a cached schema still takes about half as long as parsing
+        # it; only schemas already loaded by this process, or inherited by
+        # forked workers, start in milliseconds
+        if self.cache_path is None:
             return None
 
-        # add WS-Security token
+        location = os.path.join(self.cache_path, 'suds-' + suds.__version__)
+        path = local_path(self.schema_url)
+
+        if path is not None:
+            st = os.stat(path)
+            stamp = (path, st.st_mtime, st.st_size)
+            digest = _schema_digests.get(stamp)
+            if digest is None:
+                with open(path, 'rb') as f:
+                    digest = hashlib.sha1(f.read()).hexdigest()
+                _schema_digests[stamp] = digest
+        else:
+            # revalidated at most once per interval, so clones and pool
+            # tenants of a loaded schema don't wait on the network
+            seen = _remote_digests.get(self.schema_url)
+            if (seen is not None and
+                    time.time() - seen[1] < self.schema_check_interval):
+                digest = seen[0]
+            else:
+                digest = remote_digest(self.schema_url, location)
+                if digest is None:
+                    # never seen and unreachable; suds will fail to load it
+                    return None
+                _remote_digests[self.schema_url] = (digest, time.time())
+
+        # the schema is versioned by its hash, not its age
+        return SchemaCache(os.path.join(location, digest), days=365)
+
+    def init_client(self):
+        cache = self.schema_cache()
+        key = (self.schema_url, cache and cache.location, self.offline)
+
+        # instances starting on several threads parse the schema once
+        with _schema_clients_lock:
+            if key not in _schema_clients:
+                plugins = []
+                if self.offline:
+                    plugins.append(OfflineSchemaPlugin())
+
+                try:
+                    # create the SOAP client
+                    _schema_clients[key] = Client(self.schema_url, cache=cache,
+                                                  cachingpolicy=1,
+                                                  plugins=plugins)
+                except URLError as e:
+                    self.log(e, logging.CRITICAL)
+                    return None
+                _schema_stub_types[key] = {}
+                _schema_models[key] = ObjectModel(_schema_clients[key])
+
+        # clones share the parsed schema and type factory but not options;
+        # envelope templates hold this instance's credentials, so they stay
+        # per instance
+        self.client = _schema_clients[key].clone()
+        self._stub_types = _schema_stub_types[key]
+        self.models = _schema_models[key]
+        self.templates = {}
+
+        # suds factories aren't safe to use from several threads; requests
+        # built on worker threads copy prototypes made here
+        self.stub('RetrieveRequest')
+
+        # keep-alive connections shared by every thread's client
+        if self.transport is None:
+            self.transport = PooledTransport(ConnectionPool(self.concurrency),
+                                             self.compress)
+        self.client.set_options(transport=self.transport)
+
+        # add WS-Security token.  suds builds the header from the schema's
+        # options, which every clone shares, so the token is added by a
+        # plugin of this client rather than set as its wsse option
         security = Security()
         token = UsernameToken(self.username, self.password)
         security.tokens.append(token)
-        self.client.set_options(wsse=security)
+
+        plugins = [SecurityPlugin(security), TimingPlugin(self.instruments)]
+        if self.compact:
+            plugins.append(CompactPlugin())
+        self.client.set_options(plugins=self.client.options.plugins + plugins)
+        self.owner = threading.current_thread()
+        self.local = threading.local()
         return self.client
 
+    @property
+    def service(self):
+        # drop-in for client.service that runs on the calling thread's client
+        return ServiceProxy(self)
+
+    def thread_client(self):
+        # suds clients keep per-call state, so each worker thread gets its
+        # own clone; the clone shares the schema and the transport
+        if threading.current_thread() is self.owner:
+            return self.client
+
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.client.clone()
+        return client
+
+    def account_limiter(self):
+        # the first instance of an account creates its limiter; later ones
+        # raise its concurrency cap to theirs and may set its rate
+        if self.limiter is None:
+            with _account_limiters_lock:
+                limiter = _account_limiters.get(self.username)
+                if limiter is None:
+                    limiter = RateLimiter(self.rate,
+                                          max_concurrency=self.concurrency)
+                    _account_limiters[self.username] = limiter
+                else:
+                    limiter.extend(self.rate, self.concurrency)
+                self.limiter = limiter
+        return self.limiter
+
+    def limited(self, method, fn, *args):
+        # every SOAP request goes through here: it waits for the account's
+        # limiter, and throttled requests are retried while the limiter's
+        # retry budget lasts; each attempt is recorded by the instruments
+        limiter = self.account_limiter()
+
+        while True:
+            stats = self.instruments.start(method)
+            limiter.acquire()
+            stats.acquired = time.time()
+            try:
+                result = fn(*args)
+            except Exception as e:
+                self.instruments.finish(stats, error=e)
+                outcome = limiter.classify(e)
+                limiter.release(outcome)
+                if outcome == THROTTLED and limiter.retry():
+                    self.log(e, logging.WARNING)
+                    continue
+                raise
+
+            self.instruments.finish(stats, result)
+            limiter.release(OK)
+            return result
+
+    def call(self, method, *args):
+        return self.limited(method,
+                            lambda: getattr(self.thread_client().service,
+                                            method)(*args))
+
+    def call_xml(self, method, *args):
+        # like call(), but returns the raw reply for callers that decode it
+        # themselves; the client is this thread's, so the option is safe
+        def send():
+            client = self.thread_client()
+            client.set_options(retxml=True)
+            try:
+                return getattr(client.service, method)(*args)
+            finally:
+                client.set_options(retxml=False)
+
+        return self.limited(method, send)
+
+    def executor(self):
+        if self.pool is None:
+            self.pool = ThreadPool(self.workers)
+        return self.pool
+
+    def submit(self, method, *args):
+        # returns a multiprocessing AsyncResult; .get() re-raises errors
+        return self.executor().apply_async(self.checked_call,
+                                           (method,) + args)
+
+    def map_calls(self, method, arglist):
+        # fan the calls out over the pool, yielding responses in order
+        return self.executor().imap(lambda args: self.checked_call(method,
+                                                                   *args),
+                                    arglist)
+
+    def checked_call(self, method, *args):
+        try:
+            resp = self.call(method, *args)
+        except suds.WebFault as e:
+            raise SoapError(str(e))
+
+        if resp.OverallStatus != 'OK':
+            self.log(resp, logging.ERROR)
+            raise ExactTargetError(resp.RequestID, resp.Results[0].StatusMessage)
+
+        return resp
+
+    def close(self):
+        if self.pool is not None and not self.shared_pool:
+            self.pool.terminate()
+            self.pool = None
+
+        if isinstance(self.transport, PooledTransport):
+            self.transport.pool.clear()
+
     def add_to_triggered_send_definition(self, tsd_key, email, subscriberkey,
                                          attribs=None):
+        if self.compiled:
+            return self._compiled_triggered_send(tsd_key, email, subscriberkey,
+                                                 attribs)
+
+        ts = self._triggered_send(tsd_key, email, subscriberkey, attribs)
+        co = self.create_options('Synchronous')
+
+        opts = [ts]
+
+        try:
+            resp = self.service.Create(co, opts)
+        except suds.WebFault as e:
+            raise SoapError(str(e))
+
+        if resp.OverallStatus != 'OK':
+            self.log(resp, logging.ERROR)
+            raise ExactTargetError(resp.RequestID, resp.Results[0].StatusMessage)
+
+        return resp.RequestID
+
+    def _triggered_send(self, tsd_key, email, subscriberkey, attribs=None):
         # create a subscriber object
         s = self.client.factory.create('Subscriber')
         s.EmailAddress = email
@@ -84,19 +464,24 @@ class ExactTargetAPI:
         ts = self.client.factory.create('TriggeredSend')
         ts.TriggeredSendDefinition = tsd
         ts.Subscribers = [s]
+        return ts
 
-        co = self.client.factory.create('CreateOptions')
-        co.RequestType = 'Synchronous'
-        co.QueuePriority = 'Medium'
-        so = self.client.factory.create('SaveOption')
-        so.PropertyName = '*'
-        so.SaveAction = 'UpdateAdd'
-        co.SaveOptions = [so]
+    def _compiled_triggered_send(self, tsd_key, email, subscriberkey,
+                                 attribs=None):
+        names = tuple(sorted(attribs)) if attribs else ()
 
-        opts = [ts]
+        def build(t):
+            return (self.create_options('Synchronous'),
+                    [self._triggered_send(t('tsd_key'), t('email'), t('key'),
+                                          dict((k, t('attr:' + k)) for k in names))])
+
+        tpl = self.template(('TriggeredSend', names), 'Create', build)
+        values = {'tsd_key': tsd_key, 'email': email, 'key': subscriberkey}
+        for k in names:
+            values['attr:' + k] = attribs[k]
 
         try:
-            resp = self.client.service.Create(co, opts)
+            resp = self.send_envelope('Create', tpl.fill(values))
         except suds.WebFault as e:
             raise SoapError(str(e))
 
@@ -106,58 +491,299 @@ class ExactTargetAPI:
 
         return resp.RequestID
 
-    def _create_api_property(self, name, value):
-        p = self.client.factory.create('APIProperty')
-        p.Name = name
-        p.Value = value
-        return p
+    def template(self, shape, method, build, repeat=None):
+        # the compiled envelope for a request shape, marshalled by suds the
+        # first time it is needed; build(token) returns the method's args
+        # with token(name) standing in for every value that varies
+        tpl = self.templates.get(shape)
+        if tpl is None:
+            args = build(EnvelopeTemplate.token)
+            tpl = EnvelopeTemplate(self.envelope(method, *args), repeat)
+            self.templates[shape] = tpl
+        return tpl
+
+    def envelope(self, method, *args):
+        # marshal a request exactly as suds would before sending it
+        m = getattr(self.client.service, method).method
+        soapenv = m.binding.input.get_message(m, args, {})
+        plugins = PluginContainer(self.client.options.plugins)
+        plugins.message.marshalled(envelope=soapenv.root())
+        return soapenv.plain()
+
+    def send_envelope(self, method, body, decode=None):
+        # post an already marshalled envelope and parse the reply with suds,
+        # or with decode if given (faults are still raised by suds).  body
+        # may be a function returning the envelope, so that writing a large
+        # one is timed as the request's serialize phase
+        return self.limited(method, self._send_envelope, method, body, decode)
+
+    def _send_envelope(self, method, body, decode=None):
+        if callable(body):
+            body = body()
+
+        client = self.thread_client()
+        m = getattr(client.service, method).method
+        soap = SoapClient(client, m)
+        binding = m.binding.input
+        plugins = PluginContainer(client.options.plugins)
+
+        body = plugins.message.sending(envelope=body).envelope
+        request = Request(soap.location(), body)
+        request.headers = soap.headers()
 
-    def add_to_data_extension(self, de_key, rows):
-        opts = []
-        
-        # convert props to WSDL format
-        for props in rows:
-            apiprops = []
-            for k in props.keys():
-                apiprops.append(self._create_api_property(k, props[k]))
-    
-            # create DE and map in our properties array
-            deo = self.client.factory.create('DataExtensionObject')
-            innerprops = []
-            for p in apiprops:
-                innerprops.append(p)
-                deo.Properties = [{'Property': innerprops}]
-                deo.CustomerKey = de_key
-            
-            opts.append(deo)
-            
-        # createoptions for insertion
+        try:
+            reply = client.options.transport.send(request)
+        except TransportError as e:
+            if e.httpcode in (202, 204):
+                return None
+            return soap.failed(binding, e)
+
+        reply = plugins.message.received(reply=reply.message).reply
+        if decode is not None:
+            return decode(reply)
+        return soap.succeeded(binding, reply)
+
+    def create_options(self, request_type='Synchronous', save_action='UpdateAdd'):
+        # CreateOptions that upsert every property
         co = self.client.factory.create('CreateOptions')
-        co.RequestType = 'Asynchronous'
+        co.RequestType = request_type
         co.QueuePriority = 'Medium'
         so = self.client.factory.create('SaveOption')
         so.PropertyName = '*'
-        so.SaveAction = 'UpdateAdd'
+        so.SaveAction = save_action
         co.SaveOptions = [so]
+        return co
 
-        print self.client.service.Create(co, opts)
+    def retrieve_request(self, objtype, props, filter=None):
+        # filter is a Filter expression or a suds FilterPart
+        if isinstance(filter, Filter):
+            filter = filter.build(self)
 
-    def get_subscriber(self, key):
-        # retrieve a subscriber
         rr = self.client.factory.create('RetrieveRequest')
-        rr.ObjectType = 'Subscriber'
-        rr.Properties = ['ID', 'EmailAddress', 'SubscriberKey',
-                         'UnsubscribedDate', 'Status', 'EmailTypePreference']
+        rr.ObjectType = objtype
+        rr.Properties = props
         rr.Options = None
+        rr.Filter = filter
+        return rr
+
+    def retrieve_where(self, objtype, props, filter=None, more_data=True,
+                       max_in=MAX_IN_VALUES):
+        # yield every objtype matching filter, following pages; IN lists
+        # longer than max_in are split over several Retrieves run on the
+        # worker pool
+        if isinstance(filter, Filter):
+            filters = filter.split(max_in)
+        else:
+            filters = [filter]
+
+        requests = [self.retrieve_request(objtype, props, f) for f in filters]
+        if len(requests) == 1:
+            for r in self._retrieve_all(requests[0], more_data):
+                yield r
+            return
+
+        fetch = lambda rr: list(self._retrieve_all(rr, more_data))
+        for results in self.executor().imap(fetch, requests):
+            for r in results:
+                yield r
+
+    def _retrieve_all(self, rr, more_data=True):
+        for resp in self.retrieve_pages(rr, more_data):
+            if resp.OverallStatus not in ('OK', 'MoreDataAvailable'):
+                self.log(resp, logging.ERROR)
+                raise ExactTargetError(resp.RequestID, resp.Results[0].StatusMessage)
+
+            for r in getattr(resp, 'Results', []):
+                yield r
 
-        sfp = self.client.factory.create('SimpleFilterPart')
-        sfp.Property = 'SubscriberKey'
-        sfp.SimpleOperator = 'equals'
-        sfp.Value = key
-        rr.Filter = sfp
+    def continue_request(self, request_id):
+        # made on paging threads, so from a stub: see init_client
+        return self.stub('RetrieveRequest', ContinueRequest=request_id)
+
+    def _create_api_property(self, name, value):
+        p = self.client.factory.create('APIProperty')
+        p.Name = name
+        p.Value = value
+        return p
+
+    def add_to_data_extension(self, de_key, rows, batch_size=MAX_BATCH_OBJECTS,
+                              max_bytes=MAX_BATCH_BYTES, async=True):
+        # for very large streams iterate upsert_data_extension instead so
+        # the results don't accumulate either
+        return list(self.upsert_data_extension(de_key, rows, batch_size,
+                                               max_bytes, async))
+
+    def upsert_data_extension(self, de_key, rows, batch_size=MAX_BATCH_OBJECTS,
+                              max_bytes=MAX_BATCH_BYTES, async=True):
+        # createoptions for insertion
+        co = self.create_options('Asynchronous' if async else 'Synchronous')
+
+        if self.compiled:
+            # rows go straight into the envelope, no objects are built; the
+            # template for each row's columns is looked up here, on the
+            # calling thread, as compiling one uses the suds factory
+            items = ((self.row_template(de_key, co, props), props)
+                     for props in rows)
+            stream = self._create_stream(co, batches(items, batch_size,
+                                                     max_bytes, item_size),
+                                         self._create_rows_compiled)
+        else:
+            # slots objects serialized straight into the envelope
+            deo = self.models['DataExtensionObject']
+            prop = self.models['APIProperty']
+            objs = (deo(CustomerKey=de_key,
+                        Properties=[prop(Name=k, Value=v)
+                                    for k, v in props.iteritems()])
+                    for props in rows)
+
+            tpl = self.objects_template('Create', 'DataExtensionObject', co,
+                                        (co.RequestType,))
+            send = lambda co, objs: self._send_objects('Create', tpl, objs)
+            stream = self._create_stream(co, batches(objs, batch_size,
+                                                     max_bytes, deo_size),
+                                         send)
+
+        for r in stream:
+            yield r
+
+    def row_template(self, de_key, co, props):
+        # the compiled Create of a row with props' columns
+        cols = tuple(sorted(props))
+        build = lambda t: (co, [self._create_deo(de_key, dict((c, t(c))
+                                                              for c in cols))])
+        return self.template(('DataExtensionObject', de_key, co.RequestType,
+                              cols), 'Create', build, repeat='Objects')
+
+    def _create_rows_compiled(self, co, items):
+        # items are (template, row); every row is rendered from the template
+        # for its set of columns.  They only differ inside the Objects
+        # element, so any one of them supplies the surrounding envelope
+        def render():
+            tpl = items[0][0]
+            out = []
+            tpl.render(tpl.head, {}, out)
+            for t, props in items:
+                t.render(t.item, props, out)
+            tpl.render(tpl.tail, {}, out)
+            return ''.join(out)
 
         try:
-            resp = self.client.service.Retrieve(rr)
+            resp = self.send_envelope('Create', render)
+        except suds.WebFault as e:
+            raise SoapError(str(e))
+
+        if resp.OverallStatus != 'OK':
+            self.log(resp, logging.ERROR)
+
+        return resp
+
+    def objects_template(self, method, objtype, options, shape):
+        # envelope for method calls on a list of objects, written in by
+        # _send_objects; shape identifies the options.  Built on the calling
+        # thread, suds factories aren't shared safely
+        build = lambda t: (options, [self.stub(objtype, CustomerKey=t('key'))])
+        return self.template(('objects', method, objtype) + shape, method,
+                             build, repeat='Objects')
+
+    def _send_objects(self, method, tpl, objs, decode=None):
+        # send model objects (see ObjectModel) without going through suds
+        # marshalling; the reply is parsed by suds unless decode is given
+        def render():
+            out = []
+            tpl.render(tpl.head, {}, out)
+            for obj in objs:
+                self.models.serialize(obj, 'Objects', tpl.prefix,
+                                      tpl.type_prefix, out)
+            tpl.render(tpl.tail, {}, out)
+            return ''.join(out)
+
+        try:
+            resp = self.send_envelope(method, render, decode)
+        except suds.WebFault as e:
+            raise SoapError(str(e))
+
+        if resp.OverallStatus != 'OK':
+            self.log(resp, logging.ERROR)
+
+        return resp
+
+    def _create_deo(self, de_key, props):
+        # convert props to WSDL format
+        deo = self.client.factory.create('DataExtensionObject')
+        deo.CustomerKey = de_key
+        deo.Properties = [{'Property': [{'Name': k, 'Value': v}
+                                        for k, v in props.iteritems()]}]
+        return deo
+
+    def _create_stream(self, co, batches, send=None, errors=False):
+        # Create up to workers batches concurrently while the next one is
+        # being built, so memory stays bounded by the pipeline depth.  With
+        # errors, a batch that fails is reported as an Error result for each
+        # of its objects instead of raised
+        send = send or self._create_batch
+        pending = collections.deque()
+        offset = 0
+
+        for batch in batches:
+            sent = self.executor().apply_async(send, (co, batch))
+            pending.append((sent, offset, len(batch)))
+            offset += len(batch)
+
+            if len(pending) > self.workers:
+                for r in self._batch_results(*pending.popleft(),
+                                             errors=errors):
+                    yield r
+
+        while pending:
+            for r in self._batch_results(*pending.popleft(), errors=errors):
+                yield r
+
+    def _create_batch(self, co, objs):
+        try:
+            resp = self.service.Create(co, objs)
+        except suds.WebFault as e:
+            raise SoapError(str(e))
+
+        if resp.OverallStatus != 'OK':
+            self.log(resp, logging.ERROR)
+
+        return resp
+
+    def _batch_results(self, sent, offset, count, errors=False):
+        try:
+            resp = sent.get()
+        except Exception as e:
+            if not errors:
+                raise
+            for i in range(count):
+                yield ObjectResult(offset + i, 'Error', str(e))
+            return
+
+        results = getattr(resp, 'Results', [])
+
+        for i, r in enumerate(results):
+            # results come back in request order unless they say otherwise
+            ordinal = getattr(r, 'OrdinalID', None)
+            if ordinal is None:
+                ordinal = i
+
+            yield ObjectResult(offset + ordinal, r.StatusCode,
+                               getattr(r, 'StatusMessage', None),
+                               getattr(r, 'ErrorCode', None),
+                               getattr(r, 'NewID', None), resp.RequestID)
+
+    def get_subscriber(self, key, filter=None):
+        # retrieve a subscriber, or with filter one that also matches it
+        props = ['ID', 'EmailAddress', 'SubscriberKey', 'UnsubscribedDate',
+                 'Status', 'EmailTypePreference']
+        try:
+            if filter is None:
+                resp = self.retrieve_equals('Subscriber', props,
+                                            'SubscriberKey', key)
+            else:
+                resp = self.service.Retrieve(self.retrieve_request(
+                    'Subscriber', props,
+                    (Field('SubscriberKey') == key) & filter))
         except suds.WebFault as e:
             raise SoapError(str(e))
 
@@ -183,6 +809,25 @@ class ExactTargetAPI:
         
         return obj
     
+    def model(self, objtype, **values):
+        # an objtype from the generated object model: plain slots, no suds
+        # metadata, the cheapest way to build objects for the bulk calls
+        return self.models[objtype](**values)
+
+    def stub(self, objtype, **values):
+        # a bare object of objtype holding only the given values; unlike
+        # create() it doesn't build every schema field, which makes it
+        # cheap enough to use once per row in bulk calls
+        proto = self._stub_types.get(objtype)
+        if proto is None:
+            proto = self._stub_types[objtype] = self.client.factory.create(objtype)
+
+        obj = proto.__class__()
+        obj.__metadata__.sxtype = proto.__metadata__.sxtype
+        for k, v in values.iteritems():
+            setattr(obj, k, v)
+        return obj
+
     def _deo_to_list(self, resp):
         results = []
         
@@ -199,55 +844,110 @@ class ExactTargetAPI:
             
         return results
     
-    def get_data_extension(self, de_key, cols, start_date=None, start_date_field=None, more_data=True):
-        rr = self.client.factory.create('RetrieveRequest')
-        rr.ObjectType = 'DataExtensionObject[' + de_key + ']'
-        rr.Properties = cols
-        rr.Options = None
-        
-        if start_date is not None and start_date_field is not None:
-            sfp = self.client.factory.create('SimpleFilterPart')
-            sfp.Property = start_date_field
-            sfp.SimpleOperator = 'greaterThanOrEqual'
-            sfp.Value = start_date
-            rr.Filter = sfp
-        
-        while True:
+    def get_data_extension(self, de_key, cols, start_date=None, start_date_field=None, more_data=True,
+                           prefetch=0, retries=5, backoff=1.0, metrics=None,
+                           row_format=None, filter=None):
+        rr = self.retrieve_request('DataExtensionObject[' + de_key + ']', cols,
+                                   self.date_filter(start_date_field,
+                                                    start_date, filter))
+
+        if row_format is None:
+            pages = (self._deo_to_list(resp) for resp in
+                     self.retrieve_pages(rr, more_data, retries, backoff,
+                                         metrics))
+        else:
+            # skip suds objects and decode the reply straight into rows
+            decoder = RowDecoder(cols, row_format)
+            pages = (resp.Results for resp in
+                     self.retrieve_pages(rr, more_data, retries, backoff,
+                                         metrics, decoder.decode))
+
+        # fetch up to prefetch pages ahead while the caller works
+        if prefetch:
+            pages = prefetched(pages, prefetch)
+
+        for page in pages:
+            yield page
+
+    def retrieve_pages(self, rr, more_data=True, retries=5, backoff=1.0,
+                       metrics=None, decode=None):
+        # yield each Retrieve response, following MoreDataAvailable; faults
+        # are retried with exponential backoff until the budget runs out.
+        # With decode, the raw reply is handed to it instead of suds
+        while rr is not None:
+            start = time.time()
+
             try:
-                resp = self.client.service.Retrieve(rr)
-                yield self._deo_to_list(resp)
-            except suds.WebFault:
+                if decode is None:
+                    resp = self.service.Retrieve(rr)
+                else:
+                    resp = decode(self.call_xml('Retrieve', rr))
+            except suds.WebFault as e:
+                if retries <= 0:
+                    raise SoapError(str(e))
+
+                self.log(e, logging.WARNING)
+                time.sleep(backoff)
+                retries -= 1
+                backoff = min(backoff * 2, MAX_BACKOFF)
                 continue
-            break
 
-        if more_data:
-            while resp.OverallStatus == 'MoreDataAvailable':
-                rr = self.client.factory.create('RetrieveRequest')
-                rr.ContinueRequest = resp.RequestID
-                
-                while True:
-                    try:
-                        resp = self.client.service.Retrieve(rr)
-                        yield self._deo_to_list(resp)
-                    except suds.WebFault:
-                        continue
-                    break
-                
-    def get_object(self, objtype, props):
-        rr = self.create('RetrieveRequest')
-        rr.ObjectType = objtype
-        rr.Properties = props
-        
-        try:
-            resp = self.client.service.Retrieve(rr)
-        except suds.WebFault as e:
-            raise SoapError(str(e))
-        
-        if resp.OverallStatus != 'OK':
-            self.log(resp, logging.ERROR)
-            raise ExactTargetError(resp.RequestID, resp.Results[0].StatusMessage)
-        
-        return resp.Results
+            if metrics is not None:
+                metrics.record(time.time() - start,
+                               len(getattr(resp, 'Results', [])))
+
+            yield resp
+
+            if more_data and resp.OverallStatus == 'MoreDataAvailable':
+                rr = self.continue_request(resp.RequestID)
+            else:
+                rr = None
+
+    def date_filter(self, field, start_date, filter=None):
+        # rows changed since start_date and matching filter, if given
+        if start_date is None or field is None:
+            return filter
+
+        since = Field(field) >= start_date
+        if filter is None:
+            return since
+        return since & filter
+
+    def get_object(self, objtype, props, filter=None):
+        # every matching object as suds objects, all pages; for large
+        # enumerations iterate iter_objects instead
+        return list(self.retrieve_where(objtype, props, filter))
+
+    def iter_objects(self, objtype, props, filter=None, more_data=True,
+                     prefetch=0, row_format='record', max_in=MAX_IN_VALUES):
+        # lazily yield every objtype matching filter as a lightweight row
+        # holding just props (see ObjectDecoder), fetching a page at a time
+        # and up to prefetch pages ahead
+        if isinstance(filter, Filter):
+            filters = filter.split(max_in)
+        else:
+            filters = [filter]
+
+        # built up front, the pages may be fetched on another thread
+        requests = [self.retrieve_request(objtype, props, f) for f in filters]
+        decoder = ObjectDecoder(props, row_format)
+
+        def pages():
+            for rr in requests:
+                for page in self.retrieve_pages(rr, more_data,
+                                                decode=decoder.decode):
+                    if page.OverallStatus not in ('OK', 'MoreDataAvailable'):
+                        raise ExactTargetError(page.RequestID,
+                                               page.OverallStatus)
+                    yield page.Results
+
+        rows = pages()
+        if prefetch:
+            rows = prefetched(rows, prefetch)
+
+        for page in rows:
+            for row in page:
+                yield row
     
     def strip_object(self, obj):
         id_list = ['ObjectID', 'ID', 'CustomerKey']
@@ -258,24 +958,118 @@ class ExactTargetAPI:
                     
         return obj
     
-    def delete_objects(self, objs):
-        for o in objs:
-            self.strip_object(o)
+    def delete_objects(self, objs, batch_size=MAX_BATCH_OBJECTS):
+        # the objects are left as they are; the first failure is raised
+        for r in self.delete_many(objs, batch_size=batch_size):
+            if not r.ok:
+                raise ExactTargetError(r.request_id, r.message)
 
-        try:
-            resp = self.client.service.Delete(None, objs)
-        except suds.WebFault as e:
-            raise SoapError(str(e))
-        
-        if resp.OverallStatus != 'OK':
-            self.log(resp, logging.ERROR)
-            raise ExactTargetError(resp.RequestID, resp.Results[0].StatusMessage)
-        
         return True
-    
+
+    def delete_many(self, items, objtype=None, key_field='CustomerKey',
+                    batch_size=MAX_BATCH_OBJECTS, errors=False):
+        # Delete a stream of suds objects, or of keys of objtype in
+        # key_field, in batches sent concurrently.  Only each object's
+        # identifying fields are sent.  Returns a list of ObjectResults,
+        # one per item in the order given.  Objects the server refused are
+        # reported there; a batch that failed as a whole raises SoapError,
+        # or with errors is reported as an Error result for each object.
+        stubs = (self.key_stub(item, objtype, key_field)[1] for item in items)
+        return self._write_many('Delete', stubs, batch_size, errors)
+
+    def update_many(self, items, objtype=None, key_field='CustomerKey',
+                    batch_size=MAX_BATCH_OBJECTS, errors=False):
+        # Update a stream of suds objects (sent as they are) or of
+        # (key, {field: value}) pairs for objtype, e.g.
+        #   api.update_many(((k, {'TriggeredSendStatus': 'Inactive'})
+        #                    for k in tsd_keys), 'TriggeredSendDefinition')
+        # Returns a list of ObjectResults as for delete_many.
+        def stubs():
+            for item in items:
+                if isinstance(item, tuple):
+                    key, values = item
+                    item = self.stub(objtype, **values)
+                    setattr(item, key_field, key)
+                yield item
+
+        return self._write_many('Update', stubs(), batch_size, errors)
+
+    def delete_rows(self, de_key, keys, key_field=None,
+                    batch_size=MAX_BATCH_OBJECTS, errors=False):
+        # Delete data extension rows by primary key: keys are
+        # {column: value} dicts, or values of key_field.  Returns a list of
+        # ObjectResults as for delete_many.
+        def stubs():
+            for key in keys:
+                if key_field is not None:
+                    key = {key_field: key}
+                yield self.stub('DataExtensionObject', CustomerKey=de_key,
+                                Keys={'Key': [{'Name': k, 'Value': v}
+                                              for k, v in key.iteritems()]})
+
+        return self._write_many('Delete', stubs(), batch_size, errors)
+
+    def key_stub(self, item, objtype=None, key_field='CustomerKey'):
+        # (key, stub holding only the identifying fields) for a suds object,
+        # or for a key of objtype
+        if not hasattr(item, '__metadata__'):
+            return item, self.stub(objtype, **{key_field: item})
+
+        values = dict((k, getattr(item, k)) for k in KEY_FIELDS
+                      if getattr(item, k, None) is not None)
+        return self.object_key(item), self.stub(item.__class__.__name__,
+                                                **values)
+
+    def object_key(self, obj):
+        for k in KEY_FIELDS:
+            value = getattr(obj, k, None)
+            if value is not None:
+                return value
+        return None
+
+    def _write_many(self, method, stubs, batch_size, errors=False):
+        # the stubs are serialized directly (see ObjectModel) and the
+        # replies read by a ResultDecoder on the worker threads; suds
+        # marshalling and unmarshalling would hold the GIL for most of a
+        # batch and keep the requests from overlapping.  Any template of the
+        # method will do for a batch, only its Objects differ
+        templates = {}
+        count = [0]
+        decoder = ResultDecoder()
+        send = lambda co, objs: self._send_objects(
+            method, templates[objs[0].__class__.__name__], objs,
+            decoder.decode)
+
+        def tracked():
+            # templates are built here, on the calling thread; their types
+            # are the ones whose cached lookups are dropped afterwards
+            for stub in stubs:
+                objtype = stub.__class__.__name__
+                if objtype not in templates:
+                    templates[objtype] = self.objects_template(method,
+                                                               objtype, None,
+                                                               ())
+                count[0] += 1
+                yield stub
+
+        results = {}
+        try:
+            for r in self._create_stream(None, batches(tracked(), batch_size),
+                                         send, errors=errors):
+                results[r.index] = r
+        finally:
+            for objtype in templates:
+                self.invalidate(objtype)
+
+        # objects the responses didn't mention
+        return [results.get(i) or ObjectResult(i, 'Error', 'no result')
+                for i in range(count[0])]
+
     def update_object(self, obj):
+        self.invalidate(obj.__class__.__name__)
+
         try:
-            resp = self.client.service.Update(None, obj)
+            resp = self.service.Update(None, obj)
         except suds.WebFault as e:
             raise SoapError(str(e))
         
@@ -301,7 +1095,7 @@ class ExactTargetAPI:
             email.TextBody = body
             
         try:
-            resp = self.client.service.Create(None, [email])
+            resp = self.service.Create(None, [email])
         except suds.WebFault as e:
             raise SoapError(str(e))
 
@@ -333,7 +1127,7 @@ class ExactTargetAPI:
         tsd.SendSourceDataExtension = self.strip_object(de)
         
         try:
-            resp = self.client.service.Create(None, [tsd])
+            resp = self.service.Create(None, [tsd])
         except suds.WebFault as e:
             raise SoapError(str(e))
 
@@ -364,11 +1158,15 @@ class ExactTargetAPI:
         
         # TriggeredSendDataExtension
         if template is not None:
-            for o in self.get_object('DataExtensionTemplate', ['Name', 'ObjectID']):
-                if o.Name == template:
-                    de.Template = o
-                    sender_field = 'SubscriberKey'
-                    break
+            found = self.cached(('DataExtensionTemplate', 'Name', template),
+                                lambda: next(self.iter_objects('DataExtensionTemplate',
+                                                               ['ObjectID', 'Name'],
+                                                               Field('Name') == template),
+                                             None))
+            if found is not None:
+                de.Template = self.stub('DataExtensionTemplate',
+                                        ObjectID=found.ObjectID)
+                sender_field = 'SubscriberKey'
         
         de.CategoryID = folder
         
@@ -383,7 +1181,7 @@ class ExactTargetAPI:
         de.Fields = {'Field': de_fields}
 
         try:
-            resp = self.client.service.Create(None, [de])
+            resp = self.service.Create(None, [de])
         except suds.WebFault as e:
             raise SoapError(str(e))
 
@@ -416,18 +1214,12 @@ class ExactTargetAPI:
                 sl.Status = 'Active'
                 s.Lists = [sl]
 
-        co = self.client.factory.create('CreateOptions')
-        co.RequestType = 'Synchronous'
-        co.QueuePriority = 'Medium'
-        so = self.client.factory.create('SaveOption')
-        so.PropertyName = '*'
-        so.SaveAction = 'UpdateAdd'
-        co.SaveOptions = [so]
+        co = self.create_options('Synchronous')
 
         opts = [s]
 
         try:
-            resp = self.client.service.Create(co, opts)
+            resp = self.service.Create(co, opts)
         except suds.WebFault as e:
             raise SoapError(str(e))
 
@@ -439,31 +1231,12 @@ class ExactTargetAPI:
 
     def get_subscriber_list(self, listname, create_if_not_exists=False):
         # retrieve a subscriber list
-        rr = self.client.factory.create('RetrieveRequest')
-        rr.ObjectType = 'List'
-        rr.Properties = ['ID', 'ListName', 'Description', 'Type',
-                         'ListClassification']
-        rr.Options = None
+        l = self.lookup('List', 'ListName', listname,
+                        ['ID', 'ListName', 'Description', 'Type',
+                         'ListClassification'])
 
-        sfp = self.client.factory.create('SimpleFilterPart')
-        sfp.Property = 'ListName'
-        sfp.SimpleOperator = 'equals'
-        sfp.Value = listname
-        rr.Filter = sfp
-
-        try:
-            resp = self.client.service.Retrieve(rr)
-        except suds.WebFault as e:
-            raise SoapError(str(e))
-
-        if resp.OverallStatus != 'OK':
-            self.log(resp, logging.ERROR)
-            raise ExactTargetError(resp.RequestID, resp.Results[0].StatusMessage)
-
-        try:
-            return resp.Results[0]
-        except AttributeError:
-            pass
+        if l is not None:
+            return l
 
         # create the subscriber list
         if create_if_not_exists == True:
@@ -471,55 +1244,170 @@ class ExactTargetAPI:
         else:
             return None
 
-    def add_subscribers_to_list(self, subs, async=True):
-        sublist = self.create('SubscriberList')
-        sublist.Action = 'create'
-        
-        objs = []
-        
-        for subscribers in subs:
-            sublist.ID = subscribers[0]
-            
-            for email in subscribers[1]:
-                sub = self.create('Subscriber')
-                sub.SubscriberKey = email
-                sub.EmailAddress = email
-                sub.Lists = [sublist]
-                objs.append(sub)
-        
-        uo = self.create('UpdateOptions')
-        if async:
-            uo.RequestType = 'Asynchronous'
-        
-        for obj in chunks(objs, 400):
+    def get_send_classification(self, key):
+        return self.lookup('SendClassification', 'CustomerKey', key,
+                           ['ObjectID', 'CustomerKey', 'Name'])
+
+    def get_folder(self, name):
+        return self.lookup('DataFolder', 'Name', name,
+                           ['ID', 'Name', 'ContentType', 'CustomerKey'])
+
+    def lookup(self, objtype, prop, value, props):
+        # first objtype whose prop equals value, cached; misses aren't
+        # cached so objects created elsewhere show up on the next call
+        def fetch():
             try:
-                resp = self.client.service.Create(None, obj)
+                resp = self.retrieve_equals(objtype, props, prop, value)
             except suds.WebFault as e:
                 raise SoapError(str(e))
-            
-            if resp.OverallStatus != 'OK':
+
+            if resp.OverallStatus not in ('OK', 'MoreDataAvailable'):
                 self.log(resp, logging.ERROR)
                 raise ExactTargetError(resp.RequestID, resp.Results[0].StatusMessage)
 
+            try:
+                return resp.Results[0]
+            except AttributeError:
+                return None
+
+        return self.cached((objtype, prop, value), fetch)
+
+    def retrieve_equals(self, objtype, props, prop, value):
+        # Retrieve objtype where prop equals value, from a compiled envelope
+        # when enabled
+        if not self.compiled:
+            return self.service.Retrieve(self.retrieve_request(
+                objtype, props, self.create_filter(prop, 'equals', value)))
+
+        build = lambda t: (self.retrieve_request(objtype, props,
+                                                 self.create_filter(prop, 'equals',
+                                                                    t('value'))),)
+        tpl = self.template(('Retrieve', objtype, tuple(props), prop), 'Retrieve',
+                            build)
+        return self.send_envelope('Retrieve', tpl.fill({'value': value}))
+
+    def cached(self, key, fetch):
+        # callers get a copy: the cached object changed by one of them, as
+        # by strip_object, would otherwise change for every later caller
+        value = self.lookups.get(key)
+        if value is None:
+            value = fetch()
+            if value is not None:
+                self.lookups.put(key, value)
+        return copy_object(value)
+
+    def invalidate(self, objtype=None):
+        # drop cached lookups after objects of objtype (or anything) change
+        self.lookups.invalidate(objtype)
+
+    def add_subscribers_to_list(self, subs, async=True):
+        def records():
+            for list_id, emails in subs:
+                sublist = self.model('SubscriberList', ID=list_id,
+                                     Action='create')
+
+                for email in emails:
+                    yield {'email': email, 'lists': [sublist]}
+
+        results = []
+        for r in self.upsert_subscribers(records(), async=async):
+            if not r.ok:
+                raise ExactTargetError(r.request_id, r.message)
+            results.append(r)
+
+        return results
+
+    def upsert_subscribers(self, records, async=False,
+                           batch_size=MAX_SUBSCRIBER_BATCH,
+                           max_bytes=MAX_BATCH_BYTES):
+        # records are dicts with an 'email' and optionally 'key'
+        # (SubscriberKey, defaults to the email), 'status', 'attributes'
+        # ({name: value}) and 'lists' (list IDs, list names or
+        # SubscriberList objects).  Yields one ObjectResult per record; a
+        # record naming a list that doesn't exist isn't sent and gets an
+        # Error result.
+        co = self.create_options('Asynchronous' if async else 'Synchronous')
+
+        # records left out, and for each the number sent before it, to map
+        # the index of a sent object back to its record
+        failed = []
+        gaps = []
+
+        def objs():
+            for i, record in enumerate(records):
+                try:
+                    s = self._create_subscriber_obj(record)
+                except ExactTargetError as e:
+                    gaps.append(i - len(failed))
+                    failed.append(ObjectResult(i, 'Error', e.message))
+                    continue
+                yield s
+
+        tpl = self.objects_template('Create', 'Subscriber', co,
+                                    (co.RequestType,))
+        send = lambda co, objs: self._send_objects('Create', tpl, objs)
+        done = 0
+        for r in self._create_stream(co, batches(objs(), batch_size,
+                                                 max_bytes, subscriber_size),
+                                     send):
+            r.index += bisect_right(gaps, r.index)
+            while done < len(failed) and failed[done].index < r.index:
+                yield failed[done]
+                done += 1
+            yield r
+
+        for r in failed[done:]:
+            yield r
+
+    def _create_subscriber_obj(self, record):
+        s = self.model('Subscriber', EmailAddress=record['email'],
+                       SubscriberKey=record.get('key', record['email']))
+
+        if 'status' in record:
+            s.Status = record['status']
+
+        attribs = record.get('attributes')
+        if attribs:
+            attribute = self.models['Attribute']
+            s.Attributes = [attribute(Name=k, Value=v)
+                            for k, v in attribs.iteritems()]
+
+        lists = []
+        for l in record.get('lists', ()):
+            if isinstance(l, basestring):
+                found = self.get_subscriber_list(l)
+                if found is None:
+                    raise ExactTargetError(None, 'no list named %r' % l)
+                l = found.ID
+
+            # suds objects are serialized too
+            if not isinstance(l, SchemaObject) and not hasattr(l, '__metadata__'):
+                l = self.model('SubscriberList', ID=l, Status='Active')
+
+            lists.append(l)
+
+        if lists:
+            s.Lists = lists
+
+        return s
+
     def create_subscriber_lists(self, lists, folder=0):
         objs = []
-        
+
         for li in lists:
-            l = self.create('List')
-            
+            l = self.model('List', CustomerKey=li['key'], ListName=li['name'],
+                           Description=li['description'])
+
             if folder > 0:
                 l.Category = folder
-            
-            l.CustomerKey = li['key']
-            l.ListName = li['name']
-            l.Description = li['description']
-            
+
             objs.append(l)
 
-        try:
-            resp = self.client.service.Create(None, objs)
-        except suds.WebFault as e:
-            raise SoapError(str(e))
+        resp = self._send_objects('Create',
+                                  self.objects_template('Create', 'List',
+                                                        None, ()),
+                                  objs)
+        self.invalidate('List')
 
         if resp.OverallStatus != 'OK':
             self.log(resp, logging.ERROR)
@@ -531,48 +1419,36 @@ class ExactTargetAPI:
             
             return list_obs
 
-    def get_email_receivers(self, jobid):
-        # retrieve all users who received this email
-        rr = self.client.factory.create('RetrieveRequest')
-        rr.ObjectType = 'SentEvent'
-        rr.Properties = ['SendID', 'EventDate', 'SubscriberKey']
-        rr.Options = None
+    def get_email_receivers(self, jobid, filter=None):
+        # retrieve a user who received this email, or None; see
+        # get_all_email_receivers for the rest
+        return next(self._email_receivers(jobid, filter, False), None)
 
-        sfp = self.client.factory.create('SimpleFilterPart')
-        sfp.Property = 'SendID'
-        sfp.SimpleOperator = 'equals'
-        sfp.Value = jobid
-        rr.Filter = sfp
+    def get_all_email_receivers(self, jobid, filter=None):
+        # retrieve all users who received this email, every page of them;
+        # for many sends use ettracking.EventExtractor
+        return list(self._email_receivers(jobid, filter))
 
-        try:
-            resp = self.client.service.Retrieve(rr)
-        except suds.WebFault as e:
-            raise SoapError(str(e))
+    def _email_receivers(self, jobid, filter=None, more_data=True):
+        where = Field('SendID') == jobid
+        if filter is not None:
+            where = where & filter
 
-        if resp.OverallStatus != 'OK':
-            self.log(resp, logging.ERROR)
-            raise ExactTargetError(resp.RequestID, resp.Results[0].StatusMessage)
-
-        try:
-            return resp.Results[0]
-        except AttributeError:
-            pass
+        return self.retrieve_where('SentEvent',
+                                   ['SendID', 'EventDate', 'SubscriberKey'],
+                                   where, more_data)
 
-    def get_email_stats(self, jobid):
+    def get_email_stats(self, jobid, filter=None):
         # retrieve stats on a single email send
-        rr = self.client.factory.create('RetrieveRequest')
-        rr.ObjectType = 'Send'
-        rr.Properties = ['SentDate', 'UniqueOpens', 'NumberSent', 'NumberDelivered', 'HardBounces', 'SoftBounces']
-        rr.Options = None
+        where = Field('ID') == jobid
+        if filter is not None:
+            where = where & filter
 
-        sfp = self.client.factory.create('SimpleFilterPart')
-        sfp.Property = 'ID'
-        sfp.SimpleOperator = 'equals'
-        sfp.Value = jobid
-        rr.Filter = sfp
+        rr = self.retrieve_request('Send', ['SentDate', 'UniqueOpens', 'NumberSent', 'NumberDelivered', 'HardBounces', 'SoftBounces'],
+                                   where)
 
         try:
-            resp = self.client.service.Retrieve(rr)
+            resp = self.service.Retrieve(rr)
         except suds.WebFault as e:
             raise SoapError(str(e))
 
@@ -596,24 +1472,14 @@ class ExactTargetAPI:
         fd = self.create('FilterDefinition', key)
         fd.Name = name
         fd.Description = description
-        filter_len = len(filters)
-        
-        if filter_len is 1:
-            fd.DataFilter = self.create_filter(*filters[0])
-        else:
-            cfp = self.create('SimpleFilterPart')
-            cfp.LeftOperand = self.create_filter(*filters[0])
-            cfp.LogicalOperator = operator
-            cfp.RightOperand = self.create_filter(*filters[1])
-            
-            if filter_len > 2:
-                cfp.AdditionalOperands = []
-                for f in filters[2:]:
-                    cfp.AdditionalOperands.append(self.create_filter(*f))
-                    
-            fd.DataFilter = cfp
-            
-        self.client.service.Create(None, fd)
+
+        # filters is a Filter expression, or (prop, operator, value) tuples
+        # joined by operator
+        if not isinstance(filters, Filter):
+            filters = Logical(operator, [Condition(p, op, v) for p, op, v in filters])
+
+        fd.DataFilter = filters.build(self)
+        self.service.Create(None, fd)
 
     def start_tsd(self, tsd):
         tsd.TriggeredSendStatus = 'Active'
@@ -623,20 +1489,32 @@ class ExactTargetAPI:
         tsd.TriggeredSendStatus = 'Inactive'
         self.update_object(tsd)
 
-    def run_import(self, key):
-        im = self.create('ImportDefinition')
-        im.CustomerKey = key
-        
+    def run_import(self, key, **settings):
+        # start the import; returns its task ID, see etjobs.JobTracker.
+        # settings such as FileSpec are saved to the definition first
+        if settings:
+            self.update_object(self.stub('ImportDefinition', CustomerKey=key,
+                                         **settings))
+
+        # built from stubs, as imports are started from loader threads
+        im = self.stub('ImportDefinition', CustomerKey=key)
+
         objs = {'Definition': [im,]}
-        
+
         try:
-            resp = self.client.service.Perform(self.create('PerformOptions'), 'start', objs)
+            resp = self.service.Perform(self.stub('PerformOptions'), 'start',
+                                        objs)
         except suds.WebFault as e:
             raise SoapError(str(e))
 
         if resp.OverallStatus != 'OK':
             self.log(resp, logging.ERROR)
-            raise ExactTargetError(resp.RequestID, resp.Results[0].StatusMessage)
+            raise ExactTargetError(resp.RequestID, resp.OverallStatusMessage)
+
+        try:
+            return resp.Results.Result[0].Task.ID
+        except (AttributeError, IndexError):
+            return None
 
 class ExactTargetError(Exception):
     def __init__(self, request_id, message):
@@ -653,6 +1531,1730 @@ class ExactTargetError(Exception):
 class SoapError(Exception):
     pass
 
+
+class RateLimiter(object):
+    # Token bucket (rate requests per second, up to burst at once) plus an
+    # adaptive in-flight limit: it grows by one after each limit's worth of
+    # successes and halves, at most once per cooldown, on throttling or
+    # server faults.  Throttling also pauses new requests with a growing
+    # backoff.  Retries draw on a budget earned by successful requests, so a
+    # struggling endpoint sees fewer retries rather than a retry storm.
+
+    def __init__(self, rate=None, burst=None, max_concurrency=8,
+                 min_concurrency=1, cooldown=1.0, retry_ratio=0.1,
+                 max_retries=10):
+        self.rate = rate
+        self.burst = burst or max(1, rate or 1)
+        self.tokens = self.burst
+        self.stamp = time.time()
+        self.lock = threading.Lock()
+
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = max_concurrency
+        self.active = 0
+        self.successes = 0
+        self.cond = threading.Condition()
+
+        self.cooldown = cooldown
+        self.backoff = cooldown
+        self.paused_until = 0
+        self.decreased_at = 0
+
+        self.retry_ratio = retry_ratio
+        self.max_retries = max_retries
+        self.retry_budget = max_retries
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                wait = self.paused_until - time.time()
+                if wait <= 0 and self.active < self.limit:
+                    break
+                self.cond.wait(wait if wait > 0 else None)
+            self.active += 1
+
+        self.take()
+
+    def try_acquire(self, poll=0.01):
+        # acquire() for event loops, which mustn't block: 0 once a slot and
+        # a token are taken, otherwise about how many seconds to wait
+        # before trying again
+        with self.cond:
+            wait = self.paused_until - time.time()
+            if wait > 0:
+                return wait
+            if self.active >= self.limit:
+                return poll
+
+            wait = self.next_token()
+            if wait <= 0:
+                self.active += 1
+            return wait
+
+    def take(self):
+        # one token from the bucket, sleeping until it refills
+        while True:
+            wait = self.next_token()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def next_token(self):
+        # take a token if there is one and return 0, else the seconds until
+        # the bucket refills
+        if self.rate is None:
+            return 0
+
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def release(self, outcome=None):
+        outcome = outcome or OK
+        now = time.time()
+
+        with self.cond:
+            self.active -= 1
+
+            if outcome == OK:
+                self.backoff = self.cooldown
+                self.retry_budget = min(self.max_retries,
+                                        self.retry_budget + self.retry_ratio)
+                self.successes += 1
+                if self.successes >= self.limit:
+                    self.successes = 0
+                    self.limit = min(self.max_concurrency, self.limit + 1)
+            else:
+                if now - self.decreased_at >= self.cooldown:
+                    self.decreased_at = now
+                    self.successes = 0
+                    self.limit = max(self.min_concurrency, self.limit // 2)
+
+                if outcome == THROTTLED:
+                    self.paused_until = max(self.paused_until,
+                                            now + self.backoff)
+                    self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+
+            self.cond.notify_all()
+
+    def extend(self, rate=None, max_concurrency=None):
+        # take on the settings of another user of the limiter: the larger
+        # concurrency cap, and a rate if none was set; two different rates
+        # for one account are a configuration error
+        if rate is not None and self.rate is not None and rate != self.rate:
+            raise ValueError('rate %s conflicts with the account rate %s'
+                             % (rate, self.rate))
+
+        if rate is not None and self.rate is None:
+            with self.lock:
+                self.rate = rate
+                self.burst = max(1, rate)
+                self.tokens = min(self.tokens, self.burst)
+                self.stamp = time.time()
+
+        with self.cond:
+            if max_concurrency > self.max_concurrency:
+                self.limit += max_concurrency - self.max_concurrency
+                self.max_concurrency = max_concurrency
+                self.cond.notify_all()
+
+    def retry(self):
+        # spend one retry from the budget, if there is one
+        with self.cond:
+            if self.retry_budget >= 1:
+                self.retry_budget -= 1
+                return True
+            return False
+
+    def classify(self, error):
+        # OK, THROTTLED (the server asked us to slow down) or FAULT
+        status = getattr(error, 'httpcode', None)
+        if status is None and error.args and isinstance(error.args[0], tuple):
+            status = error.args[0][0]
+        if status in (429, 503):
+            return THROTTLED
+
+        text = str(error).lower()
+        if any(marker in text for marker in THROTTLE_MARKERS):
+            return THROTTLED
+
+        return FAULT
+
+
+class FileRateLimiter(RateLimiter):
+    # A RateLimiter whose token bucket lives in a file, so every process on
+    # the host using the same path shares one request rate.  The adaptive
+    # concurrency limit stays per process.
+
+    def __init__(self, path, rate, burst=None, **kwargs):
+        RateLimiter.__init__(self, rate, burst, **kwargs)
+        self.path = path
+
+    def next_token(self):
+        with self.lock:
+            return self.take_shared()
+
+    def take_shared(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            now = time.time()
+
+            try:
+                tokens, stamp = [float(v) for v in os.read(fd, 64).split()]
+            except ValueError:
+                tokens, stamp = self.burst, now
+
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, '%r %r' % (tokens, now))
+            return wait
+        finally:
+            os.close(fd)
+
+
+class RequestStats(object):
+    # One SOAP request as seen by Instrumentation.  The phases, in seconds:
+    # wait (for the rate limiter), build (suds marshalling the objects),
+    # serialize (rendering the envelope), network (send to first reply
+    # byte read) and parse (suds unmarshalling the reply).  A phase that
+    # didn't happen, e.g. parsing after a transport error, is None.
+    __slots__ = ('method', 'started', 'acquired', 'marshalled', 'sending',
+                 'received', 'finished', 'request_bytes', 'response_bytes',
+                 'objects', 'request_id', 'status', 'error')
+
+    def __init__(self, method):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.method = method
+        self.started = time.time()
+
+    def span(self, start, end):
+        if start is None or end is None:
+            return None
+        return end - start
+
+    @property
+    def wait(self):
+        return self.span(self.started, self.acquired)
+
+    @property
+    def build(self):
+        return self.span(self.acquired, self.marshalled)
+
+    @property
+    def serialize(self):
+        return self.span(self.marshalled or self.acquired, self.sending)
+
+    @property
+    def network(self):
+        return self.span(self.sending, self.received or self.finished)
+
+    @property
+    def parse(self):
+        return self.span(self.received, self.finished)
+
+    @property
+    def elapsed(self):
+        return self.span(self.started, self.finished)
+
+    def phases(self):
+        return [(name, getattr(self, name)) for name in PHASES]
+
+    def __repr__(self):
+        return '<RequestStats %s %s %s>' % (self.method, self.status,
+                                            self.elapsed)
+
+
+class Histogram(object):
+    # cumulative-bucket histogram in the Prometheus sense
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, n in zip(self.buckets + ('+Inf',), self.counts):
+            total += n
+            yield bound, total
+
+
+class Instrumentation(object):
+    # Collects a RequestStats for every SOAP request an ExactTargetAPI
+    # makes, runs the before/after hooks around it and keeps histograms of
+    # the phase timings and payload sizes by method:
+    #
+    #   api.instruments.after(lambda stats: log(stats.network))
+    #   api.instruments.after(StatsdExporter('localhost', 8125))
+    #   text = api.instruments.prometheus()
+    #
+    # Hooks run on the thread making the request, so they should be quick.
+
+    def __init__(self, time_buckets=TIME_BUCKETS, size_buckets=SIZE_BUCKETS):
+        self.time_buckets = time_buckets
+        self.size_buckets = size_buckets
+        self.before_hooks = []
+        self.after_hooks = []
+        self.histograms = {}
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def before(self, hook):
+        self.before_hooks.append(hook)
+        return hook
+
+    def after(self, hook):
+        self.after_hooks.append(hook)
+        return hook
+
+    def current(self):
+        return getattr(self.local, 'stats', None)
+
+    def start(self, method, track=True):
+        # track: let TimingPlugin fill in the phases of the suds call made
+        # on this thread; off for callers that interleave requests
+        stats = RequestStats(method)
+        if track:
+            self.local.stats = stats
+        for hook in self.before_hooks:
+            hook(stats)
+        return stats
+
+    def finish(self, stats, result=None, error=None):
+        stats.finished = time.time()
+        if self.current() is stats:
+            self.local.stats = None
+
+        if error is not None:
+            stats.status = 'Error'
+            stats.error = error
+        elif isinstance(result, basestring):
+            # raw reply from call_xml
+            for name, value in RAW_FIELDS.findall(result):
+                if name == 'OverallStatus':
+                    stats.status = value
+                else:
+                    stats.request_id = value
+            stats.objects = len(RAW_RESULTS.findall(result))
+        elif result is not None:
+            stats.status = getattr(result, 'OverallStatus', None)
+            stats.request_id = getattr(result, 'RequestID', None)
+            stats.objects = len(getattr(result, 'Results', None) or [])
+
+        self.record(stats)
+        for hook in self.after_hooks:
+            hook(stats)
+
+    def record(self, stats):
+        with self.lock:
+            self.counts[(stats.method, stats.status)] += 1
+            for phase, seconds in stats.phases():
+                if seconds is not None:
+                    self.observe('request_seconds', stats.method, seconds,
+                                 self.time_buckets, phase=phase)
+            for name in ('request_bytes', 'response_bytes'):
+                size = getattr(stats, name)
+                if size is not None:
+                    self.observe(name, stats.method, size, self.size_buckets)
+
+    def observe(self, name, method, value, buckets, phase=None):
+        key = (name, method, phase)
+        h = self.histograms.get(key)
+        if h is None:
+            h = self.histograms[key] = Histogram(buckets)
+        h.observe(value)
+
+    def prometheus(self, prefix='exacttarget'):
+        # the text exposition format, for a /metrics endpoint or a
+        # node_exporter textfile
+        lines = []
+        with self.lock:
+            lines.append('# TYPE %s_requests_total counter' % prefix)
+            for (method, status), n in sorted(self.counts.items()):
+                lines.append('%s_requests_total{method="%s",status="%s"} %d'
+                             % (prefix, method, status, n))
+
+            for name in ('request_seconds', 'request_bytes', 'response_bytes'):
+                keys = sorted(k for k in self.histograms if k[0] == name)
+                if not keys:
+                    continue
+                lines.append('# TYPE %s_%s histogram' % (prefix, name))
+                for key in keys:
+                    h = self.histograms[key]
+                    labels = 'method="%s"' % key[1]
+                    if key[2] is not None:
+                        labels += ',phase="%s"' % key[2]
+                    metric = '%s_%s' % (prefix, name)
+                    for bound, n in h.cumulative():
+                        lines.append('%s_bucket{%s,le="%s"} %d'
+                                     % (metric, labels, bound, n))
+                    lines.append('%s_sum{%s} %r' % (metric, labels, h.sum))
+                    lines.append('%s_count{%s} %d' % (metric, labels, h.count))
+
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counts.clear()
+
+
+class StatsdExporter(object):
+    # an Instrumentation after-hook sending each request's timings (ms),
+    # sizes and status to StatsD over UDP, one packet per request
+
+    def __init__(self, host='localhost', port=8125, prefix='exacttarget'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, stats):
+        metric = '%s.%s' % (self.prefix, stats.method)
+        lines = ['%s.requests.%s:1|c' % (metric, stats.status)]
+        for phase, seconds in stats.phases():
+            if seconds is not None:
+                lines.append('%s.%s:%.3f|ms' % (metric, phase, seconds * 1000))
+        for name in ('request_bytes', 'response_bytes', 'objects'):
+            value = getattr(stats, name)
+            if value is not None:
+                lines.append('%s.%s:%d|h' % (metric, name, value))
+
+        try:
+            self.sock.sendto('\n'.join(lines), self.address)
+        except socket.error:
+            pass
+
+
+class SecurityPlugin(MessagePlugin):
+    # puts an instance's WS-Security header into every request its client
+    # (and the client's clones) marshal, compiled envelopes included
+
+    def __init__(self, security):
+        self.security = security
+
+    def __deepcopy__(self, memo):
+        # thread clones send the same credentials
+        return self
+
+    def marshalled(self, context):
+        header = context.envelope.getChild('Header')
+        if header is not None:
+            header.insert(self.security.xml())
+
+
+class TimingPlugin(MessagePlugin):
+    # marks the phase boundaries of the current thread's request; suds
+    # calls these between marshalling, sending and unmarshalling
+
+    def __init__(self, instruments):
+        self.instruments = instruments
+
+    def __deepcopy__(self, memo):
+        # client clones share the instruments
+        return self
+
+    def marshalled(self, context):
+        stats = self.instruments.current()
+        if stats is not None:
+            stats.marshalled = time.time()
+
+    def sending(self, context):
+        stats = self.instruments.current()
+        if stats is not None:
+            stats.sending = time.time()
+            stats.request_bytes = len(context.envelope)
+
+    def received(self, context):
+        stats = self.instruments.current()
+        if stats is not None:
+            stats.received = time.time()
+            stats.response_bytes = len(context.reply)
+
+
+class CompactPlugin(MessagePlugin):
+    # Trims requests as they are marshalled: elements of the partner API
+    # namespace are put in the default namespace rather than each carrying a
+    # prefix, and below DataExtensionObject and Subscriber objects nil
+    # elements and xsi:type annotations are left out.  Compiled envelopes
+    # are marshalled through it too.
+
+    def marshalled(self, context):
+        body = context.envelope.getChild('Body')
+        if body is None:
+            return
+        for el in body.children:
+            self.compact(el, False)
+
+    def compact(self, el, plain):
+        # plain: inside an object whose fields need no annotations
+        if el.prefix is not None and el.namespace()[1] == PARTNER_URI:
+            el.prefix = None
+            el.expns = PARTNER_URI
+
+        xsi_type = el.getAttribute('type', Namespace.xsins)
+        if plain:
+            if xsi_type is not None:
+                el.remove(xsi_type)
+        elif el.name == 'Objects' and xsi_type is not None:
+            plain = xsi_type.getValue().split(':')[-1] in COMPACT_TYPES
+
+        for child in list(el.children):
+            if plain and child.isnil():
+                child.detach()
+            else:
+                self.compact(child, plain)
+
+
+class ClientPool(object):
+    # ExactTargetAPI instances for many accounts (business units) on one
+    # parsed schema.  Every tenant has its own credentials, connections,
+    # rate limiter and lookup cache; the schema, type factory and worker
+    # threads are shared, so adding a tenant costs a client clone rather
+    # than a schema parse.
+    #
+    #   pool = ClientPool(workers=16)
+    #   pool.add('brand-a', 'user-a', 'secret-a', rate=10)
+    #   pool.add('brand-b', 'user-b', 'secret-b')
+    #   pool['brand-a'].get_subscriber(key)
+    #
+    # Tenants are logged in on first use; keyword arguments to the pool are
+    # defaults for every tenant's ExactTargetAPI.
+
+    def __init__(self, workers=8, **defaults):
+        self.defaults = defaults
+        self.pool = ThreadPool(workers)
+        self.configs = {}
+        self.apis = {}
+        self.lock = threading.Lock()
+
+    def add(self, tenant, username, password, **options):
+        config = dict(self.defaults, **options)
+        with self.lock:
+            self.configs[tenant] = (username, password, config)
+
+    def get(self, tenant):
+        api = self.apis.get(tenant)
+        if api is not None:
+            return api
+
+        with self.lock:
+            api = self.apis.get(tenant)
+            if api is None:
+                username, password, config = self.configs[tenant]
+                api = ExactTargetAPI(username, password, pool=self.pool,
+                                     **config)
+                if api.init_client() is None:
+                    raise SoapError('could not load the schema for %s'
+                                    % tenant)
+                self.apis[tenant] = api
+        return api
+
+    __getitem__ = get
+
+    def __contains__(self, tenant):
+        return tenant in self.configs
+
+    def tenants(self):
+        return list(self.configs)
+
+    def remove(self, tenant):
+        with self.lock:
+            self.configs.pop(tenant, None)
+            api = self.apis.pop(tenant, None)
+        if api is not None:
+            api.close()
+
+    def close(self):
+        with self.lock:
+            apis = self.apis.values()
+            self.apis = {}
+        for api in apis:
+            api.close()
+        self.pool.terminate()
+
+
+class ServiceProxy(object):
+    def __init__(self, api):
+        self.api = api
+
+    def __getattr__(self, method):
+        return lambda *args: self.api.call(method, *args)
+
+
+class ConnectionPool(object):
+    # idle HTTP/1.1 keep-alive connections per host, shared between the
+    # transports of every client (and thread) of an account
+
+    def __init__(self, maxsize=10, timeout=90):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+
+        # hosts that refused a compressed request
+        self.uncompressed = set()
+
+    def get(self, host):
+        with self.lock:
+            idle = self.idle.setdefault(host, [])
+            if idle:
+                return idle.pop(), True
+
+        scheme, netloc = host
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout), False
+        return httplib.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def put(self, host, conn):
+        with self.lock:
+            idle = self.idle.setdefault(host, [])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+
+        conn.close()
+
+    def clear(self):
+        with self.lock:
+            idle = [c for conns in self.idle.values() for c in conns]
+            self.idle = {}
+
+        for conn in idle:
+            conn.close()
+
+
+class PooledTransport(Transport):
+    # Responses are always accepted gzip or deflate encoded.  With compress,
+    # request bodies of compress_min bytes or more are sent gzipped; a host
+    # that rejects one (400 or 415) is sent plain requests from then on.
+
+    def __init__(self, pool=None, compress=False,
+                 compress_min=COMPRESS_MIN_BYTES, level=COMPRESS_LEVEL):
+        Transport.__init__(self)
+        self.pool = pool or ConnectionPool()
+        self.compress = compress
+        self.compress_min = compress_min
+        self.level = level
+        self.documents = HttpAuthenticated()
+
+    def __deepcopy__(self, memo):
+        # suds deep-copies options when cloning a client; the clone gets its
+        # own transport (suds links each to one client) on the same pool
+        return self.__class__(self.pool, self.compress, self.compress_min,
+                              self.level)
+
+    def open(self, request):
+        # schema downloads are one-off, leave them to the stock transport
+        return self.documents.open(request)
+
+    def send(self, request):
+        url = urlparse.urlsplit(request.url)
+        host = (url.scheme, url.netloc)
+        path = url.path + ('?' + url.query if url.query else '')
+
+        headers = dict(request.headers)
+        headers['Accept-Encoding'] = 'gzip, deflate'
+        body = request.message
+
+        if (self.compress and len(body) >= self.compress_min and
+                host not in self.pool.uncompressed):
+            gz = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            resp, data = self.post(host, path, gz.compress(body) + gz.flush(),
+                                   dict(headers, **{'Content-Encoding': 'gzip'}))
+            if resp.status in (400, 415):
+                self.pool.uncompressed.add(host)
+                resp, data = self.post(host, path, body, headers)
+        else:
+            resp, data = self.post(host, path, body, headers)
+
+        if resp.status >= 300:
+            raise TransportError(resp.reason, resp.status, StringIO(data))
+
+        return Reply(resp.status, dict(resp.getheaders()), data)
+
+    def post(self, host, path, body, headers):
+        # a pooled connection may have been closed by the server while idle,
+        # in which case the request is retried once on a fresh one
+        for attempt in (0, 1):
+            conn, reused = self.pool.get(host)
+            try:
+                conn.request('POST', path, body, headers)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            break
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self.pool.put(host, conn)
+
+        return resp, decode_body(data, resp.getheader('content-encoding'))
+
+
+def decode_body(data, encoding):
+    encoding = (encoding or '').strip().lower()
+    if encoding == 'gzip':
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        # zlib-wrapped as the spec says, or raw as IIS sends it
+        try:
+            return zlib.decompress(data)
+        except zlib.error:
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+    return data
+
+
+class PageMetrics(object):
+    # latency and throughput of a paginated Retrieve
+
+    def __init__(self):
+        self.pages = 0
+        self.rows = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.started = time.time()
+
+    def record(self, latency, rows):
+        self.pages += 1
+        self.rows += rows
+        self.latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    @property
+    def mean_latency(self):
+        return self.latency / self.pages if self.pages else 0.0
+
+    @property
+    def rows_per_second(self):
+        elapsed = time.time() - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return '<PageMetrics %d pages, %d rows, %.3fs mean latency, %.0f rows/s>' % (
+            self.pages, self.rows, self.mean_latency, self.rows_per_second)
+
+
+class LookupCache(object):
+    # thread-safe LRU cache whose entries expire after ttl seconds; keys are
+    # tuples starting with the object type so a type can be invalidated
+
+    def __init__(self, size=1024, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+
+            if entry is None or (entry[0] is not None and
+                                 entry[0] < time.time()):
+                self.misses += 1
+                return None
+
+            # most recently used entries live at the end
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if not self.size:
+            return
+
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (expires, value)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, objtype=None):
+        with self.lock:
+            if objtype is None:
+                self.entries.clear()
+            else:
+                for key in [k for k in self.entries if k[0] == objtype]:
+                    del self.entries[key]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.entries)}
+
+
+class EnvelopeTemplate(object):
+    # A marshalled envelope split around its placeholder tokens, so sending
+    # another request of the same shape is string joins instead of building
+    # and marshalling suds objects.  With repeat, the first-to-last element
+    # of that name becomes a fragment rendered once per item.  A value of
+    # None leaves out the element around its token, as suds leaves out an
+    # unset field.
+    pattern = re.compile(r'@@et:(\d+)@@')
+    open_tag = re.compile(r'<([\w:]+)(?:\s[^<>]*)?>$')
+    fields = {}
+    lock = threading.Lock()
+
+    @classmethod
+    def token(cls, field):
+        # fields are numbered process-wide so tokens never collide
+        with cls.lock:
+            n = cls.fields.setdefault(field, len(cls.fields))
+        return '@@et:%d@@' % n
+
+    def __init__(self, envelope, repeat=None):
+        names = dict((n, f) for f, n in self.fields.items())
+        head, item, tail = envelope, None, ''
+
+        # namespace prefixes of the repeated element and of the type in its
+        # xsi:type, for items serialized by an ObjectModel
+        self.prefix = self.type_prefix = ''
+
+        if repeat is not None:
+            m = re.search(r'<(\w+:)?%s[\s>]' % repeat, envelope)
+            close = '</%s%s>' % (m.group(1) or '', repeat)
+            stop = envelope.rindex(close) + len(close)
+            head, item, tail = (envelope[:m.start()], envelope[m.start():stop],
+                                envelope[stop:])
+
+            self.prefix = str(m.group(1) or '')
+            t = re.match(r'<[^>]*xsi:type="(\w+:)?', item)
+            if t is not None:
+                self.type_prefix = str(t.group(1) or '')
+
+        self.head = self.parse(head, names)
+        self.item = self.parse(item, names) if item is not None else None
+        self.tail = self.parse(tail, names)
+
+    def parse(self, text, names):
+        # [(literal, field or None, open tag, close tag)] as bytes; the tags
+        # are those of the element holding just the field's token
+        parts = self.pattern.split(text)
+        literals = parts[0::2]
+        out = []
+        for i, n in enumerate(parts[1::2]):
+            literal, open, close = literals[i], '', ''
+            m = self.open_tag.search(literal)
+            if m is not None:
+                end = '</%s>' % m.group(1)
+                if literals[i + 1].startswith(end):
+                    literal, open, close = literal[:m.start()], m.group(0), end
+                    literals[i + 1] = literals[i + 1][len(end):]
+            out.append((literal.encode('utf-8'), names[int(n)],
+                        open.encode('utf-8'), close.encode('utf-8')))
+        out.append((literals[-1].encode('utf-8'), None, '', ''))
+        return out
+
+    def render(self, parts, values, out):
+        for literal, field, open, close in parts:
+            out.append(literal)
+            if field is not None:
+                v = values[field]
+                if v is None:
+                    continue
+                if not isinstance(v, basestring):
+                    v = str(v)
+                if isinstance(v, str):
+                    v = v.decode('utf-8')
+                out.append(open)
+                out.append(escape(v).encode('utf-8'))
+                out.append(close)
+
+    def fill(self, values, items=()):
+        out = []
+        self.render(self.head, values, out)
+        for item in items:
+            self.render(self.item, item, out)
+        self.render(self.tail, values, out)
+        return ''.join(out)
+
+
+class SchemaObject(object):
+    # Base of the classes an ObjectModel generates: a slot per schema field
+    # and nothing else, so building one costs about as much as a tuple.
+    # Unset fields read as missing, like on a stub.
+    __slots__ = ()
+    _type = None
+    _fields = ()
+
+    def __init__(self, **values):
+        for k, v in values.iteritems():
+            setattr(self, k, v)
+
+    def __iter__(self):
+        # (name, value) of the fields set, in schema order
+        for name, wrapped, declared in self._fields:
+            v = getattr(self, name, None)
+            if v is not None:
+                yield name, v
+
+    def __repr__(self):
+        return '<%s %s>' % (self._type,
+                            ' '.join('%s=%r' % item for item in self))
+
+
+class ObjectModel(object):
+    # SchemaObject classes for the types of a parsed schema, generated on
+    # first use, and their serializer.  Objects are written straight to
+    # XML in schema order; lists repeat their element, wrapper elements
+    # such as DataExtensionObject.Properties take a plain list of their
+    # items, and xsi:type is only given where an object isn't of the
+    # declared type.  Stubs, suds objects and dicts nested in them are
+    # serialized too.
+
+    def __init__(self, client):
+        self.resolver = client.factory.resolver
+        self.types = {}
+        self.lock = threading.Lock()
+
+    def __getitem__(self, objtype):
+        cls = self.types.get(objtype)
+        if cls is None:
+            with self.lock:
+                cls = self.types.get(objtype)
+                if cls is None:
+                    cls = self.types[objtype] = self.generate(objtype)
+        return cls
+
+    def generate(self, objtype):
+        sxtype = self.resolver.find(objtype)
+        if sxtype is None:
+            raise TypeNotFound(objtype)
+
+        # (name, (item name, item type) of a wrapper or None, declared
+        # type); names are kept as bytes like the rest of the output
+        fields = []
+        for el, ancestry in sxtype.children():
+            name = str(el.name)
+            if any(f[0] == name for f in fields):
+                continue
+            wrapped = None
+            if el.type is None and el.rawchildren:
+                items = [c for c, a in el.children()]
+                if len(items) == 1:
+                    wrapped = (str(items[0].name), self.declared(items[0]))
+            fields.append((name, wrapped, self.declared(el)))
+
+        return type(str(objtype), (SchemaObject,),
+                    {'__slots__': tuple(f[0] for f in fields),
+                     '_type': objtype, '_fields': tuple(fields)})
+
+    def declared(self, el):
+        resolved = el.resolve()
+        if resolved.builtin():
+            return None
+        return str(resolved.name)
+
+    def serialize(self, obj, tag, prefix, type_prefix, out, declared=None):
+        # append obj to out as utf-8 XML element prefix + tag
+        if not isinstance(obj, SchemaObject):
+            if isinstance(obj, dict):
+                obj = self[declared](**obj)
+            else:
+                obj = self[obj.__class__.__name__](**dict(obj))
+
+        cls = obj.__class__
+        if declared is not None and next(iter(obj), None) is None:
+            # an empty nested object is left out, as suds does
+            return
+
+        if cls._type != declared:
+            out.append('<%s%s xsi:type="%s%s">' % (prefix, tag, type_prefix,
+                                                   cls._type))
+        else:
+            out.append('<%s%s>' % (prefix, tag))
+
+        for name, wrapped, ftype in cls._fields:
+            v = getattr(obj, name, None)
+            if v is None:
+                continue
+            if wrapped is None:
+                self.values(v, name, ftype, prefix, type_prefix, out)
+            else:
+                # as suds takes them, the wrapper may also be a dict or
+                # object (or a list of one) holding the items
+                item = wrapped[0]
+                if isinstance(v, (list, tuple)) and len(v) == 1:
+                    v = v[0] if self.wrapper(v[0], name, item) else v
+                if self.wrapper(v, name, item):
+                    v = v[item] if isinstance(v, dict) else getattr(v, item, None)
+                if not v:
+                    continue
+                out.append('<%s%s>' % (prefix, name))
+                self.values(v, item, wrapped[1], prefix, type_prefix, out)
+                out.append('</%s%s>' % (prefix, name))
+
+        out.append('</%s%s>' % (prefix, tag))
+
+    def wrapper(self, v, name, item):
+        if isinstance(v, dict):
+            return item in v
+        return hasattr(v, '__keylist__') and v.__class__.__name__ == name
+
+    def values(self, v, tag, declared, prefix, type_prefix, out):
+        for item in v if isinstance(v, (list, tuple)) else (v,):
+            if item is None:
+                continue
+            if (isinstance(item, (SchemaObject, dict)) or
+                    hasattr(item, '__keylist__')):
+                self.serialize(item, tag, prefix, type_prefix, out, declared)
+            else:
+                out.append('<%s%s>%s</%s%s>' % (prefix, tag, xml_text(item),
+                                                prefix, tag))
+
+
+class PendingResult(object):
+    # a result delivered later by a background thread; get() blocks until
+    # it arrives, callbacks run on the delivering thread
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.callbacks = []
+        self.value = None
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+
+        for fn in callbacks:
+            fn(value)
+
+    def ready(self):
+        return self.event.is_set()
+
+    def get(self, timeout=None):
+        if not self.event.wait(timeout):
+            raise RuntimeError('result not ready after %s seconds' % timeout)
+        return self.value
+
+    def add_callback(self, fn):
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(fn)
+                return
+        fn(self.value)
+
+
+class TriggeredSendBatcher(object):
+    # Queues triggered sends and delivers them as TriggeredSend objects
+    # grouped by definition key, each carrying many subscribers, several per
+    # Create call.  A flush happens once max_size sends are queued or the
+    # oldest has waited max_wait seconds.  send() returns a PendingResult
+    # that receives the subscriber's ObjectResult.  Without timer nothing
+    # waits on max_wait: callers that batch for themselves flush, or use
+    # deliver(), and no timer thread is started.
+
+    def __init__(self, api, max_size=MAX_SUBSCRIBER_BATCH, max_wait=1.0,
+                 max_subscribers=MAX_TS_SUBSCRIBERS,
+                 max_objects=MAX_TS_OBJECTS, timer=True):
+        self.api = api
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.max_subscribers = max_subscribers
+        self.max_objects = max_objects
+
+        self.lock = threading.Lock()
+        self.queued = collections.OrderedDict()
+        self.count = 0
+        self.oldest = None
+        self.seq = 0
+        self.sending = []
+
+        # deliveries build their objects from stubs on the worker pool; the
+        # prototypes and the options come from the factory here
+        for objtype in ('Subscriber', 'TriggeredSendDefinition',
+                        'TriggeredSend'):
+            api.stub(objtype)
+        self.options = api.create_options('Synchronous')
+
+        self.closed = threading.Event()
+        self.timer = None
+        if timer:
+            self.timer = threading.Thread(target=self.run)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def subscriber(self, email, subscriberkey, attribs=None):
+        s = self.api.stub('Subscriber', EmailAddress=email,
+                          SubscriberKey=subscriberkey, Status='Active',
+                          EmailTypePreference='HTML',
+                          PrimarySMSPublicationStatus='OptedIn')
+        if attribs:
+            s.Attributes = [{'Name': k, 'Value': v}
+                            for k, v in attribs.iteritems()]
+        return s
+
+    def send(self, tsd_key, email, subscriberkey, attribs=None):
+        pending = PendingResult()
+
+        with self.lock:
+            s = self.subscriber(email, subscriberkey, attribs)
+            self.queued.setdefault(tsd_key, []).append((self.seq, s, pending))
+            self.seq += 1
+            self.count += 1
+            if self.oldest is None:
+                self.oldest = time.time()
+            full = self.count >= self.max_size
+
+        if full:
+            self.flush()
+
+        return pending
+
+    def run(self):
+        while not self.closed.wait(min(self.max_wait, 0.1)):
+            with self.lock:
+                due = (self.oldest is not None and
+                       time.time() - self.oldest >= self.max_wait)
+            if due:
+                self.flush()
+
+    def flush(self):
+        # hand everything queued to the api's worker pool
+        with self.lock:
+            if not self.count:
+                return None
+            groups = self.queued.items()
+            self.queued = collections.OrderedDict()
+            self.count = 0
+            self.oldest = None
+
+        # flushes come from the timer and from senders at once
+        sent = self.api.executor().apply_async(self._deliver, (groups,))
+        with self.lock:
+            self.sending = [s for s in self.sending if not s.ready()] + [sent]
+        return sent
+
+    def deliver(self, tsd_key, sends):
+        # send (email, subscriberkey, attribs) triples to tsd_key now, on
+        # this thread and past the queue; returns an ObjectResult per send,
+        # in order.  A call that failed as a whole has no request_id
+        queued = [(i, self.subscriber(*send), PendingResult())
+                  for i, send in enumerate(sends)]
+        self._deliver([(tsd_key, queued)])
+        return [pending.get() for i, s, pending in queued]
+
+    def close(self):
+        self.closed.set()
+        if self.timer is not None:
+            self.timer.join()
+        self.flush()
+        with self.lock:
+            sending = list(self.sending)
+        for sent in sending:
+            sent.wait()
+
+    def _deliver(self, groups):
+        # one TriggeredSend per max_subscribers of a definition; entries
+        # lines up with objs so results can be mapped back
+        objs = []
+        entries = []
+        for tsd_key, queued in groups:
+            for chunk in chunks(queued, self.max_subscribers):
+                tsd = self.api.stub('TriggeredSendDefinition',
+                                    SourceAddressType='DefaultPrivateIPAddress',
+                                    DomainType='DefaultDomain',
+                                    HeaderSalutationSource='None',
+                                    FooterSalutationSource='None',
+                                    TriggeredSendType='Continuous',
+                                    TriggeredSendStatus='Active',
+                                    CustomerKey=tsd_key)
+                objs.append(self.api.stub('TriggeredSend',
+                                          TriggeredSendDefinition=tsd,
+                                          Subscribers=[s for i, s, p in chunk]))
+                entries.append(chunk)
+
+        for i in range(0, len(objs), self.max_objects):
+            self._create(self.options, objs[i:i + self.max_objects],
+                         entries[i:i + self.max_objects])
+
+    def _create(self, co, objs, entries):
+        try:
+            resp = self.api.service.Create(co, objs)
+        except Exception as e:
+            # nothing in the call was sent; fail every subscriber in it
+            for chunk in entries:
+                for seq, s, pending in chunk:
+                    pending.set(ObjectResult(seq, 'Error', str(e)))
+            return
+
+        try:
+            if resp.OverallStatus != 'OK':
+                self.api.log(resp, logging.ERROR)
+
+            for i, r in enumerate(getattr(resp, 'Results', [])):
+                ordinal = getattr(r, 'OrdinalID', None)
+                if ordinal is None:
+                    ordinal = i
+                if ordinal >= len(entries):
+                    continue
+
+                # failed subscribers, by position or else by SubscriberKey
+                failures = {}
+                for f in getattr(r, 'SubscriberFailures', []):
+                    key = getattr(f, 'Ordinal', None)
+                    if key is None:
+                        key = getattr(getattr(f, 'Subscriber', None),
+                                      'SubscriberKey', None)
+                    failures[key] = f
+
+                for n, (seq, s, pending) in enumerate(entries[ordinal]):
+                    f = failures.get(n) or failures.get(s.SubscriberKey)
+                    if f is not None:
+                        pending.set(ObjectResult(
+                            seq, 'Error', getattr(f, 'ErrorDescription', None),
+                            f.ErrorCode, None, resp.RequestID))
+                    else:
+                        pending.set(ObjectResult(
+                            seq, r.StatusCode,
+                            getattr(r, 'StatusMessage', None),
+                            getattr(r, 'ErrorCode', None),
+                            getattr(r, 'NewID', None), resp.RequestID))
+        finally:
+            # subscribers the response didn't mention, and any left when
+            # reading it failed
+            for chunk in entries:
+                for seq, s, pending in chunk:
+                    if not pending.ready():
+                        pending.set(ObjectResult(seq, 'Error', 'no result',
+                                                 None, None,
+                                                 getattr(resp, 'RequestID',
+                                                         None)))
+
+
+class Filter(object):
+    # A Retrieve filter expression.  Conditions come from Field and combine
+    # with & and |:
+    #
+    #   (Field('Status') == 'Active') & Field('Email').in_(emails)
+    #   Field('Age').between(18, 30) | Field('Email').like('%@example.com')
+    #
+    # build(api) compiles it to the SimpleFilterPart / ComplexFilterPart
+    # tree ET expects; anywhere a filter is accepted, an expression can be
+    # given instead.
+
+    def __and__(self, other):
+        return Logical('AND', [self, other])
+
+    def __or__(self, other):
+        return Logical('OR', [self, other])
+
+    def split(self, size):
+        # equivalent filters whose IN lists hold at most size values; only
+        # INs that must all hold (the filter or its top-level AND terms)
+        # are split, so the results of the parts never overlap
+        if isinstance(self, Logical) and self.operator == 'AND':
+            terms = self.operands
+        else:
+            terms = [self]
+
+        big = [t for t in terms if isinstance(t, Condition) and
+               t.operator == 'IN' and len(t.values) > size]
+        if not big:
+            return [self]
+
+        term = max(big, key=lambda t: len(t.values))
+        rest = [t for t in terms if t is not term]
+        parts = []
+        for values in chunks(term.values, size):
+            part = Condition(term.prop, 'IN', values)
+            if rest:
+                part = Logical('AND', rest + [part])
+            parts.extend(part.split(size))
+        return parts
+
+
+class Condition(Filter):
+    # one SimpleFilterPart; dates go in DateValue, anything else in Value
+
+    def __init__(self, prop, operator, values=()):
+        if values is None:
+            values = []
+        elif not isinstance(values, (list, tuple)):
+            values = [values]
+        self.prop = prop
+        self.operator = operator
+        self.values = list(values)
+
+    def build(self, api):
+        sfp = api.stub('SimpleFilterPart', Property=self.prop,
+                       SimpleOperator=self.operator)
+        if self.values:
+            if all(isinstance(v, datetime.date) for v in self.values):
+                sfp.DateValue = self.values
+            else:
+                sfp.Value = [v if isinstance(v, basestring) else unicode(v)
+                             for v in self.values]
+        return sfp
+
+    def __repr__(self):
+        return '<Condition %s %s %r>' % (self.prop, self.operator,
+                                         self.values)
+
+
+class Logical(Filter):
+    # AND / OR of any number of filters (or suds FilterParts), built as a
+    # balanced tree of binary ComplexFilterParts
+
+    def __init__(self, operator, operands):
+        self.operator = operator
+        self.operands = []
+        for o in operands:
+            if isinstance(o, Logical) and o.operator == operator:
+                self.operands.extend(o.operands)
+            else:
+                self.operands.append(o)
+
+    def build(self, api):
+        parts = [o.build(api) if isinstance(o, Filter) else o
+                 for o in self.operands]
+        return self.join(api, parts)
+
+    def join(self, api, parts):
+        if len(parts) == 1:
+            return parts[0]
+        middle = len(parts) // 2
+        return api.stub('ComplexFilterPart',
+                        LeftOperand=self.join(api, parts[:middle]),
+                        LogicalOperator=self.operator,
+                        RightOperand=self.join(api, parts[middle:]))
+
+    def __repr__(self):
+        return '<Logical %s %r>' % (self.operator, self.operands)
+
+
+class Field(object):
+    # builds Conditions on one property
+
+    def __init__(self, prop):
+        self.prop = prop
+
+    def __eq__(self, value):
+        return Condition(self.prop, 'equals', value)
+
+    def __ne__(self, value):
+        return Condition(self.prop, 'notEquals', value)
+
+    def __lt__(self, value):
+        return Condition(self.prop, 'lessThan', value)
+
+    def __le__(self, value):
+        return Condition(self.prop, 'lessThanOrEqual', value)
+
+    def __gt__(self, value):
+        return Condition(self.prop, 'greaterThan', value)
+
+    def __ge__(self, value):
+        return Condition(self.prop, 'greaterThanOrEqual', value)
+
+    def in_(self, values):
+        return Condition(self.prop, 'IN', list(values))
+
+    def between(self, low, high):
+        return Condition(self.prop, 'between', [low, high])
+
+    def like(self, pattern):
+        return Condition(self.prop, 'like', pattern)
+
+    def is_null(self):
+        return Condition(self.prop, 'isNull')
+
+    def is_not_null(self):
+        return Condition(self.prop, 'isNotNull')
+
+
+class Page(object):
+    # a decoded Retrieve reply, shaped like the suds response
+    __slots__ = ('OverallStatus', 'RequestID', 'Results')
+
+    def __init__(self, status, request_id, results):
+        self.OverallStatus = status
+        self.RequestID = request_id
+        self.Results = results
+
+
+# one result of a write, as read by ResultDecoder
+Result = collections.namedtuple('Result', ['StatusCode', 'StatusMessage',
+                                           'OrdinalID', 'ErrorCode', 'NewID'])
+
+
+class RowDecoder(object):
+    # Decodes DataExtensionObject Retrieve replies without building suds
+    # objects.  Rows come back as:
+    #   dict    - {column: value}, like _deo_to_list
+    #   tuple   - values in cols order; cols is the shared header
+    #   record  - namedtuple (no per-row __dict__) with cols as fields
+    #   columns - one {column: [values]} per page
+    formats = ('dict', 'tuple', 'record', 'columns')
+
+    def __init__(self, cols, row_format='tuple'):
+        if row_format not in self.formats:
+            raise ValueError('unknown row format %r' % row_format)
+
+        self.cols = list(cols)
+        self.row_format = row_format
+        self.index = dict((c, i) for i, c in enumerate(self.cols))
+        self.record = collections.namedtuple('Row', self.cols, rename=True)
+
+    def decode(self, xml):
+        status = request_id = None
+        rows = []
+        width = len(self.cols)
+        name = value = None
+        row = {} if self.row_format == 'dict' else [None] * width
+
+        for event, elem in ElementTree.iterparse(StringIO(xml)):
+            tag = elem.tag
+
+            if tag == NAME_TAG:
+                name = elem.text
+            elif tag == VALUE_TAG:
+                value = elem.text
+            elif tag == PROPERTY_TAG:
+                if self.row_format == 'dict':
+                    row[name] = value
+                elif name in self.index:
+                    row[self.index[name]] = value
+                name = value = None
+            elif tag == RESULTS_TAG:
+                rows.append(row)
+                row = {} if self.row_format == 'dict' else [None] * width
+                elem.clear()
+            elif tag == STATUS_TAG:
+                status = elem.text
+            elif tag == REQUEST_ID_TAG:
+                request_id = elem.text
+
+        if self.row_format == 'tuple':
+            rows = [tuple(r) for r in rows]
+        elif self.row_format == 'record':
+            rows = [self.record._make(r) for r in rows]
+        elif self.row_format == 'columns':
+            rows = dict((c, [r[i] for r in rows])
+                        for i, c in enumerate(self.cols))
+
+        return Page(status, request_id, rows)
+
+
+class ObjectDecoder(object):
+    # Decodes Retrieve replies for ordinary objects (Subscriber, SentEvent,
+    # ...) without suds, reading each requested property from the result's
+    # elements; dotted properties such as 'Client.ID' read nested ones.
+    # Rows come back as for RowDecoder, minus 'columns'.
+    formats = ('dict', 'tuple', 'record')
+
+    def __init__(self, props, row_format='tuple'):
+        if row_format not in self.formats:
+            raise ValueError('unknown row format %r' % row_format)
+
+        self.props = list(props)
+        self.row_format = row_format
+        self.paths = ['/'.join(PARTNER_NS + p for p in prop.split('.'))
+                      for prop in self.props]
+        self.record = collections.namedtuple('Row', [p.replace('.', '_')
+                                                     for p in self.props],
+                                             rename=True)
+
+    def decode(self, xml):
+        status = request_id = None
+        rows = []
+
+        for event, elem in ElementTree.iterparse(StringIO(xml)):
+            tag = elem.tag
+
+            if tag == RESULTS_TAG:
+                row = tuple(elem.findtext(p) for p in self.paths)
+                if self.row_format == 'dict':
+                    row = dict(zip(self.props, row))
+                elif self.row_format == 'record':
+                    row = self.record._make(row)
+                rows.append(row)
+                elem.clear()
+            elif tag == STATUS_TAG:
+                status = elem.text
+            elif tag == REQUEST_ID_TAG:
+                request_id = elem.text
+
+        return Page(status, request_id, rows)
+
+
+class ResultDecoder(object):
+    # Decodes Create, Update and Delete replies without suds: a Page whose
+    # Results hold the fields of each result that ObjectResult takes
+    numeric = ('OrdinalID', 'ErrorCode', 'NewID')
+
+    def decode(self, xml):
+        status = request_id = None
+        rows = []
+
+        for event, elem in ElementTree.iterparse(StringIO(xml)):
+            tag = elem.tag
+
+            if tag == RESULTS_TAG:
+                r = dict((f, elem.findtext(PARTNER_NS + f))
+                         for f in Result._fields)
+                for f in self.numeric:
+                    if r[f]:
+                        r[f] = int(r[f])
+                rows.append(Result(**r))
+                elem.clear()
+            elif tag == STATUS_TAG:
+                status = elem.text
+            elif tag == REQUEST_ID_TAG:
+                request_id = elem.text
+
+        return Page(status, request_id, rows)
+
+
+class ObjectResult(object):
+    # outcome of one object in a bulk call; index is its position in the
+    # stream the caller passed in
+    __slots__ = ('index', 'status', 'message', 'error_code', 'new_id',
+                 'request_id')
+
+    def __init__(self, index, status, message=None, error_code=None,
+                 new_id=None, request_id=None):
+        self.index = index
+        self.status = status
+        self.message = message
+        self.error_code = error_code
+        self.new_id = new_id
+        self.request_id = request_id
+
+    @property
+    def ok(self):
+        return self.status == 'OK'
+
+    def __repr__(self):
+        return '<ObjectResult %s %s %r>' % (self.index, self.status,
+                                            self.message)
+
+
+class OfflineSchemaPlugin(DocumentPlugin):
+    # the ET schema imports its fault types from the web service; none of the
+    # operations reference them, so offline the import is simply dropped
+    remote_import = re.compile(r'\sschemaLocation="https?://[^"]*"')
+
+    def loaded(self, context):
+        context.document = self.remote_import.sub('', context.document)
+
+
+class SchemaCache(ObjectCache):
+    # ObjectCache that unpickles with the garbage collector paused: a parsed
+    # schema is tens of thousands of objects, and the collections they
+    # trigger part way through double the load time
+
+    def get(self, id):
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return ObjectCache.get(self, id)
+        finally:
+            if enabled:
+                gc.enable()
+
+def remote_digest(url, location):
+    # sha1 of the document at url.  The ETag and Last-Modified the server
+    # sent with it are kept under location, so an unchanged schema is
+    # revalidated rather than downloaded again; if the server can't be
+    # reached the last digest seen is used
+    index = os.path.join(location, 'remote-%s.json'
+                         % hashlib.sha1(url).hexdigest())
+    try:
+        with open(index) as f:
+            known = json.load(f)
+    except (IOError, ValueError):
+        known = {}
+
+    request = urllib2.Request(url)
+    if known.get('etag'):
+        request.add_header('If-None-Match', known['etag'])
+    if known.get('modified'):
+        request.add_header('If-Modified-Since', known['modified'])
+
+    try:
+        resp = urllib2.urlopen(request, timeout=30)
+        body = resp.read()
+    except (URLError, socket.error, httplib.HTTPException):
+        # a 304 Not Modified lands here too
+        return known.get('digest')
+
+    known = {'digest': hashlib.sha1(body).hexdigest(),
+             'etag': resp.info().getheader('ETag'),
+             'modified': resp.info().getheader('Last-Modified')}
+    try:
+        if not os.path.isdir(location):
+            os.makedirs(location)
+        with open(index + '.tmp', 'w') as f:
+            json.dump(known, f)
+        os.rename(index + '.tmp', index)
+    except (IOError, OSError):
+        pass
+    return known['digest']
+
+def copy_object(value):
+    # a copy of a suds object deep enough that setting its fields, or those
+    # of its children, leaves the original alone; deepcopy would also copy
+    # the schema type each object points to, hundreds of times slower
+    if isinstance(value, suds.sudsobject.Object):
+        c = value.__class__()
+        for k in value.__keylist__:
+            setattr(c, k, copy_object(getattr(value, k)))
+        c.__metadata__ = value.__metadata__
+        return c
+    if isinstance(value, list):
+        return [copy_object(v) for v in value]
+    if isinstance(value, dict):
+        return dict((k, copy_object(v)) for k, v in value.iteritems())
+    return value
+
+def xml_text(v):
+    # a simple value as escaped utf-8 element text
+    if isinstance(v, bool):
+        return 'true' if v else 'false'
+    if isinstance(v, (datetime.date, datetime.time)):
+        v = v.isoformat()
+    elif not isinstance(v, basestring):
+        v = str(v)
+    if isinstance(v, unicode):
+        v = v.encode('utf-8')
+    return escape(v)
+
+def local_url(path):
+    return 'file://' + urllib.pathname2url(os.path.abspath(path))
+
+def local_path(url):
+    if url.startswith('file://'):
+        return urllib.url2pathname(url[len('file://'):])
+    if '://' not in url:
+        return url
+    return None
+
 # http://stackoverflow.com/a/1751478/271768
 def chunks(l, n):
     return [l[i:i+n] for i in range(0, len(l), n)]
+
+def prefetched(iterable, depth):
+    # run iterable on a background thread, buffering at most depth items
+    # ahead of the consumer; errors are re-raised in the consumer
+    q = Queue.Queue(depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                q.put(entry, timeout=0.5)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception:
+            put((done, sys.exc_info()))
+
+    t = threading.Thread(target=produce)
+    t.daemon = True
+    t.start()
+
+    try:
+        while True:
+            item, error = q.get()
+            if error is not None:
+                raise error[0], error[1], error[2]
+            if item is done:
+                return
+            yield item
+    finally:
+        # the consumer stopped early; let the producer wind down
+        stop.set()
+
+def batches(objs, size, max_bytes=None, sizeof=None):
+    # lazily group any iterable into lists of at most size objects and,
+    # when sizeof is given, roughly max_bytes of serialized payload
+    batch = []
+    nbytes = 0
+
+    for obj in objs:
+        if max_bytes is not None and sizeof is not None:
+            n = sizeof(obj)
+            if batch and nbytes + n > max_bytes:
+                yield batch
+                batch = []
+                nbytes = 0
+            nbytes += n
+
+        batch.append(obj)
+
+        if len(batch) >= size:
+            yield batch
+            batch = []
+            nbytes = 0
+
+    if batch:
+        yield batch
+
+def subscriber_size(sub):
+    # approximate serialized size of a Subscriber
+    n = 300 + len(sub.EmailAddress) + len(unicode(sub.SubscriberKey))
+    for a in getattr(sub, 'Attributes', None) or ():
+        v = a.Value
+        n += 50 + len(a.Name) + len(v if isinstance(v, basestring) else str(v))
+    return n + 120 * len(getattr(sub, 'Lists', None) or ())
+
+def row_size(props):
+    # approximate serialized size of a row as a DataExtensionObject
+    n = 200
+    for k, v in props.iteritems():
+        n += 40 + len(k) + len(v if isinstance(v, basestring) else str(v))
+    return n
+
+def item_size(item):
+    # approximate serialized size of a (template, row) to render
+    return row_size(item[1])
+
+def deo_size(deo):
+    # approximate serialized size of a DataExtensionObject
+    n = 200
+    for p in deo.Properties:
+        v = p.Value
+        n += 40 + len(p.Name) + len(v if isinstance(v, basestring) else str(v))
+    return n
@@ -0,0 +1,185 @@
+# Non-blocking counterpart to ExactTargetAPI for Tornado applications.
+#
+# Requests are built by an ExactTargetAPI (so the same RetrieveRequest,
+# CreateOptions and SaveOption construction is used) and sent over Tornado's
+# AsyncHTTPClient, so a single IOLoop can keep thousands of calls in flight
+# without a thread per request.  Calls wait for the account's RateLimiter,
+# the one the blocking api uses, on the IOLoop rather than blocking it.
+#
+#   api = ExactTargetAPI(username, password)
+#   api.init_client()
+#   et = AsyncExactTargetAPI(api)
+#
+#   resp = yield et.retrieve('List', ['ID', 'ListName'])
+#
+#   pages = et.get_data_extension('my_de', ['Email', 'Name'])
+#   while (yield pages.fetch_next):
+#       rows = pages.next_object()
+import logging
+import time
+
+from StringIO import StringIO
+
+import suds
+from suds.client import SoapClient
+from suds.plugin import PluginContainer
+from suds.transport import TransportError
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient, HTTPError, HTTPRequest
+
+from etapi import OK, THROTTLED, ExactTargetError, SoapError
+
+class AsyncExactTargetAPI(object):
+    def __init__(self, api, max_clients=100, request_timeout=90):
+        self.api = api
+        self.request_timeout = request_timeout
+        self.http = AsyncHTTPClient(force_instance=True,
+                                    max_clients=max_clients)
+
+    def envelope(self, method, *args):
+        # marshal exactly as suds would, minus the blocking send
+        client = self.api.client
+        soap = SoapClient(client, getattr(client.service, method).method)
+        plugins = PluginContainer(client.options.plugins)
+
+        body = self.api.envelope(method, *args).encode('utf-8')
+        body = plugins.message.sending(envelope=body).envelope
+
+        request = HTTPRequest(soap.location(), method='POST',
+                              headers=soap.headers(), body=body,
+                              request_timeout=self.request_timeout)
+        return soap, request
+
+    @gen.coroutine
+    def call(self, method, *args):
+        # throttled calls are retried while the limiter's retry budget
+        # lasts, as by api.limited()
+        limiter = self.api.account_limiter()
+        instruments = self.api.instruments
+
+        while True:
+            stats = instruments.start(method, track=False)
+            yield self.acquire(limiter)
+            stats.acquired = time.time()
+
+            try:
+                result = yield self.send(stats, method, *args)
+            except Exception as e:
+                instruments.finish(stats, error=e)
+                outcome = limiter.classify(e)
+                limiter.release(outcome)
+                if outcome == THROTTLED and limiter.retry():
+                    self.api.log(e, logging.WARNING)
+                    continue
+                if isinstance(e, suds.WebFault):
+                    raise SoapError(str(e))
+                raise
+
+            instruments.finish(stats, result)
+            limiter.release(OK)
+            raise gen.Return(result)
+
+    @gen.coroutine
+    def acquire(self, limiter):
+        wait = limiter.try_acquire()
+        while wait > 0:
+            yield gen.sleep(wait)
+            wait = limiter.try_acquire()
+
+    @gen.coroutine
+    def send(self, stats, method, *args):
+        # calls interleave on the IOLoop thread, so the phases are marked
+        # here rather than by the api's TimingPlugin
+        soap, request = self.envelope(method, *args)
+        binding = soap.method.binding.input
+        stats.sending = time.time()
+        stats.request_bytes = len(request.body)
+
+        try:
+            resp = yield self.http.fetch(request)
+        except HTTPError as e:
+            if e.response is None:
+                raise
+
+            # faults come back as HTTP 500 with a SOAP body
+            stats.received = time.time()
+            stats.response_bytes = len(e.response.body)
+            error = TransportError(str(e), e.code,
+                                   StringIO(e.response.body))
+            result = soap.failed(binding, error)
+        else:
+            stats.received = time.time()
+            stats.response_bytes = len(resp.body)
+            plugins = PluginContainer(self.api.client.options.plugins)
+            reply = plugins.message.received(reply=resp.body).reply
+            result = soap.succeeded(binding, reply)
+
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def checked_call(self, method, *args):
+        resp = yield self.call(method, *args)
+
+        if resp.OverallStatus not in ('OK', 'MoreDataAvailable'):
+            self.api.log(resp, logging.ERROR)
+            raise ExactTargetError(resp.RequestID, resp.Results[0].StatusMessage)
+
+        raise gen.Return(resp)
+
+    def retrieve(self, objtype, props, filter=None):
+        rr = self.api.retrieve_request(objtype, props, filter)
+        return self.checked_call('Retrieve', rr)
+
+    def create(self, objs, options=None):
+        return self.checked_call('Create', options, objs)
+
+    def update(self, objs, options=None):
+        return self.checked_call('Update', options, objs)
+
+    def delete(self, objs, options=None):
+        return self.checked_call('Delete', options, objs)
+
+    def perform(self, action, objs, options=None):
+        if options is None:
+            options = self.api.create('PerformOptions')
+        return self.checked_call('Perform', options, action, objs)
+
+    def get_data_extension(self, de_key, cols, start_date=None,
+                           start_date_field=None, more_data=True):
+        rr = self.api.retrieve_request('DataExtensionObject[' + de_key + ']',
+                                       cols,
+                                       self.api.date_filter(start_date_field,
+                                                            start_date))
+        return PageCursor(self, rr, more_data)
+
+
+class PageCursor(object):
+    # asynchronous iteration over Retrieve pages, one page per fetch_next
+
+    def __init__(self, et, rr, more_data=True):
+        self.et = et
+        self.rr = rr
+        self.more_data = more_data
+        self.page = None
+
+    @property
+    def fetch_next(self):
+        return self._fetch()
+
+    @gen.coroutine
+    def _fetch(self):
+        if self.rr is None:
+            raise gen.Return(False)
+
+        resp = yield self.et.checked_call('Retrieve', self.rr)
+        self.page = self.et.api._deo_to_list(resp)
+
+        if self.more_data and resp.OverallStatus == 'MoreDataAvailable':
+            self.rr = self.et.api.continue_request(resp.RequestID)
+        else:
+            self.rr = None
+
+        raise gen.Return(True)
+
+    def next_object(self):
+        return self.page
@@ -0,0 +1,208 @@
+# Incremental sync of data extensions against a local SQLite index.
+#
+# For each data extension the index keeps a short hash of every row by
+# primary key, plus the newest modified date seen.  A sync only retrieves
+# rows modified since that watermark and reports what actually changed:
+#
+#   sync = DeltaSync(api, '/var/lib/myapp/et-delta.db')
+#   for change in sync.sync('my_de', ['Email', 'Name', 'Modified'],
+#                           key='Email', modified_field='Modified'):
+#       if change.kind == DELETE:
+#           ...
+#       else:
+#           ...change.row...
+#
+# The data extension needs a column holding each row's last modified date;
+# ET doesn't keep one.  Rows are re-fetched from a little before the
+# watermark (overlap) so writes that landed during the last sync aren't
+# missed; the hashes drop the ones that didn't change.
+#
+# Deleted rows don't match a date filter, so with deletes=True the sync
+# also scans just the key column(s) of the whole data extension and
+# reports keys the index has but ET no longer does.  That scan is much
+# smaller than the rows, but still proportional to the table; run it less
+# often than the delta.
+#
+# Changes are reported at least once: the index for a page is committed
+# when the caller asks for the next page, and the watermark only moves
+# once the whole sync has been consumed.
+import collections
+import datetime
+import hashlib
+import sqlite3
+import threading
+import time
+
+INSERT, UPDATE, DELETE = 'insert', 'update', 'delete'
+
+Change = collections.namedtuple('Change', ['kind', 'key', 'row'])
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS watermarks (
+    de_key TEXT PRIMARY KEY,
+    field TEXT NOT NULL,
+    watermark TEXT,
+    synced REAL
+);
+CREATE TABLE IF NOT EXISTS rows (
+    de_key TEXT NOT NULL,
+    pk TEXT NOT NULL,
+    hash BLOB NOT NULL,
+    seen INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (de_key, pk)
+);
+'''
+
+# how ET renders Date columns, and ISO for our own watermarks
+DATE_FORMATS = ('%m/%d/%Y %I:%M:%S %p', '%m/%d/%Y %H:%M:%S', '%m/%d/%Y',
+                '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d')
+
+# separates the parts of a composite key
+KEY_SEP = u'\x1f'
+
+def parse_date(value):
+    if value is None:
+        return None
+    value = value.split('.')[0]
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return None
+
+def row_hash(row, cols):
+    # 8 bytes are plenty to tell whether one row changed
+    data = KEY_SEP.join(u'' if row.get(c) is None else row[c] for c in cols)
+    return sqlite3.Binary(hashlib.sha1(data.encode('utf-8')).digest()[:8])
+
+class DeltaSync(object):
+    def __init__(self, api, path, overlap=300, prefetch=1):
+        self.api = api
+        self.overlap = datetime.timedelta(seconds=overlap)
+        self.prefetch = prefetch
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def watermark(self, de_key):
+        with self.lock:
+            row = self.db.execute('SELECT watermark FROM watermarks '
+                                  'WHERE de_key = ?', (de_key,)).fetchone()
+        return parse_date(row[0]) if row and row[0] else None
+
+    def reset(self, de_key):
+        # forget the index; the next sync reports every row as an insert
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM watermarks WHERE de_key = ?',
+                            (de_key,))
+            self.db.execute('DELETE FROM rows WHERE de_key = ?', (de_key,))
+
+    def sync(self, de_key, cols, key, modified_field, deletes=False):
+        # key is the primary key column, or a tuple of them
+        keys = (key,) if isinstance(key, basestring) else tuple(key)
+        cols = list(cols)
+        for c in keys + (modified_field,):
+            if c not in cols:
+                cols.append(c)
+
+        watermark = self.watermark(de_key)
+        newest = watermark
+        since = None
+        if watermark is not None:
+            since = (watermark - self.overlap).strftime('%Y-%m-%dT%H:%M:%S')
+
+        pages = self.api.get_data_extension(de_key, cols, since,
+                                            modified_field,
+                                            prefetch=self.prefetch,
+                                            row_format='dict')
+        for page in pages:
+            changes = []
+            updates = []
+            hashes = self.hashes(de_key, [self.pk(r, keys) for r in page])
+
+            for row in page:
+                modified = parse_date(row.get(modified_field))
+                if modified is not None and (newest is None or
+                                             modified > newest):
+                    newest = modified
+
+                pk = self.pk(row, keys)
+                h = row_hash(row, cols)
+                old = hashes.get(pk)
+                if old is None:
+                    changes.append(Change(INSERT, pk, row))
+                elif str(old) != str(h):
+                    changes.append(Change(UPDATE, pk, row))
+                else:
+                    continue
+                updates.append((de_key, pk, h))
+
+            for change in changes:
+                yield change
+
+            with self.lock, self.db:
+                self.db.executemany('INSERT OR REPLACE INTO rows '
+                                    '(de_key, pk, hash) VALUES (?, ?, ?)',
+                                    updates)
+
+        if deletes:
+            for change in self.sweep(de_key, keys):
+                yield change
+
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO watermarks '
+                            '(de_key, field, watermark, synced) '
+                            'VALUES (?, ?, ?, ?)',
+                            (de_key, modified_field,
+                             newest and newest.isoformat(), time.time()))
+
+    def sweep(self, de_key, keys):
+        # mark every key ET still has with a new generation, then report
+        # and drop the rest
+        with self.lock:
+            gen = self.db.execute('SELECT COALESCE(MAX(seen), 0) + 1 '
+                                  'FROM rows WHERE de_key = ?',
+                                  (de_key,)).fetchone()[0]
+
+        pages = self.api.get_data_extension(de_key, list(keys),
+                                            prefetch=self.prefetch,
+                                            row_format='dict')
+        for page in pages:
+            with self.lock, self.db:
+                self.db.executemany('UPDATE rows SET seen = ? '
+                                    'WHERE de_key = ? AND pk = ?',
+                                    [(gen, de_key, self.pk(r, keys))
+                                     for r in page])
+
+        with self.lock:
+            gone = self.db.execute('SELECT pk FROM rows '
+                                   'WHERE de_key = ? AND seen < ?',
+                                   (de_key, gen)).fetchall()
+
+        for (pk,) in gone:
+            yield Change(DELETE, pk, None)
+
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM rows WHERE de_key = ? AND seen < ?',
+                            (de_key, gen))
+
+    def pk(self, row, keys):
+        return KEY_SEP.join(row.get(k) or u'' for k in keys)
+
+    def hashes(self, de_key, pks):
+        # stored hashes for a page of keys, in chunks under SQLite's
+        # variable limit
+        found = {}
+        with self.lock:
+            for i in range(0, len(pks), 500):
+                part = pks[i:i + 500]
+                sql = ('SELECT pk, hash FROM rows WHERE de_key = ? AND pk IN '
+                       '(%s)' % ','.join('?' * len(part)))
+                found.update(self.db.execute(sql, [de_key] + part))
+        return found
+
+    def close(self):
+        self.db.close()
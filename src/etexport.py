@@ -0,0 +1,244 @@
+# Streaming export of data extensions to local files.
+#
+# Pages from the paginated Retrieve are decoded straight into tuples
+# (RowDecoder) and written out as they arrive, so memory stays at a page or
+# two whatever the size of the extension.  Output is split into numbered
+# files of rows_per_file rows:
+#
+#   writer = CsvWriter('/data/my_de-%05d.csv')
+#   metrics = export_data_extension(api, 'my_de', ['Email', 'Name'], writer,
+#                                   checkpoint='/data/my_de.checkpoint')
+#   print metrics.rows_per_second
+#
+# With a checkpoint file, every completed file is recorded along with the
+# number of rows written so far and the last of them.  A failed export run
+# again with the same checkpoint runs the query again, skips the rows
+# already in completed files and carries on from the next file, discarding
+# any part written after the checkpoint.  A ContinueRequest can't be used
+# for this: its RequestID is used up once the page after it has been asked
+# for, which with prefetching happens before the page's rows are written,
+# and ET has no way to start a Retrieve part way, so the skipped pages are
+# downloaded again.  The extension mustn't change in between, or the
+# skipped rows won't be the ones already exported: the last of them is
+# checked against the checkpoint and ResumeError raised if they differ.
+# Start over by deleting the checkpoint.
+#
+# ParquetWriter needs pyarrow.
+import csv
+import json
+import os
+import time
+
+from etapi import (ExactTargetError, PageMetrics, RowDecoder, prefetched)
+
+
+class ResumeError(Exception):
+    pass
+
+
+def export_data_extension(api, de_key, cols, writer, checkpoint=None,
+                          filter=None, prefetch=1, progress=None,
+                          progress_interval=10.0):
+    # progress(metrics) is called at most every progress_interval seconds;
+    # returns the PageMetrics for the run
+    state = load_checkpoint(checkpoint)
+    if state.get('done'):
+        return PageMetrics()
+
+    rr = api.retrieve_request('DataExtensionObject[' + de_key + ']', cols,
+                              filter)
+    done = skip = state.get('rows', 0)
+
+    decoder = RowDecoder(cols, 'tuple')
+    metrics = PageMetrics()
+    pages = api.retrieve_pages(rr, metrics=metrics, decode=decoder.decode)
+    if prefetch:
+        pages = prefetched(pages, prefetch)
+
+    writer.start(cols, state.get('part', 0))
+    writer.discard()
+    files = state.get('files', [])
+    last = state.get('last')
+    reported = time.time()
+
+    for page in pages:
+        if page.OverallStatus not in ('OK', 'MoreDataAvailable'):
+            raise ExactTargetError(page.RequestID, page.OverallStatus)
+
+        rows = page.Results
+        if skip:
+            if skip <= len(rows):
+                check_resumed(rows[skip - 1], last, done)
+            rows, skip = rows[skip:], max(0, skip - len(rows))
+        writer.write(rows)
+        done += len(rows)
+        if rows:
+            last = list(rows[-1])
+
+        if writer.full() and page.OverallStatus == 'MoreDataAvailable':
+            files.append(writer.finish_part())
+            save_checkpoint(checkpoint, {'rows': done, 'part': writer.part,
+                                         'files': files, 'last': last})
+
+        if progress is not None and time.time() - reported >= progress_interval:
+            reported = time.time()
+            progress(metrics)
+
+    if skip:
+        raise ResumeError('the export has %d rows, the checkpoint is at row '
+                          '%d' % (done - skip, done))
+
+    path = writer.finish_part()
+    if path is not None:
+        files.append(path)
+    save_checkpoint(checkpoint, {'done': True, 'files': files})
+    return metrics
+
+def check_resumed(row, last, count):
+    # the last row skipped must be the last one exported before; checkpoints
+    # from before the row was recorded aren't checked
+    if last is not None and list(row) != last:
+        raise ResumeError('row %d is %r, not %r as when the checkpoint was '
+                          'saved; the extension has changed, delete the '
+                          'checkpoint to start over' % (count, row, last))
+
+def load_checkpoint(path):
+    if path is None or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_checkpoint(path, state):
+    # written aside and renamed, so a crash leaves the old one intact
+    if path is None:
+        return
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, path)
+
+
+class ChunkedWriter(object):
+    # Base for the file formats: rows go to pattern % part until the part
+    # holds rows_per_file rows.  A part is only opened once it has rows, and
+    # is synced to disk before the export records it as complete.
+
+    def __init__(self, pattern, rows_per_file=250000):
+        self.pattern = pattern
+        self.rows_per_file = rows_per_file
+        self.cols = None
+        self.part = 0
+        self.rows = 0
+        self.out = None
+
+    def start(self, cols, part=0):
+        self.cols = list(cols)
+        self.part = part
+
+    def discard(self):
+        # remove what an earlier run left of this and later parts
+        part = self.part
+        while os.path.exists(self.pattern % part):
+            os.remove(self.pattern % part)
+            part += 1
+
+    def full(self):
+        return self.rows >= self.rows_per_file
+
+    def write(self, rows):
+        if not rows:
+            return
+        if self.out is None:
+            self.path = self.pattern % self.part
+            self.out = self.open(self.path)
+            self.rows = 0
+        self.write_rows(rows)
+        self.rows += len(rows)
+
+    def finish_part(self):
+        # close the current part; returns its path, or None if it had no rows
+        if self.out is None:
+            return None
+        self.close(self.out)
+        self.out = None
+        self.part += 1
+        return self.path
+
+    def open(self, path):
+        return open(path, 'wb')
+
+    def close(self, out):
+        out.flush()
+        os.fsync(out.fileno())
+        out.close()
+
+
+class CsvWriter(ChunkedWriter):
+    def __init__(self, pattern, rows_per_file=250000, header=True, **fmtparams):
+        ChunkedWriter.__init__(self, pattern, rows_per_file)
+        self.header = header
+        self.fmtparams = fmtparams
+
+    def open(self, path):
+        out = ChunkedWriter.open(self, path)
+        self.csv = csv.writer(out, **self.fmtparams)
+        if self.header:
+            self.csv.writerow([c.encode('utf-8') for c in self.cols])
+        return out
+
+    def write_rows(self, rows):
+        # the csv module wants bytes
+        self.csv.writerows([[v.encode('utf-8') if isinstance(v, unicode) else v
+                             for v in row] for row in rows])
+
+
+class JsonLinesWriter(ChunkedWriter):
+    def write_rows(self, rows):
+        cols = self.cols
+        self.out.write(''.join(json.dumps(dict(zip(cols, row))) + '\n'
+                               for row in rows))
+
+
+class ParquetWriter(ChunkedWriter):
+    # every column is a nullable string, as ET returns them; rows are
+    # buffered up to row_group_size per row group
+
+    def __init__(self, pattern, rows_per_file=1000000, row_group_size=50000,
+                 compression='snappy'):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('ParquetWriter needs pyarrow')
+
+        ChunkedWriter.__init__(self, pattern, rows_per_file)
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.buffer = []
+
+    def open(self, path):
+        schema = self.pa.schema([(c, self.pa.string()) for c in self.cols])
+        return self.pq.ParquetWriter(path, schema,
+                                     compression=self.compression)
+
+    def write_rows(self, rows):
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.row_group_size:
+            self.flush_buffer(self.out)
+
+    def flush_buffer(self, out):
+        if not self.buffer:
+            return
+        columns = zip(*self.buffer)
+        arrays = [self.pa.array(list(values), type=self.pa.string())
+                  for values in columns]
+        out.write_table(self.pa.Table.from_arrays(arrays, names=self.cols))
+        self.buffer = []
+
+    def close(self, out):
+        self.flush_buffer(out)
+        out.close()
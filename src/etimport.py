@@ -0,0 +1,247 @@
+# Bulk loads through file imports.
+#
+# Past a few hundred thousand rows SOAP upserts cost far more than handing
+# ET a file.  A FileImporter streams the rows into delimited files of
+# rows_per_file rows, compresses and drops them on a worker pool while the
+# next one is being written, and has an existing ImportDefinition load each
+# in turn, pointing it at the file before starting it and waiting for the
+# import to finish before starting the next:
+#
+#   importer = FileImporter(api, 'my_de', 'my_de_import',
+#                           FtpDrop('ftp.s6.exacttarget.com', user, password))
+#   load = importer.load(rows)
+#   print load.method, load.rows, [job.status for job in load.results]
+#
+# Loads smaller than threshold rows go through add_to_data_extension
+# instead, so load() suits any size; load.results then holds ObjectResults
+# rather than import Jobs.  LocalDirectoryDrop stands in for the FTP folder
+# when testing.
+#
+# The definition's destination and field mapping stay as configured in ET;
+# only FileSpec, FileType, Delimiter and HeaderLines are set.  Files are
+# UTF-8 with a header line, zipped, and named after the import key.
+import collections
+import csv
+import ftplib
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+import Queue
+
+from multiprocessing.pool import ThreadPool
+
+from etapi import ExactTargetError
+from etjobs import JobTracker
+
+# rows below which a load goes through SOAP upserts
+IMPORT_THRESHOLD = 250000
+
+# FileType of the definition for a delimiter
+FILE_TYPES = {',': 'CSV', '\t': 'TAB'}
+
+# method is 'soap' or 'import'; results holds an ObjectResult per row or a
+# Job per file
+Load = collections.namedtuple('Load', ['method', 'rows', 'results'])
+
+class FileImporter(object):
+    def __init__(self, api, de_key, import_key, drop, cols=None,
+                 threshold=IMPORT_THRESHOLD, rows_per_file=2000000,
+                 delimiter=',', workers=2, work_dir=None, tracker=None,
+                 poll_interval=30.0):
+        self.api = api
+        self.de_key = de_key
+        self.import_key = import_key
+        self.drop = drop
+        self.cols = cols
+        self.threshold = threshold
+        self.rows_per_file = rows_per_file
+        self.delimiter = delimiter
+        self.workers = workers
+        self.work_dir = work_dir
+        self.tracker = tracker
+        self.poll_interval = poll_interval
+
+    def load(self, rows):
+        # buffer up to threshold rows to see which way to go
+        rows = iter(rows)
+        head = list(itertools.islice(rows, self.threshold))
+        if len(head) < self.threshold:
+            return Load('soap', len(head),
+                        self.api.add_to_data_extension(self.de_key, head))
+        return self.import_rows(itertools.chain(head, rows))
+
+    def import_rows(self, rows):
+        # write the files here, compress and drop them on the pool, and
+        # import them one by one on another thread as they become ready.
+        # The first error stops the load: files not yet imported are
+        # skipped and an import being waited for is left running in ET
+        work_dir = tempfile.mkdtemp(prefix='etimport-', dir=self.work_dir)
+        pool = ThreadPool(self.workers)
+        ready = Queue.Queue(self.workers)
+        jobs = []
+        errors = []
+        stop = threading.Event()
+
+        # a tracker of the caller's is started if it hasn't been, and left
+        # running for the caller to close
+        tracker = self.tracker
+        if tracker is None:
+            tracker = JobTracker(self.api, self.poll_interval)
+        tracker.start()
+
+        # imports are started on the loader thread, which builds them from
+        # stubs of prototypes made here
+        for objtype in ('ImportDefinition', 'PerformOptions'):
+            self.api.stub(objtype)
+
+        importer = threading.Thread(target=self.run_imports,
+                                    args=(ready, tracker, jobs, errors, stop))
+        importer.daemon = True
+        importer.start()
+
+        stamp = time.strftime('%Y%m%d%H%M%S')
+        count = 0
+        try:
+            for part, chunk in enumerate(self.parts(rows)):
+                if stop.is_set():
+                    break
+                name = '%s-%s-%05d.csv' % (self.import_key, stamp, part)
+                path = os.path.join(work_dir, name)
+                count += self.write(path, chunk)
+                ready.put(pool.apply_async(self.pack, (path, name)))
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            ready.put(None)
+            importer.join()
+            pool.close()
+            pool.join()
+            if self.tracker is None:
+                tracker.close()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return Load('import', count, jobs)
+
+    def parts(self, rows):
+        while True:
+            chunk = itertools.islice(rows, self.rows_per_file)
+            first = next(chunk, None)
+            if first is None:
+                return
+            yield itertools.chain([first], chunk)
+
+    def write(self, path, rows):
+        rows = iter(rows)
+        first = next(rows)
+        cols = self.cols or sorted(first)
+
+        with open(path, 'wb') as f:
+            out = csv.DictWriter(f, cols, restval='',
+                                 delimiter=self.delimiter,
+                                 lineterminator='\r\n')
+            out.writerow(dict((c, c.encode('utf-8')) for c in cols))
+
+            count = 0
+            for row in itertools.chain([first], rows):
+                out.writerow(dict((k, v.encode('utf-8')
+                                   if isinstance(v, unicode) else v)
+                                  for k, v in row.iteritems()))
+                count += 1
+        return count
+
+    def pack(self, path, name):
+        # zip the file and hand it to the drop; returns the file name
+        zipped = path + '.zip'
+        with zipfile.ZipFile(zipped, 'w', zipfile.ZIP_DEFLATED,
+                             allowZip64=True) as z:
+            z.write(path, name)
+        os.remove(path)
+
+        self.drop.put(zipped, name + '.zip')
+        return name + '.zip'
+
+    def run_imports(self, ready, tracker, jobs, errors, stop):
+        # imports of one definition can't overlap, so each waits for the
+        # last; once the load is stopped the remaining files are only
+        # drained
+        while True:
+            packed = ready.get()
+            if packed is None:
+                return
+            if stop.is_set():
+                continue
+
+            try:
+                name = packed.get()
+                settings = {'FileSpec': name,
+                            'FileType': FILE_TYPES.get(self.delimiter, 'Other'),
+                            'HeaderLines': 1}
+                if settings['FileType'] == 'Other':
+                    settings['Delimiter'] = self.delimiter
+
+                task = self.api.run_import(self.import_key, **settings)
+                if task is None:
+                    raise ExactTargetError(None, 'import %s started no task'
+                                           % self.import_key)
+
+                pending = tracker.track_import(task)
+                while not pending.ready():
+                    if stop.wait(0.5):
+                        break
+                else:
+                    jobs.append(pending.get())
+            except Exception:
+                errors.append(sys.exc_info())
+                stop.set()
+
+
+class LocalDirectoryDrop(object):
+    # files land in a local directory, e.g. a mounted share or a test
+    # stand-in for the FTP import folder; renamed into place once complete
+
+    def __init__(self, path):
+        self.path = path
+
+    def put(self, local_path, name):
+        target = os.path.join(self.path, name)
+        shutil.move(local_path, target + '.part')
+        os.rename(target + '.part', target)
+
+
+class FtpDrop(object):
+    # files are uploaded to directory on ET's FTP server, over TLS unless
+    # tls is False; a connection per upload, as they run in parallel
+
+    def __init__(self, host, user, password, directory='Import', tls=True,
+                 timeout=300):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.directory = directory
+        self.tls = tls
+        self.timeout = timeout
+
+    def put(self, local_path, name):
+        if self.tls:
+            ftp = ftplib.FTP_TLS(self.host, timeout=self.timeout)
+            ftp.login(self.user, self.password)
+            ftp.prot_p()
+        else:
+            ftp = ftplib.FTP(self.host, timeout=self.timeout)
+            ftp.login(self.user, self.password)
+
+        try:
+            ftp.cwd(self.directory)
+            with open(local_path, 'rb') as f:
+                ftp.storbinary('STOR ' + name, f, 1 << 20)
+        finally:
+            ftp.quit()
+        os.remove(local_path)
@@ -0,0 +1,230 @@
+# Completion tracking for asynchronous work.
+#
+# Asynchronous Creates (upsert_data_extension's default) and started imports
+# return as soon as ET has queued them.  A JobTracker takes their RequestIDs
+# and import task IDs and polls them all together in periodic sweeps - the
+# ResultMessage of up to 500 requests, or the ImportResultsSummary of up to
+# 500 imports, per Retrieve - and hands back a PendingResult for each that
+# receives a Job once the work is done:
+#
+#   tracker = JobTracker(api, interval=30)
+#   tracker.start()
+#
+#   job = tracker.track_import(api.run_import('nightly_import'))
+#   job.add_callback(lambda job: log(job.status, job.errors))
+#
+#   results = api.add_to_data_extension('my_de', rows)
+#   for job in tracker.track_results(results):
+#       print job.get().failures
+#
+#   tracker.close()
+#
+# A sweep polls at most max_per_sweep jobs of each kind, those polled least
+# recently first, so the overhead stays bounded however many imports run
+# in parallel; the Retrieves go through the api's rate limiter like any
+# other call.  A job still unfinished after timeout seconds is given up
+# with status TIMEOUT.
+#
+# The schema has no AsyncActivityStatus object, so a request counts as done
+# once ET has written its ResultMessage; the objects it rejected are read
+# from its ResultItems.
+import collections
+import logging
+import threading
+import time
+
+from etapi import (ExactTargetError, Field, MAX_IN_VALUES, ObjectResult,
+                   PendingResult)
+
+# kinds of tracked job
+REQUEST, IMPORT = 'request', 'import'
+
+# ImportStatus values of a finished import
+IMPORT_DONE = ('Completed', 'Error', 'Canceled')
+
+TIMEOUT = 'Timeout'
+
+MESSAGE_PROPS = ['RequestID', 'OverallStatusCode', 'StatusCode',
+                 'StatusMessage']
+ITEM_PROPS = ['RequestID', 'OrdinalID', 'StatusCode', 'StatusMessage',
+              'ErrorCode']
+SUMMARY_PROPS = ['TaskResultID', 'ImportStatus', 'TotalRows',
+                 'NumberSuccessful', 'NumberDuplicated', 'NumberErrors']
+
+# status is the request's OverallStatusCode or the import's ImportStatus;
+# total, succeeded and errors count rows of an import, failures holds an
+# ObjectResult for each object of a request ET rejected
+Job = collections.namedtuple('Job', ['kind', 'id', 'status', 'message',
+                                     'total', 'succeeded', 'errors',
+                                     'failures'])
+
+class JobTracker(object):
+    def __init__(self, api, interval=30.0, max_per_sweep=MAX_IN_VALUES,
+                 timeout=24 * 3600):
+        self.api = api
+        self.interval = interval
+        self.max_per_sweep = max_per_sweep
+        self.timeout = timeout
+
+        # id -> (PendingResult, time tracked), least recently polled first
+        self.jobs = {REQUEST: collections.OrderedDict(),
+                     IMPORT: collections.OrderedDict()}
+        self.lock = threading.Lock()
+
+        # sweeps build their requests from stubs on the tracker's thread;
+        # the prototypes come from the factory here
+        for objtype in ('RetrieveRequest', 'SimpleFilterPart',
+                        'ComplexFilterPart'):
+            api.stub(objtype)
+
+        self.thread = None
+        self.closed = threading.Event()
+
+    def track_request(self, request_id):
+        return self.track(REQUEST, request_id)
+
+    def track_import(self, task_id):
+        # run_import gives None when ET didn't say which task it started
+        if task_id is None:
+            raise ValueError('no import task ID to track')
+        return self.track(IMPORT, str(task_id))
+
+    def track_results(self, results):
+        # a PendingResult per distinct request among the ObjectResults of a
+        # bulk call, in order
+        ids = collections.OrderedDict((r.request_id, True) for r in results
+                                      if r.request_id is not None)
+        return [self.track_request(i) for i in ids]
+
+    def track(self, kind, job_id):
+        with self.lock:
+            entry = self.jobs[kind].get(job_id)
+            if entry is None:
+                entry = self.jobs[kind][job_id] = (PendingResult(),
+                                                   time.time())
+        return entry[0]
+
+    def pending(self):
+        with self.lock:
+            return sum(len(jobs) for jobs in self.jobs.values())
+
+    def start(self):
+        # a tracker already started is left as it is
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        while not self.closed.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                self.api.log(e, logging.ERROR)
+
+    def sweep(self):
+        # poll one round of jobs; returns the number that finished
+        done = 0
+        for kind, poll in ((REQUEST, self.poll_requests),
+                           (IMPORT, self.poll_imports)):
+            ids = self.due(kind)
+            if ids:
+                for job in poll(ids):
+                    done += self.finish(kind, job)
+        return done + self.expire()
+
+    def due(self, kind):
+        # the max_per_sweep least recently polled, moved to the back
+        with self.lock:
+            jobs = self.jobs[kind]
+            ids = list(jobs)[:self.max_per_sweep]
+            for i in ids:
+                jobs[i] = jobs.pop(i)
+        return ids
+
+    def finish(self, kind, job):
+        with self.lock:
+            entry = self.jobs[kind].pop(job.id, None)
+        if entry is None:
+            return 0
+        entry[0].set(job)
+        return 1
+
+    def expire(self):
+        cutoff = time.time() - self.timeout
+        expired = []
+        with self.lock:
+            for kind, jobs in self.jobs.items():
+                for job_id, (pending, tracked) in jobs.items():
+                    if tracked < cutoff:
+                        del jobs[job_id]
+                        expired.append((pending, Job(kind, job_id, TIMEOUT,
+                                                     None, None, None, None,
+                                                     [])))
+        for pending, job in expired:
+            pending.set(job)
+        return len(expired)
+
+    def poll_requests(self, ids):
+        messages = dict((unicode(m.RequestID), m) for m in
+                        self.retrieve('ResultMessage', MESSAGE_PROPS,
+                                      Field('RequestID').in_(ids)))
+        if not messages:
+            return []
+
+        failures = collections.defaultdict(list)
+        where = (Field('RequestID').in_(list(messages)) &
+                 (Field('StatusCode') == 'Error'))
+        for item in self.retrieve('ResultItem', ITEM_PROPS, where):
+            failures[unicode(item.RequestID)].append(
+                ObjectResult(getattr(item, 'OrdinalID', None), item.StatusCode,
+                             getattr(item, 'StatusMessage', None),
+                             getattr(item, 'ErrorCode', None),
+                             request_id=item.RequestID))
+
+        jobs = []
+        for request_id, m in messages.items():
+            status = (getattr(m, 'OverallStatusCode', None) or
+                      getattr(m, 'StatusCode', None))
+            errors = failures.get(request_id, [])
+            jobs.append(Job(REQUEST, request_id, status,
+                            getattr(m, 'StatusMessage', None), None, None,
+                            len(errors), errors))
+        return jobs
+
+    def poll_imports(self, ids):
+        jobs = []
+        for s in self.retrieve('ImportResultsSummary', SUMMARY_PROPS,
+                               Field('TaskResultID').in_(ids)):
+            status = getattr(s, 'ImportStatus', None)
+            if status not in IMPORT_DONE:
+                continue
+            jobs.append(Job(IMPORT, str(s.TaskResultID), status, None,
+                            getattr(s, 'TotalRows', None),
+                            getattr(s, 'NumberSuccessful', None),
+                            getattr(s, 'NumberErrors', None), []))
+        return jobs
+
+    def retrieve(self, objtype, props, where):
+        for f in where.split(MAX_IN_VALUES):
+            rr = self.api.stub('RetrieveRequest', ObjectType=objtype,
+                               Properties=props, Filter=f.build(self.api))
+            for page in self.api.retrieve_pages(rr):
+                if page.OverallStatus not in ('OK', 'MoreDataAvailable'):
+                    raise ExactTargetError(page.RequestID, page.OverallStatus)
+                for r in getattr(page, 'Results', []):
+                    yield r
+
+    def close(self, wait=False):
+        # with wait, keep sweeping until every job has finished or timed out
+        if wait:
+            while self.pending():
+                self.sweep()
+                if self.pending():
+                    time.sleep(self.interval)
+
+        self.closed.set()
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,276 @@
+# Durable write-behind queue in front of an ExactTargetAPI.
+#
+# Writes are committed to a local SQLite file and return straight away; a
+# background thread delivers them in batches grouped by target (data
+# extension, subscribers, triggered send definition).  Nothing is removed
+# from the file until ET has accepted it, so after a crash the queue simply
+# resumes where it was.
+#
+#   api = ExactTargetAPI(username, password, workers=4)
+#   api.init_client()
+#   q = WriteQueue(api, '/var/lib/myapp/et-queue.db')
+#   q.start()
+#
+#   q.put_rows('my_de', [{'Email': 'a@example.com', 'Name': 'A'}],
+#              key='Email')
+#   q.put_subscriber({'email': 'a@example.com', 'lists': [1234]})
+#   q.put_triggered_send('welcome', 'a@example.com', 'a@example.com')
+#
+#   q.close()
+#
+# Writes with a key are idempotent: queueing the same key again replaces
+# the pending write, so replaying a source after a crash doesn't duplicate
+# anything.  Data extension rows and subscribers are sent as upserts, so
+# redelivering a batch whose outcome was lost is harmless too; triggered
+# sends are delivered at least once.
+#
+# A batch that fails as a whole (fault, network, throttling) is retried
+# with backoff and dead-lettered after max_attempts; a row ET rejects is
+# dead-lettered at once, since resending the same data won't help.
+import collections
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from etapi import (MAX_BACKOFF, MAX_BATCH_OBJECTS, MAX_SUBSCRIBER_BATCH,
+                   TriggeredSendBatcher)
+
+# kinds of queued write
+ROWS, SUBSCRIBER, TRIGGERED_SEND = 'rows', 'subscriber', 'triggered_send'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS writes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    target TEXT NOT NULL,
+    key TEXT,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    due REAL NOT NULL DEFAULT 0,
+    dead INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS writes_key ON writes (kind, target, key);
+CREATE INDEX IF NOT EXISTS writes_due ON writes (dead, due, id);
+'''
+
+DeadLetter = collections.namedtuple('DeadLetter', ['id', 'kind', 'target',
+                                                   'key', 'payload',
+                                                   'attempts', 'error'])
+
+class WriteQueue(object):
+    def __init__(self, api, path, batch_size=MAX_BATCH_OBJECTS,
+                 flush_interval=1.0, max_attempts=8, retry_backoff=1.0):
+        self.api = api
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+
+        # one connection shared by callers and the flusher; WAL keeps the
+        # inserts from request handlers cheap while a flush reads
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+        self.batcher = None
+        self.thread = None
+        self.closed = threading.Event()
+        self.wakeup = threading.Event()
+        self.unflushed = 0
+
+    def put_rows(self, de_key, rows, key=None):
+        # key names the column that identifies a row, e.g. its primary key
+        self.put(ROWS, de_key, [(row[key] if key else None, row)
+                                for row in rows])
+
+    def put_subscriber(self, record):
+        # record as for ExactTargetAPI.upsert_subscribers; lists must be
+        # IDs or names so the record can be stored
+        self.put(SUBSCRIBER, '', [(record.get('key', record['email']),
+                                   record)])
+
+    def put_triggered_send(self, tsd_key, email, subscriberkey, attribs=None,
+                           key=None):
+        # key, if given, makes the send idempotent, e.g. an order number
+        self.put(TRIGGERED_SEND, tsd_key,
+                 [(key, {'email': email, 'key': subscriberkey,
+                         'attributes': attribs})])
+
+    def put(self, kind, target, entries):
+        now = time.time()
+        params = [(kind, target, key, json.dumps(payload), now)
+                  for key, payload in entries]
+
+        with self.lock, self.db:
+            self.db.executemany('INSERT OR REPLACE INTO writes '
+                                '(kind, target, key, payload, created) '
+                                'VALUES (?, ?, ?, ?, ?)', params)
+            self.unflushed += len(params)
+            full = self.unflushed >= self.batch_size
+
+        if full:
+            self.wakeup.set()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while not self.closed.is_set():
+            try:
+                sent = self.flush()
+            except Exception as e:
+                # e.g. the database is locked by another process
+                self.api.log(e, logging.ERROR)
+                sent = 0
+
+            if not sent:
+                self.wakeup.wait(self.flush_interval)
+                self.wakeup.clear()
+
+    def flush(self, limit=None):
+        # deliver up to limit (default several batches) of the writes that
+        # are due; returns how many were attempted
+        limit = limit or self.batch_size * max(1, self.api.workers)
+        with self.lock:
+            self.unflushed = 0
+            rows = self.db.execute('SELECT id, kind, target, payload, attempts '
+                                   'FROM writes WHERE dead = 0 AND due <= ? '
+                                   'ORDER BY id LIMIT ?',
+                                   (time.time(), limit)).fetchall()
+
+        groups = collections.OrderedDict()
+        for id, kind, target, payload, attempts in rows:
+            groups.setdefault((kind, target), []).append(
+                (id, json.loads(payload), attempts))
+
+        for (kind, target), writes in groups.items():
+            deliver = getattr(self, 'deliver_' + kind)
+            self.settle(writes, deliver(target, [w[1] for w in writes]))
+
+        return len(rows)
+
+    def deliver_rows(self, de_key, rows):
+        return self.outcomes(len(rows), self.api.upsert_data_extension(
+            de_key, rows, self.batch_size, async=False))
+
+    def deliver_subscriber(self, target, records):
+        return self.outcomes(len(records), self.api.upsert_subscribers(
+            records, batch_size=min(self.batch_size, MAX_SUBSCRIBER_BATCH)))
+
+    def deliver_triggered_send(self, tsd_key, sends):
+        # the flusher batches sends itself, so the batcher needs no timer
+        if self.batcher is None:
+            self.batcher = TriggeredSendBatcher(self.api, timer=False)
+
+        results = self.batcher.deliver(tsd_key, [(send['email'], send['key'],
+                                                  send['attributes'])
+                                                 for send in sends])
+
+        outcomes = []
+        for r in results:
+            if r.ok:
+                outcomes.append((True, None))
+            elif r.request_id is None:
+                # the call itself failed, nothing was sent
+                outcomes.append((None, r.message))
+            else:
+                outcomes.append((False, r.message))
+        return outcomes
+
+    def outcomes(self, count, results):
+        # (True, None) for delivered, (False, message) for rejected and
+        # (None, message) for writes whose batch failed and should be retried
+        outcomes = [(None, 'no result')] * count
+        try:
+            for r in results:
+                if r.index < count:
+                    outcomes[r.index] = (r.ok, None if r.ok else r.message)
+        except Exception as e:
+            self.api.log(e, logging.WARNING)
+            outcomes = [o if o[0] is not None else (None, str(e))
+                        for o in outcomes]
+        return outcomes
+
+    def settle(self, writes, outcomes):
+        done = []
+        dead = []
+        retry = []
+        now = time.time()
+
+        for (id, payload, attempts), (ok, error) in zip(writes, outcomes):
+            if ok:
+                done.append((id,))
+            elif ok is False or attempts + 1 >= self.max_attempts:
+                dead.append((attempts + 1, error, id))
+            else:
+                delay = min(MAX_BACKOFF, self.retry_backoff * 2 ** attempts)
+                retry.append((attempts + 1, now + delay, error, id))
+
+        with self.lock, self.db:
+            self.db.executemany('DELETE FROM writes WHERE id = ?', done)
+            self.db.executemany('UPDATE writes SET attempts = ?, dead = 1, '
+                                'error = ? WHERE id = ?', dead)
+            self.db.executemany('UPDATE writes SET attempts = ?, due = ?, '
+                                'error = ? WHERE id = ?', retry)
+
+    def pending(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM writes '
+                                   'WHERE dead = 0').fetchone()[0]
+
+    def dead_letters(self, kind=None):
+        sql = ('SELECT id, kind, target, key, payload, attempts, error '
+               'FROM writes WHERE dead = 1')
+        args = ()
+        if kind is not None:
+            sql += ' AND kind = ?'
+            args = (kind,)
+
+        with self.lock:
+            rows = self.db.execute(sql + ' ORDER BY id', args).fetchall()
+        return [DeadLetter(id, kind, target, key, json.loads(payload),
+                           attempts, error)
+                for id, kind, target, key, payload, attempts, error in rows]
+
+    def retry_dead(self, ids=None):
+        # put dead letters (all, or the given ids) back in the queue
+        sql = 'UPDATE writes SET dead = 0, attempts = 0, due = 0 WHERE dead = 1'
+        with self.lock, self.db:
+            if ids is None:
+                self.db.execute(sql)
+            else:
+                self.db.executemany(sql + ' AND id = ?', [(i,) for i in ids])
+        self.wakeup.set()
+
+    def discard_dead(self, ids=None):
+        sql = 'DELETE FROM writes WHERE dead = 1'
+        with self.lock, self.db:
+            if ids is None:
+                self.db.execute(sql)
+            else:
+                self.db.executemany(sql + ' AND id = ?', [(i,) for i in ids])
+
+    def close(self, drain=True):
+        # stop the flusher; with drain, first deliver whatever is due
+        self.closed.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        if drain:
+            while self.flush():
+                pass
+
+        if self.batcher is not None:
+            self.batcher.close()
+        self.db.close()
@@ -0,0 +1,177 @@
+# Bulk extraction of tracking events.
+#
+# Retrieves every SentEvent, OpenEvent, ClickEvent, BounceEvent and
+# UnsubEvent for a set of sends or a date window.  The work is cut into
+# independent Retrieves - per event type, per chunk of SendIDs and per time
+# slice - run on the api's worker pool, each following its pages to the
+# end.  Replies are decoded straight into Event tuples and handed back a
+# page at a time as they arrive, so a consumer can ship them on while the
+# rest is still being fetched:
+#
+#   api = ExactTargetAPI(username, password, workers=8)
+#   api.init_client()
+#   extractor = EventExtractor(api)
+#
+#   for events in extractor.by_sends(send_ids):
+#       sink.write(events)
+#
+#   for events in extractor.by_window(start, end,
+#                                     slice=datetime.timedelta(hours=1)):
+#       sink.write(events)
+#
+# Time slices are half-open, so consecutive slices never return the same
+# event; duplicates ET returns across the pages of a Retrieve are dropped
+# using a bounded window of the events it returned last.
+import collections
+import datetime
+import sys
+import threading
+import Queue
+
+from etapi import (ExactTargetError, Field, MAX_IN_VALUES, ObjectDecoder,
+                   chunks)
+
+EVENT_TYPES = ('SentEvent', 'OpenEvent', 'ClickEvent', 'BounceEvent',
+               'UnsubEvent')
+
+# properties retrieved for each type; Event holds the union
+COMMON_PROPS = ['SendID', 'SubscriberKey', 'EventDate', 'BatchID']
+EVENT_PROPS = {
+    'ClickEvent': COMMON_PROPS + ['URL'],
+    'BounceEvent': COMMON_PROPS + ['BounceCategory', 'SMTPCode'],
+}
+
+# rows in a page of a Retrieve reply
+PAGE_SIZE = 2500
+
+Event = collections.namedtuple('Event', ['type', 'send_id', 'subscriber_key',
+                                         'event_date', 'batch_id', 'url',
+                                         'bounce_category', 'smtp_code'])
+
+class EventExtractor(object):
+    def __init__(self, api, event_types=EVENT_TYPES, sends_per_request=MAX_IN_VALUES,
+                 dedupe_window=2 * PAGE_SIZE, queue_depth=16):
+        # dedupe_window events are remembered per Retrieve running, and
+        # forgotten once it ends
+        self.api = api
+        self.event_types = event_types
+        self.sends_per_request = sends_per_request
+        self.dedupe_window = dedupe_window
+        self.queue_depth = queue_depth
+
+    def by_sends(self, send_ids, start=None, end=None, slice=None):
+        # events of the given sends, optionally within [start, end) cut
+        # into slices
+        units = []
+        for ids in chunks(list(send_ids), self.sends_per_request):
+            where = Field('SendID').in_(ids)
+            for window in self.windows(start, end, slice):
+                units.extend((t, where if window is None else where & window)
+                             for t in self.event_types)
+        return self.extract(units)
+
+    def by_window(self, start, end, slice=datetime.timedelta(hours=1)):
+        # every event in [start, end)
+        units = [(t, window) for window in self.windows(start, end, slice)
+                 for t in self.event_types]
+        return self.extract(units)
+
+    def windows(self, start, end, slice):
+        if start is None and end is None:
+            return [None]
+
+        if slice is None or start is None or end is None:
+            return [self.window(start, end)]
+
+        windows = []
+        while start < end:
+            windows.append(self.window(start, min(start + slice, end)))
+            start += slice
+        return windows
+
+    def window(self, start, end):
+        if start is None:
+            return Field('EventDate') < end
+        if end is None:
+            return Field('EventDate') >= start
+        return (Field('EventDate') >= start) & (Field('EventDate') < end)
+
+    def extract(self, units):
+        # run every (event type, filter) Retrieve on the worker pool and
+        # yield lists of new Events a page at a time, in arrival order
+        q = Queue.Queue(self.queue_depth)
+        stop = threading.Event()
+        done = object()
+        pool = self.api.executor()
+
+        def put(entry):
+            # gives up once the consumer has gone, freeing the worker
+            while not stop.is_set():
+                try:
+                    q.put(entry, timeout=0.5)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+
+        def run(unit, event_type, rr):
+            if stop.is_set():
+                return
+            try:
+                for page in self.pages(event_type, rr):
+                    if not put((unit, page, None)):
+                        return
+            except Exception:
+                put((unit, None, sys.exc_info()))
+            put((unit, done, None))
+
+        # requests are built here, suds factories aren't shared safely
+        for unit, (event_type, where) in enumerate(units):
+            props = EVENT_PROPS.get(event_type, COMMON_PROPS)
+            rr = self.api.retrieve_request(event_type, props, where)
+            pool.apply_async(run, (unit, event_type, rr))
+
+        # events recently returned by each running Retrieve, keyed on what
+        # identifies an event; a Retrieve is of one type
+        seen = collections.defaultdict(collections.OrderedDict)
+        remaining = len(units)
+
+        try:
+            while remaining:
+                unit, page, error = q.get()
+                if error is not None:
+                    raise error[0], error[1], error[2]
+                if page is done:
+                    seen.pop(unit, None)
+                    remaining -= 1
+                    continue
+
+                recent = seen[unit]
+                events = []
+                for event in page:
+                    key = (event.send_id, event.subscriber_key,
+                           event.event_date, event.url)
+                    if key in recent:
+                        continue
+                    recent[key] = True
+                    if len(recent) > self.dedupe_window:
+                        recent.popitem(last=False)
+                    events.append(event)
+
+                if events:
+                    yield events
+        finally:
+            stop.set()
+
+    def pages(self, event_type, rr):
+        decoder = ObjectDecoder(EVENT_PROPS.get(event_type, COMMON_PROPS),
+                                'dict')
+
+        for page in self.api.retrieve_pages(rr, decode=decoder.decode):
+            if page.OverallStatus not in ('OK', 'MoreDataAvailable'):
+                raise ExactTargetError(page.RequestID, page.OverallStatus)
+
+            yield [Event(event_type, r['SendID'], r['SubscriberKey'],
+                         r['EventDate'], r['BatchID'], r.get('URL'),
+                         r.get('BounceCategory'), r.get('SMTPCode'))
+                   for r in page.Results]
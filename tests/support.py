@@ -0,0 +1,38 @@
+# Shared test setup: src/ and bench/ on the path, and ExactTargetAPI
+# instances on the bundled schema, optionally pointed at a MockServer.
+#
+#   python -m unittest discover -s tests
+import os
+import sys
+import tempfile
+
+from xml.etree import cElementTree as ElementTree
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path[:0] = [os.path.join(ROOT, 'src'), os.path.join(ROOT, 'bench')]
+
+import etapi
+
+LOG_PATH = tempfile.gettempdir()
+
+WSSE_NS = ('{http://docs.oasis-open.org/wss/2004/01/'
+           'oasis-200401-wss-wssecurity-secext-1.0.xsd}')
+
+def make_api(username='test', password='secret', server=None, **options):
+    api = etapi.ExactTargetAPI(username, password, log_path=LOG_PATH,
+                               offline=True, **options)
+    api.init_client()
+    if server is not None:
+        api.client.set_options(location=server.url)
+    return api
+
+def credentials(envelope):
+    # (username, password) of an envelope's UsernameToken, or None
+    if isinstance(envelope, unicode):
+        envelope = envelope.encode('utf-8')
+    root = ElementTree.fromstring(envelope)
+    token = root.find('.//%sUsernameToken' % WSSE_NS)
+    if token is None:
+        return None
+    return (token.findtext(WSSE_NS + 'Username'),
+            token.findtext(WSSE_NS + 'Password'))
@@ -0,0 +1,1031 @@
+import BaseHTTPServer
+import datetime
+import os
+import re
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+
+from xml.etree import cElementTree as ElementTree
+
+from support import LOG_PATH, credentials, make_api
+
+import etapi
+import suds
+from mockserver import (ENVELOPE, MockServer, Schema, deo_row, object_row,
+                        retrieve_response, write_response)
+
+
+SOAP_BODY = '{http://schemas.xmlsoap.org/soap/envelope/}Body'
+XSI_NIL = '{http://www.w3.org/2001/XMLSchema-instance}nil'
+
+
+class CredentialsTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MockServer(record=True).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_marshalled_envelope(self):
+        api = make_api('user-a', 'secret-a')
+        env = api.envelope('Retrieve', api.retrieve_request('List', ['ID']))
+        self.assertEqual(credentials(env), ('user-a', 'secret-a'))
+
+    def test_sent_requests(self):
+        api = make_api('user-a', 'secret-a', self.server, workers=2)
+        api.service.Retrieve(api.retrieve_request('List', ['ID']))
+
+        # worker threads send on clones of the client
+        rr = api.retrieve_request('List', ['ID'])
+        list(api.map_calls('Retrieve', [(rr,)] * 4))
+        api.close()
+
+        self.assertEqual(len(self.server.received), 5)
+        for body in self.server.received:
+            self.assertEqual(credentials(body), ('user-a', 'secret-a'))
+
+    def test_schema_client_has_no_credentials(self):
+        api = make_api('user-a', 'secret-a')
+        self.assertIsNone(api.client.wsdl.options.wsse)
+        self.assertIsNone(api.client.options.wsse)
+
+
+class AccountLimiterTest(unittest.TestCase):
+    def test_later_instance_settings_honored(self):
+        first = make_api('limited-a')
+        second = make_api('limited-a', workers=8, rate=50)
+
+        limiter = second.account_limiter()
+        self.assertIs(limiter, first.account_limiter())
+        self.assertEqual((limiter.max_concurrency, limiter.limit,
+                          limiter.rate), (8, 8, 50))
+
+        # a smaller instance doesn't lower them
+        make_api('limited-a', workers=2).account_limiter()
+        self.assertEqual((limiter.max_concurrency, limiter.rate), (8, 50))
+
+    def test_conflicting_rates_rejected(self):
+        make_api('limited-b', rate=10).account_limiter()
+        api = make_api('limited-b', rate=20)
+        self.assertRaises(ValueError, api.account_limiter)
+
+    def test_concurrent_calls_on_one_account(self):
+        server = MockServer(latency=0.1).start()
+        try:
+            make_api('limited-c', server=server).account_limiter()
+            api = make_api('limited-c', server=server, workers=8)
+            rr = api.retrieve_request('List', ['ID'])
+            start = time.time()
+            list(api.map_calls('Retrieve', [(rr,)] * 8))
+            elapsed = time.time() - start
+            api.close()
+        finally:
+            server.stop()
+
+        # one at a time would take 0.8s
+        self.assertLess(elapsed, 0.5)
+
+
+class LookupCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MockServer().start()
+        self.server.rows['List'] = self.server.rows['DataFolder'] = 1
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_hits(self):
+        api = make_api(server=self.server)
+        first = api.get_subscriber_list('x')
+        self.assertEqual(api.get_subscriber_list('x').ID, first.ID)
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(api.lookups.stats()['hits'], 1)
+
+        # misses aren't cached
+        self.server.rows['List'] = 0
+        api.get_subscriber_list('y')
+        api.get_subscriber_list('y')
+        self.assertEqual(self.server.requests, 3)
+
+    def test_callers_get_copies(self):
+        api = make_api(server=self.server)
+        api.strip_object(api.get_subscriber_list('x'))
+        self.assertEqual(api.get_subscriber_list('x').ListName, 'ListName-0')
+
+    def test_expiry(self):
+        api = make_api(server=self.server, cache_ttl=0.05)
+        api.get_subscriber_list('x')
+        time.sleep(0.1)
+        api.get_subscriber_list('x')
+        self.assertEqual(self.server.requests, 2)
+
+    def test_invalidated_by_writes(self):
+        api = make_api(server=self.server)
+        api.get_subscriber_list('x')
+        api.get_folder('f')
+        api.update_object(api.stub('List', ID=1, ListName='z'))
+        requests = self.server.requests
+
+        api.get_subscriber_list('x')
+        api.get_folder('f')
+        self.assertEqual(self.server.requests, requests + 1)
+
+    def test_least_recently_used_evicted(self):
+        cache = etapi.LookupCache(size=2)
+        cache.put(('List', 'a'), 1)
+        cache.put(('List', 'b'), 2)
+        cache.get(('List', 'a'))
+        cache.put(('List', 'c'), 3)
+        self.assertIsNone(cache.get(('List', 'b')))
+        self.assertEqual(cache.get(('List', 'a')), 1)
+
+        cache.invalidate('List')
+        self.assertEqual(cache.stats()['size'], 0)
+
+
+class UpsertSubscribersTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MockServer(record=True).start()
+        self.api = make_api(server=self.server)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def created(self):
+        # subscribers sent in Create calls
+        return sum(len(re.findall(r'<(?:\w+:)?EmailAddress>', body))
+                   for body in self.server.received if 'CreateRequest' in body)
+
+    def records(self, lists):
+        return [{'email': 's%d@example.com' % i, 'lists': lists.get(i, [])}
+                for i in range(5)]
+
+    def test_list_names_resolved(self):
+        self.server.rows['List'] = 1
+        results = list(self.api.upsert_subscribers(
+            self.records({2: ['Customers']})))
+
+        self.assertEqual([r.index for r in results], range(5))
+        self.assertTrue(all(r.ok for r in results))
+        self.assertTrue(any(re.search(r'<(?:\w+:)?Lists>', body)
+                            for body in self.server.received))
+
+    def test_unknown_list_reported(self):
+        self.server.rows['List'] = 0
+        results = list(self.api.upsert_subscribers(
+            self.records({1: ['Missing'], 3: ['Missing']}), batch_size=2))
+
+        self.assertEqual([r.index for r in results], range(5))
+        self.assertEqual([r.ok for r in results],
+                         [True, False, True, False, True])
+        self.assertIn("'Missing'", results[1].message)
+        self.assertEqual(self.created(), 3)
+
+
+class ClientPoolTest(unittest.TestCase):
+    def test_tenants_send_their_own_credentials(self):
+        server = MockServer(record=True).start()
+        pool = etapi.ClientPool(workers=4, log_path=LOG_PATH, offline=True)
+        try:
+            pool.add('a', 'user-a', 'secret-a')
+            pool.add('b', 'user-b', 'secret-b')
+            for tenant in ('a', 'b'):
+                pool[tenant].client.set_options(location=server.url)
+
+            # both tenants' calls interleave on the shared worker threads
+            threads = []
+            for tenant, calls in (('a', 6), ('b', 4)):
+                api = pool[tenant]
+                rr = api.retrieve_request('List', ['ID'])
+                t = threading.Thread(target=lambda api=api, rr=rr, n=calls:
+                                     list(api.map_calls('Retrieve',
+                                                        [(rr,)] * n)))
+                t.start()
+                threads.append(t)
+            for t in threads:
+                t.join()
+        finally:
+            pool.close()
+            server.stop()
+
+        sent = [credentials(body) for body in server.received]
+        self.assertEqual(sorted(sent), [('user-a', 'secret-a')] * 6 +
+                                       [('user-b', 'secret-b')] * 4)
+
+
+class RecordingTransport(etapi.PooledTransport):
+    # keeps the Content-Encoding of every request and its reply
+    def __init__(self, *args, **kwargs):
+        etapi.PooledTransport.__init__(self, *args, **kwargs)
+        self.encodings = []
+
+    def __deepcopy__(self, memo):
+        # clones record to the same list
+        clone = etapi.PooledTransport.__deepcopy__(self, memo)
+        clone.encodings = self.encodings
+        return clone
+
+    def post(self, host, path, body, headers):
+        resp, data = etapi.PooledTransport.post(self, host, path, body,
+                                                headers)
+        self.encodings.append((headers.get('Content-Encoding'),
+                               resp.getheader('content-encoding')))
+        return resp, data
+
+
+class TransportTest(unittest.TestCase):
+    def records(self, count):
+        return [{'email': 's%d@example.com' % i,
+                 'attributes': {'Name': 'Subscriber %d' % i}}
+                for i in range(count)]
+
+    def upsert(self, compression, count=50):
+        server = MockServer(compression=compression, record=True).start()
+        transport = RecordingTransport(compress=True)
+        try:
+            api = make_api(server=server, transport=transport)
+            results = list(api.upsert_subscribers(self.records(count)))
+            results += list(api.upsert_subscribers(self.records(count)))
+        finally:
+            server.stop()
+        self.assertTrue(all(r.ok for r in results))
+        return transport, server
+
+    def test_compressed(self):
+        transport, server = self.upsert(True)
+        self.assertEqual(transport.encodings, [('gzip', 'gzip')] * 2)
+        self.assertEqual(len(server.received), 2)
+
+        # small requests are sent plain
+        transport, server = self.upsert(True, 1)
+        self.assertEqual(transport.encodings, [(None, 'gzip')] * 2)
+
+    def test_plain_after_rejected(self):
+        transport, server = self.upsert(False)
+        self.assertEqual(transport.encodings, [('gzip', None), (None, None),
+                                               (None, None)])
+        self.assertEqual(len(server.received), 2)
+
+    def test_decode_body(self):
+        data = '<Envelope/>' * 10
+        for wbits in (zlib.MAX_WBITS, -zlib.MAX_WBITS):
+            z = zlib.compressobj(1, zlib.DEFLATED, wbits)
+            self.assertEqual(etapi.decode_body(z.compress(data) + z.flush(),
+                                               'deflate'), data)
+        z = zlib.compressobj(1, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self.assertEqual(etapi.decode_body(z.compress(data) + z.flush(),
+                                           ' GZIP'), data)
+        self.assertEqual(etapi.decode_body(data, None), data)
+
+    def test_compact_envelopes_equivalent(self):
+        bodies = []
+        for compact in (True, False):
+            server = MockServer(record=True).start()
+            try:
+                api = make_api(server=server, compact=compact)
+                list(api.upsert_subscribers(self.records(3)))
+                s = api.create('Subscriber')
+                s.SubscriberKey = 'key'
+                s.EmailAddress = 'a@example.com'
+                api.service.Update(None, [s])
+            finally:
+                server.stop()
+            bodies.append(server.received)
+
+        compact, full = bodies
+        self.assertEqual(len(compact), len(full))
+        for c, f in zip(compact, full):
+            self.assertNotEqual(c, f)
+            self.assertEqual(content(c), content(f))
+
+
+class InstrumentationTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MockServer(latency=0.05, rows=3).start()
+        self.api = make_api(server=self.server)
+        self.before = []
+        self.after = []
+        self.api.instruments.before(self.before.append)
+        self.api.instruments.after(self.after.append)
+
+    def tearDown(self):
+        self.api.close()
+        self.server.stop()
+
+    def retrieve(self):
+        return self.api.service.Retrieve(self.api.retrieve_request('List',
+                                                                   ['ID']))
+
+    def test_phases(self):
+        self.retrieve()
+
+        self.assertEqual(len(self.before), 1)
+        self.assertEqual(self.after, self.before)
+        stats = self.after[0]
+        self.assertEqual((stats.method, stats.status, stats.objects),
+                         ('Retrieve', 'OK', 3))
+        self.assertEqual(stats.request_id, 'mock-1')
+        for phase, seconds in stats.phases():
+            self.assertGreaterEqual(seconds, 0, phase)
+        self.assertGreaterEqual(stats.network, 0.05)
+        self.assertLess(stats.network, stats.elapsed)
+        self.assertGreater(stats.request_bytes, 0)
+        self.assertGreater(stats.response_bytes, 0)
+
+    def test_fault_recorded(self):
+        self.server.fault_rate = 1.0
+        self.assertRaises(suds.WebFault, self.retrieve)
+
+        stats = self.after[0]
+        self.assertEqual(stats.status, 'Error')
+        self.assertIsInstance(stats.error, suds.WebFault)
+
+    def test_prometheus(self):
+        self.retrieve()
+        self.retrieve()
+        lines = self.api.instruments.prometheus().splitlines()
+
+        self.assertIn('exacttarget_requests_total{method="Retrieve",'
+                      'status="OK"} 2', lines)
+        for phase in etapi.PHASES:
+            self.assertIn('exacttarget_request_seconds_bucket{method='
+                          '"Retrieve",phase="%s",le="+Inf"} 2' % phase, lines)
+            self.assertIn('exacttarget_request_seconds_count{method='
+                          '"Retrieve",phase="%s"} 2' % phase, lines)
+        self.assertIn('exacttarget_request_seconds_bucket{method="Retrieve",'
+                      'phase="network",le="0.01"} 0', lines)
+        self.assertIn('exacttarget_response_bytes_count{method="Retrieve"} 2',
+                      lines)
+
+        self.api.instruments.reset()
+        self.assertEqual(self.api.instruments.prometheus(),
+                         '# TYPE exacttarget_requests_total counter\n')
+
+    def test_statsd(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(5)
+        try:
+            self.api.instruments.after(
+                etapi.StatsdExporter(*sock.getsockname()))
+            self.retrieve()
+            lines = sock.recv(65536).split('\n')
+        finally:
+            sock.close()
+
+        self.assertEqual(lines[0], 'exacttarget.Retrieve.requests.OK:1|c')
+        self.assertEqual([l.split(':')[0] for l in lines[1:]],
+                         ['exacttarget.Retrieve.' + name
+                          for name in etapi.PHASES +
+                          ('request_bytes', 'response_bytes', 'objects')])
+        self.assertIn('exacttarget.Retrieve.objects:3|h', lines)
+        network = [l for l in lines if '.network:' in l][0]
+        self.assertGreaterEqual(float(network.split(':')[1][:-3]), 50)
+
+
+def content(envelope):
+    # the Body of an envelope as (tag, text, children), without nil
+    # elements or attributes
+    def walk(el):
+        return (el.tag, (el.text or '').strip(),
+                [walk(child) for child in el
+                 if child.get(XSI_NIL) != 'true'])
+    body = ElementTree.fromstring(envelope).find(SOAP_BODY)
+    return walk(body)
+
+
+def capture(api):
+    # keep the envelopes api sends instead of sending them
+    sent = []
+
+    def send_envelope(method, body, decode=None):
+        sent.append(body() if callable(body) else body)
+        return etapi.Page('OK', None, [])
+
+    api.send_envelope = send_envelope
+    return sent
+
+
+def serialized(api, method, objs):
+    # the envelope _send_objects writes for objs
+    tpl = api.objects_template(method, objs[0].__class__.__name__, None, ())
+    out = []
+    tpl.render(tpl.head, {}, out)
+    for obj in objs:
+        api.models.serialize(obj, 'Objects', tpl.prefix, tpl.type_prefix, out)
+    tpl.render(tpl.tail, {}, out)
+    return ''.join(out)
+
+
+class TemplateTest(unittest.TestCase):
+    rows = [{'Email': 'a@example.com', 'Name': None},
+            {'Email': 'b&c@example.com', 'Name': u'\xe9'},
+            {'Email': 'd@example.com'}]
+
+    def test_compiled_upsert_matches_objects(self):
+        envelopes = []
+        for compiled in (True, False):
+            api = make_api(compiled=compiled)
+            sent = capture(api)
+            list(api.upsert_data_extension('de', self.rows, async=False))
+            envelopes.append(sent)
+
+        self.assertEqual(len(envelopes[0]), 1)
+        self.assertEqual(envelopes[0], envelopes[1])
+
+    def test_none_leaves_out_element(self):
+        api = make_api(compiled=True)
+        sent = capture(api)
+        list(api.upsert_data_extension('de', self.rows[:1], async=False))
+
+        self.assertIn('<Name>Name</Name></Property>', sent[0])
+        self.assertNotIn('<Value></Value>', sent[0])
+
+    def test_compiled_envelopes_carry_credentials(self):
+        api = make_api('user-a', 'secret-a', compiled=True)
+        sent = capture(api)
+        api.add_to_triggered_send_definition('welcome', 'a@example.com',
+                                             'a', {'First Name': None})
+        list(api.upsert_data_extension('de', self.rows, async=False))
+
+        self.assertEqual(len(sent), 2)
+        for body in sent:
+            self.assertEqual(credentials(body), ('user-a', 'secret-a'))
+        self.assertNotIn('<Value></Value>', sent[0])
+
+    def test_templates_built_on_calling_thread(self):
+        api = make_api(compiled=True, workers=4)
+        capture(api)
+        threads = set()
+        template = api.template
+
+        def tracked(*args, **kwargs):
+            threads.add(threading.current_thread())
+            return template(*args, **kwargs)
+
+        api.template = tracked
+        rows = [dict(self.rows[i % 3], n=str(i)) for i in range(100)]
+        list(api.upsert_data_extension('de', rows, batch_size=10))
+        api.close()
+
+        self.assertEqual(threads, set([threading.current_thread()]))
+
+
+class TriggeredSendBatcherTest(unittest.TestCase):
+    def test_concurrent_sends(self):
+        server = MockServer(record=True).start()
+        try:
+            api = make_api(server=server, workers=4)
+            batcher = etapi.TriggeredSendBatcher(api, max_size=7,
+                                                 max_wait=0.01)
+            pending = []
+
+            def send(n):
+                for i in range(25):
+                    pending.append(batcher.send('welcome',
+                                                'u%d-%d@example.com' % (n, i),
+                                                'u%d-%d' % (n, i)))
+
+            threads = [threading.Thread(target=send, args=(n,))
+                       for n in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            batcher.close()
+            results = [p.get(5) for p in pending]
+            api.close()
+        finally:
+            server.stop()
+
+        self.assertEqual(len(results), 100)
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(sum(body.count('<Subscribers>')
+                             for body in server.received), 100)
+
+    def test_unmentioned_subscribers_fail(self):
+        # the reply has a result for the first TriggeredSend only
+        api = Replying(make_api(), [Result('OK', 0)])
+        batcher = etapi.TriggeredSendBatcher(api, max_subscribers=2,
+                                             timer=False)
+        results = batcher.deliver('welcome', [('u%d@example.com' % i,
+                                               'u%d' % i) for i in range(4)])
+
+        self.assertEqual([r.status for r in results],
+                         ['OK', 'OK', 'Error', 'Error'])
+        self.assertEqual(results[2].message, 'no result')
+
+    def test_unreadable_reply_resolves_every_send(self):
+        api = Replying(make_api(), [Result(None, 0)])
+        batcher = etapi.TriggeredSendBatcher(api, max_subscribers=2,
+                                             timer=False)
+        pending = [batcher.send('welcome', 'u%d@example.com' % i, 'u%d' % i)
+                   for i in range(4)]
+        batcher.flush().wait()
+
+        results = [p.get(1) for p in pending]
+        self.assertEqual([r.status for r in results], ['Error'] * 4)
+
+
+class Result(object):
+    def __init__(self, status, ordinal):
+        if status is not None:
+            self.StatusCode = status
+        self.OrdinalID = ordinal
+
+
+class Reply(object):
+    OverallStatus = 'OK'
+    RequestID = 'mock-1'
+
+    def __init__(self, results):
+        self.Results = results
+
+
+class Replying(object):
+    # an api whose Create calls all get the same reply
+    def __init__(self, api, results):
+        self.api = api
+        self.reply = Reply(results)
+
+    def __getattr__(self, name):
+        return getattr(self.api, name)
+
+    @property
+    def service(self):
+        return self
+
+    def Create(self, co, objs):
+        return self.reply
+
+
+class WriteManyTest(unittest.TestCase):
+    def setUp(self):
+        self.api = make_api()
+
+    def test_stubs_serialized_as_suds_would(self):
+        api = self.api
+        cases = [
+            ('Delete', [api.stub('Subscriber', SubscriberKey='a@example.com'),
+                        api.stub('Subscriber', ID=5)]),
+            ('Delete', [api.stub('DataExtensionObject', CustomerKey='de',
+                                 Keys={'Key': [{'Name': 'Email',
+                                                'Value': 'a@example.com'}]})]),
+            ('Update', [api.stub('TriggeredSendDefinition', CustomerKey='k',
+                                 TriggeredSendStatus='Inactive')]),
+        ]
+        for method, objs in cases:
+            self.assertEqual(serialized(api, method, objs),
+                             api.envelope(method, None, objs))
+
+    def test_result_decoder_matches_suds(self):
+        reply = ENVELOPE % write_response('Delete', 3, 'mock-1', errors={1})
+        m = self.api.client.service.Delete.method
+        parsed = etapi.SoapClient(self.api.client, m).succeeded(
+            m.binding.input, reply)
+        decoded = etapi.ResultDecoder().decode(reply)
+
+        self.assertEqual(decoded.OverallStatus, parsed.OverallStatus)
+        self.assertEqual(decoded.RequestID, parsed.RequestID)
+        for d, p in zip(decoded.Results, parsed.Results):
+            for field in etapi.Result._fields:
+                self.assertEqual(getattr(d, field),
+                                 getattr(p, field, None))
+
+    def test_delete_many(self):
+        server = MockServer(record=True).start()
+        try:
+            api = make_api('user-a', 'secret-a', server, workers=4)
+            results = api.delete_many(('key%d' % i for i in range(10)),
+                                      'Subscriber', 'SubscriberKey',
+                                      batch_size=3)
+            api.close()
+        finally:
+            server.stop()
+
+        self.assertEqual([r.index for r in results], range(10))
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(len(server.received), 4)
+        for body in server.received:
+            self.assertEqual(credentials(body), ('user-a', 'secret-a'))
+
+    def test_results_aligned_with_input(self):
+        # repeated keys each get their result
+        server = MockServer(error_rate=0.5, seed=3).start()
+        try:
+            api = make_api(server=server, workers=2)
+            keys = ['a', 'b', 'a', 'c', 'a', 'b']
+            results = api.delete_many(keys, 'Subscriber', 'SubscriberKey',
+                                      batch_size=2)
+            api.close()
+        finally:
+            server.stop()
+
+        self.assertEqual([r.index for r in results], range(len(keys)))
+        self.assertIn(False, [r.ok for r in results])
+        self.assertIn(True, [r.ok for r in results])
+
+    def test_faults_raised(self):
+        server = MockServer(fault_rate=1.0).start()
+        try:
+            api = make_api(server=server, workers=2)
+            subscriber = api.stub('Subscriber', SubscriberKey='a')
+            self.assertRaises(etapi.SoapError, api.delete_objects,
+                              [subscriber])
+            self.assertRaises(etapi.SoapError, api.delete_many, ['a', 'b'],
+                              'Subscriber', 'SubscriberKey')
+
+            results = api.delete_many(['a', 'b'], 'Subscriber',
+                                      'SubscriberKey', errors=True)
+            api.close()
+        finally:
+            server.stop()
+
+        self.assertEqual([(r.index, r.ok) for r in results],
+                         [(0, False), (1, False)])
+
+
+class FilterTest(unittest.TestCase):
+    def setUp(self):
+        self.api = make_api()
+
+    def test_condition_values(self):
+        sfp = (etapi.Field('ID') == 5).build(self.api)
+        self.assertEqual((sfp.Property, sfp.SimpleOperator, sfp.Value),
+                         ('ID', 'equals', [u'5']))
+
+        day = datetime.date(2015, 6, 1)
+        sfp = etapi.Field('Modified').between(day, day).build(self.api)
+        self.assertEqual(sfp.DateValue, [day, day])
+        self.assertIsNone(getattr(sfp, 'Value', None))
+
+        sfp = etapi.Field('Email').is_null().build(self.api)
+        self.assertEqual(sfp.SimpleOperator, 'isNull')
+        self.assertIsNone(getattr(sfp, 'Value', None))
+
+    def test_logical_tree(self):
+        a, b, c = [etapi.Field(f) == 1 for f in 'abc']
+        expr = (a & b) & c
+        self.assertEqual(expr.operands, [a, b, c])
+        self.assertEqual((a | b).operator, 'OR')
+
+        cfp = expr.build(self.api)
+        self.assertEqual(cfp.LogicalOperator, 'AND')
+        self.assertEqual(cfp.LeftOperand.Property, 'a')
+        self.assertEqual((cfp.RightOperand.LeftOperand.Property,
+                          cfp.RightOperand.RightOperand.Property), ('b', 'c'))
+
+    def test_split(self):
+        active = etapi.Field('Status') == 'Active'
+        expr = etapi.Field('ID').in_(range(5)) & active
+        parts = expr.split(2)
+
+        self.assertEqual(len(parts), 3)
+        values = []
+        for part in parts:
+            self.assertIn(active, part.operands)
+            values.extend(part.operands[-1].values)
+        self.assertEqual(values, range(5))
+
+        # the parts of an OR would overlap, so it isn't split
+        expr = etapi.Field('ID').in_(range(5)) | active
+        self.assertEqual(expr.split(2), [expr])
+
+    def test_envelope(self):
+        expr = (etapi.Field('Email') == 'a@example.com') & \
+            etapi.Field('ID').in_([1, 2])
+        env = self.api.envelope('Retrieve', self.api.retrieve_request(
+            'Subscriber', ['ID'], expr))
+
+        self.assertIn('<LogicalOperator>AND</LogicalOperator>', env)
+        self.assertIn('<Property>Email</Property>', env)
+        self.assertIn('<SimpleOperator>IN</SimpleOperator>', env)
+        self.assertIn('<Value>1</Value>', env)
+        self.assertIn('<Value>2</Value>', env)
+
+    def test_get_subscriber(self):
+        server = MockServer(record=True, rows=1).start()
+        try:
+            api = make_api(server=server)
+            sub = api.get_subscriber('key-1',
+                                     etapi.Field('Status') == 'Active')
+            api.close()
+        finally:
+            server.stop()
+
+        self.assertEqual(sub.SubscriberKey, 'SubscriberKey-0')
+        body = server.received[0]
+        for part in ('<LogicalOperator>AND</LogicalOperator>',
+                     '<Property>SubscriberKey</Property>',
+                     '<Value>key-1</Value>', '<Property>Status</Property>',
+                     '<Value>Active</Value>'):
+            self.assertIn(part, body)
+
+
+class DecoderTest(unittest.TestCase):
+    def setUp(self):
+        self.api = make_api()
+
+    def parsed(self, reply):
+        # the reply as suds reads it
+        m = self.api.client.service.Retrieve.method
+        return etapi.SoapClient(self.api.client, m).succeeded(
+            m.binding.input, reply)
+
+    def test_row_decoder(self):
+        cols = ['Email', 'Name']
+        reply = ENVELOPE % retrieve_response('mock-1', 'MoreDataAvailable',
+                                             [deo_row(cols, i)
+                                              for i in range(3)])
+        resp = self.parsed(reply)
+        rows = self.api._deo_to_list(resp)
+
+        page = etapi.RowDecoder(cols, 'dict').decode(reply)
+        self.assertEqual((page.OverallStatus, page.RequestID),
+                         (resp.OverallStatus, resp.RequestID))
+        self.assertEqual(page.Results, rows)
+
+        tuples = etapi.RowDecoder(cols, 'tuple').decode(reply).Results
+        self.assertEqual(tuples, [(r['Email'], r['Name']) for r in rows])
+        records = etapi.RowDecoder(cols, 'record').decode(reply).Results
+        self.assertEqual([r.Email for r in records],
+                         [r['Email'] for r in rows])
+        columns = etapi.RowDecoder(cols, 'columns').decode(reply).Results
+        self.assertEqual(columns['Name'], [r['Name'] for r in rows])
+
+    def test_row_decoder_escaping(self):
+        reply = ENVELOPE % retrieve_response('mock-1', 'OK', [
+            '<Results><Properties><Property><Name>Email</Name>'
+            '<Value>a&amp;b &lt;c&gt; \xc3\xa9</Value>'
+            '</Property></Properties></Results>'])
+        page = etapi.RowDecoder(['Email', 'Name'], 'tuple').decode(reply)
+        self.assertEqual(page.Results, [(u'a&b <c> \xe9', None)])
+
+    def test_object_decoder(self):
+        props = ['ID', 'EmailAddress', 'SubscriberKey', 'Status']
+        fields = Schema().properties('Subscriber')
+        reply = ENVELOPE % retrieve_response(
+            'mock-1', 'OK',
+            [object_row('Subscriber', props, fields, i) for i in range(3)])
+        resp = self.parsed(reply)
+
+        page = etapi.ObjectDecoder(props, 'dict').decode(reply)
+        self.assertEqual(page.OverallStatus, resp.OverallStatus)
+        for row, obj in zip(page.Results, resp.Results):
+            for p in props:
+                self.assertEqual(row[p], unicode(getattr(obj, p)))
+
+        tuples = etapi.ObjectDecoder(props, 'tuple').decode(reply).Results
+        self.assertEqual(tuples, [tuple(r[p] for p in props)
+                                  for r in page.Results])
+
+
+class EnvelopeTemplateTest(unittest.TestCase):
+    def setUp(self):
+        self.api = make_api()
+        self.token = etapi.EnvelopeTemplate.token
+
+    def test_fill_matches_suds(self):
+        api = self.api
+        values = {'email': u'a&b@example.com', 'key': u'\xe9<k>'}
+        build = lambda t: (None, [api.stub('Subscriber',
+                                           EmailAddress=t('email'),
+                                           SubscriberKey=t('key'))])
+        tpl = api.template(('test', 'Subscriber'), 'Create', build)
+
+        expected = api.envelope('Create', *build(lambda f: values[f]))
+        self.assertEqual(tpl.fill(values).decode('utf-8'), expected)
+
+    def test_none_leaves_out_element(self):
+        api = self.api
+        build = lambda t: (None, [api.stub('Subscriber',
+                                           EmailAddress=t('email'),
+                                           SubscriberKey=t('key'))])
+        tpl = api.template(('test', 'Subscriber'), 'Create', build)
+        expected = api.envelope('Create', None,
+                                [api.stub('Subscriber', SubscriberKey='k')])
+        self.assertEqual(tpl.fill({'email': None, 'key': 'k'}), expected)
+
+    def test_repeat(self):
+        t = self.token
+        env = ('<a><b><Objects><c>%s</c></Objects></b><d>%s</d></a>'
+               % (t('x'), t('y')))
+        tpl = etapi.EnvelopeTemplate(env, repeat='Objects')
+
+        self.assertEqual(tpl.fill({'y': 'end'}, [{'x': 1}, {'x': None},
+                                                 {'x': 'a&b'}]),
+                         '<a><b><Objects><c>1</c></Objects><Objects></Objects>'
+                         '<Objects><c>a&amp;b</c></Objects></b><d>end</d></a>')
+
+
+class SerializerTest(unittest.TestCase):
+    def setUp(self):
+        self.api = make_api()
+
+    def test_data_extension_objects(self):
+        api = self.api
+        rows = [{'Email': 'a@example.com', 'Name': u'\xe9 & co'},
+                {'Email': 'b@example.com'}]
+        deo = api.models['DataExtensionObject']
+        prop = api.models['APIProperty']
+        objs = [deo(CustomerKey='de',
+                    Properties=[prop(Name=k, Value=v)
+                                for k, v in sorted(r.items())])
+                for r in rows]
+        suds_objs = [api._create_deo('de', dict(sorted(r.items())))
+                     for r in rows]
+
+        sent = serialized(api, 'Create', objs)
+        self.assertEqual(sent.decode('utf-8'),
+                         api.envelope('Create', None, suds_objs))
+
+    def test_nested_objects(self):
+        api = self.api
+        s = api.models['Subscriber'](
+            EmailAddress='a@example.com', SubscriberKey='a',
+            Attributes=[{'Name': 'First Name', 'Value': 'A'}],
+            Lists=[{'ID': 12, 'Status': 'Active'}])
+        stub = api.stub('Subscriber', EmailAddress='a@example.com',
+                        SubscriberKey='a',
+                        Attributes=[{'Name': 'First Name', 'Value': 'A'}],
+                        Lists=[{'ID': 12, 'Status': 'Active'}])
+
+        self.assertEqual(serialized(api, 'Create', [s]),
+                         serialized(api, 'Create', [stub]))
+        self.assertEqual(serialized(api, 'Create', [stub]),
+                         api.envelope('Create', None, [stub]))
+
+    def test_empty_fields_left_out(self):
+        s = self.api.models['Subscriber'](SubscriberKey='a', Attributes=[])
+        out = []
+        self.api.models.serialize(s, 'Objects', '', '', out)
+        self.assertEqual(''.join(out), '<Objects xsi:type="Subscriber">'
+                         '<SubscriberKey>a</SubscriberKey></Objects>')
+
+
+class IterObjectsTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MockServer(page_size=10).start()
+        self.server.rows['Subscriber'] = 25
+        self.api = make_api(server=self.server)
+        self.props = ['ID', 'EmailAddress', 'SubscriberKey', 'Status']
+
+    def tearDown(self):
+        self.api.close()
+        self.server.stop()
+
+    def test_pages_followed(self):
+        for prefetch in (0, 2):
+            requests = self.server.requests
+            rows = list(self.api.iter_objects('Subscriber', self.props,
+                                              prefetch=prefetch))
+            self.assertEqual([r.SubscriberKey for r in rows],
+                             ['SubscriberKey-%d' % i for i in range(25)])
+            self.assertEqual(self.server.requests - requests, 3)
+
+        # the first page only
+        rows = list(self.api.iter_objects('Subscriber', self.props,
+                                          more_data=False))
+        self.assertEqual(len(rows), 10)
+
+    def test_rows(self):
+        row = next(self.api.iter_objects('Subscriber', self.props))
+        self.assertEqual(row._fields, tuple(self.props))
+        self.assertEqual(row.ID, '0')
+        self.assertEqual(row.EmailAddress, 'EmailAddress-0')
+
+        row = next(self.api.iter_objects('Subscriber', self.props,
+                                         row_format='dict'))
+        self.assertEqual(sorted(row), sorted(self.props))
+
+    def test_long_in_filter_split(self):
+        where = etapi.Field('SubscriberKey').in_(['k%d' % i
+                                                  for i in range(1200)])
+        rows = list(self.api.iter_objects('Subscriber', self.props, where))
+        # three Retrieves of three pages; the mock ignores the filter
+        self.assertEqual(len(rows), 75)
+        self.assertEqual(self.server.requests, 9)
+
+
+class EmailReceiversTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MockServer(page_size=5).start()
+        self.api = make_api(server=self.server)
+
+    def tearDown(self):
+        self.api.close()
+        self.server.stop()
+
+    def test_one_receiver(self):
+        self.server.rows['SentEvent'] = 12
+        receiver = self.api.get_email_receivers(1)
+        self.assertEqual(receiver.SubscriberKey, 'SubscriberKey-0')
+        self.assertEqual(self.server.requests, 1)
+
+    def test_no_receivers(self):
+        self.assertIsNone(self.api.get_email_receivers(1))
+
+    def test_all_receivers(self):
+        self.server.rows['SentEvent'] = 12
+        receivers = self.api.get_all_email_receivers(1)
+        self.assertEqual([r.SubscriberKey for r in receivers],
+                         ['SubscriberKey-%d' % i for i in range(12)])
+
+
+class ETagHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        if self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', server.etag)
+        self.send_header('Content-Length', str(len(server.body)))
+        self.end_headers()
+        self.wfile.write(server.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SchemaCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_path = tempfile.mkdtemp()
+        self.http = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), ETagHandler)
+        self.http.requests = 0
+        self.http.etag, self.http.body = '"v1"', '<definitions/>'
+        t = threading.Thread(target=self.http.serve_forever)
+        t.daemon = True
+        t.start()
+        self.url = 'http://127.0.0.1:%d/etframework.wsdl' % \
+            self.http.server_address[1]
+
+    def tearDown(self):
+        self.stop()
+        shutil.rmtree(self.cache_path)
+
+    def stop(self):
+        if self.http is not None:
+            self.http.shutdown()
+            self.http.server_close()
+            self.http = None
+
+    def test_remote_schema_keyed_on_content(self):
+        api = etapi.ExactTargetAPI('u', 'p', log_path=LOG_PATH,
+                                   schema_url=self.url,
+                                   cache_path=self.cache_path,
+                                   schema_check_interval=0)
+        first = api.schema_cache().location
+
+        # unchanged: revalidated, same location
+        self.assertEqual(api.schema_cache().location, first)
+        self.assertEqual(self.http.requests, 2)
+
+        self.http.etag, self.http.body = '"v2"', '<definitions name="x"/>'
+        self.assertNotEqual(api.schema_cache().location, first)
+
+    def test_remote_schema_revalidated_once_per_interval(self):
+        for i in range(3):
+            api = etapi.ExactTargetAPI('u', 'p', log_path=LOG_PATH,
+                                       schema_url=self.url,
+                                       cache_path=self.cache_path)
+            first = api.schema_cache().location
+        self.assertEqual(self.http.requests, 1)
+
+        self.http.etag, self.http.body = '"v2"', '<definitions name="x"/>'
+        self.assertEqual(api.schema_cache().location, first)
+        api.schema_check_interval = 0
+        self.assertNotEqual(api.schema_cache().location, first)
+
+    def test_unreachable_remote_schema_uses_last_digest(self):
+        api = etapi.ExactTargetAPI('u', 'p', log_path=LOG_PATH,
+                                   schema_url=self.url,
+                                   cache_path=self.cache_path,
+                                   schema_check_interval=0)
+        first = api.schema_cache().location
+        self.stop()
+        self.assertEqual(api.schema_cache().location, first)
+
+    def test_local_schema_keyed_on_content(self):
+        wsdl = os.path.join(self.cache_path, 'schema.wsdl')
+        with open(wsdl, 'w') as f:
+            f.write('<definitions/>')
+        api = etapi.ExactTargetAPI('u', 'p', log_path=LOG_PATH,
+                                   schema_url=etapi.local_url(wsdl),
+                                   cache_path=self.cache_path)
+        first = api.schema_cache().location
+
+        with open(wsdl, 'w') as f:
+            f.write('<definitions name="changed"/>')
+        self.assertNotEqual(api.schema_cache().location, first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from support import make_api
+
+import etapi
+from etasync import AsyncExactTargetAPI
+from mockserver import MockServer
+
+
+class PeakLimiter(etapi.RateLimiter):
+    # a RateLimiter that remembers the most requests it let in at once
+    peak = 0
+
+    def try_acquire(self, poll=0.01):
+        wait = etapi.RateLimiter.try_acquire(self, poll)
+        self.peak = max(self.peak, self.active)
+        return wait
+
+
+class RateLimitTest(unittest.TestCase):
+    def tearDown(self):
+        self.server.stop()
+
+    def retrieve(self, limiter, calls):
+        api = make_api(server=self.server, limiter=limiter)
+        et = AsyncExactTargetAPI(api)
+
+        @gen.coroutine
+        def run():
+            resps = yield [et.retrieve('List', ['ID']) for i in range(calls)]
+            raise gen.Return(resps)
+
+        return IOLoop.current().run_sync(run, timeout=30)
+
+    def test_concurrency_limited(self):
+        self.server = MockServer(latency=0.05).start()
+        limiter = PeakLimiter(max_concurrency=2)
+        resps = self.retrieve(limiter, 8)
+
+        self.assertEqual(len(resps), 8)
+        self.assertEqual(limiter.peak, 2)
+        self.assertEqual(limiter.active, 0)
+
+    def test_throttled_calls_retried(self):
+        self.server = MockServer(throttle_rate=0.3, seed=1).start()
+        limiter = etapi.RateLimiter(cooldown=0.01, max_retries=50)
+        resps = self.retrieve(limiter, 10)
+
+        self.assertTrue(all(r.OverallStatus == 'OK' for r in resps))
+        self.assertLess(limiter.retry_budget, 50)
+        self.assertEqual(limiter.active, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
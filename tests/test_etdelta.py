@@ -0,0 +1,106 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import support
+
+import etdelta
+from etdelta import DELETE, INSERT, UPDATE
+
+
+class DataExtension(object):
+    # stands in for the api's get_data_extension over one table of rows
+    def __init__(self, rows, page_size=2):
+        self.rows = rows
+        self.page_size = page_size
+        self.requests = []
+
+    def get_data_extension(self, de_key, cols, start_date=None,
+                           start_date_field=None, prefetch=0,
+                           row_format='dict'):
+        self.requests.append((cols, start_date))
+        since = etdelta.parse_date(start_date)
+        rows = [dict((c, r.get(c)) for c in cols) for r in self.rows
+                if since is None or
+                etdelta.parse_date(r[start_date_field]) >= since]
+        for i in range(0, len(rows), self.page_size):
+            yield rows[i:i + self.page_size]
+
+
+def row(email, name, minute):
+    return {'Email': email, 'Name': name,
+            'Modified': '6/1/2015 10:%02d:00 AM' % minute}
+
+
+class DeltaSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.de = DataExtension([row('a@example.com', u'A', 0),
+                                 row('b@example.com', u'B', 1),
+                                 row('c@example.com', u'C', 2)])
+        self.sync = etdelta.DeltaSync(self.de,
+                                      os.path.join(self.dir, 'delta.db'),
+                                      overlap=60)
+
+    def tearDown(self):
+        self.sync.close()
+        shutil.rmtree(self.dir)
+
+    def changes(self, deletes=False):
+        return [(c.kind, c.key) for c in
+                self.sync.sync('de', ['Email', 'Name'], 'Email', 'Modified',
+                               deletes)]
+
+    def test_first_sync_inserts_everything(self):
+        self.assertEqual(self.changes(), [(INSERT, 'a@example.com'),
+                                          (INSERT, 'b@example.com'),
+                                          (INSERT, 'c@example.com')])
+        self.assertEqual(self.sync.watermark('de'),
+                         datetime.datetime(2015, 6, 1, 10, 2))
+        self.assertEqual(self.de.requests[0],
+                         (['Email', 'Name', 'Modified'], None))
+
+    def test_only_changes_reported(self):
+        self.changes()
+        self.assertEqual(self.changes(), [])
+        # from the watermark less the overlap; the rows fetched again
+        # weren't reported
+        self.assertEqual(self.de.requests[-1][1], '2015-06-01T10:01:00')
+
+        self.de.rows[1] = row('b@example.com', u'B2', 3)
+        self.de.rows.append(row('d@example.com', u'D', 4))
+        self.assertEqual(self.changes(), [(UPDATE, 'b@example.com'),
+                                          (INSERT, 'd@example.com')])
+
+    def test_deletes(self):
+        self.changes()
+        del self.de.rows[1]
+        self.assertEqual(self.changes(deletes=True),
+                         [(DELETE, 'b@example.com')])
+        self.assertEqual(self.de.requests[-1], (['Email'], None))
+
+        self.de.rows.append(row('b@example.com', u'B', 9))
+        self.assertEqual(self.changes(), [(INSERT, 'b@example.com')])
+
+    def test_watermark_kept_until_consumed(self):
+        changes = self.sync.sync('de', ['Email', 'Name'], 'Email', 'Modified')
+        next(changes)
+        changes.close()
+        self.assertIsNone(self.sync.watermark('de'))
+
+    def test_composite_key(self):
+        changes = list(self.sync.sync('de', ['Name'], ('Email', 'Name'),
+                                      'Modified'))
+        self.assertEqual(changes[0].key, u'a@example.com\x1fA')
+
+    def test_reset(self):
+        self.changes()
+        self.sync.reset('de')
+        self.assertIsNone(self.sync.watermark('de'))
+        self.assertEqual(len(self.changes()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import csv
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+from support import make_api
+
+from etexport import (CsvWriter, ResumeError, export_data_extension,
+                      load_checkpoint, save_checkpoint)
+from mockserver import MockServer
+
+
+class Killed(Exception):
+    pass
+
+
+class KilledWriter(CsvWriter):
+    # stops the export partway through writing a part, after rows rows
+    def __init__(self, pattern, rows_per_file, rows):
+        CsvWriter.__init__(self, pattern, rows_per_file)
+        self.left = rows
+
+    def write_rows(self, rows):
+        CsvWriter.write_rows(self, rows[:self.left])
+        self.left -= len(rows)
+        if self.left < 0:
+            self.out.flush()
+            raise Killed()
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.pattern = os.path.join(self.dir, 'de-%05d.csv')
+        self.checkpoint = os.path.join(self.dir, 'de.checkpoint')
+        self.server = MockServer(page_size=100).start()
+        self.server.rows['DataExtensionObject[de]'] = 1050
+        self.api = make_api(server=self.server)
+
+    def tearDown(self):
+        self.api.close()
+        self.server.stop()
+        shutil.rmtree(self.dir)
+
+    def export(self, writer):
+        return export_data_extension(self.api, 'de', ['Email'], writer,
+                                     checkpoint=self.checkpoint)
+
+    def exported(self):
+        rows = []
+        for path in sorted(glob.glob(os.path.join(self.dir, '*.csv'))):
+            with open(path, 'rb') as f:
+                rows.extend(row[0] for row in list(csv.reader(f))[1:])
+        return rows
+
+    def test_kill_and_resume(self):
+        # killed halfway through the third part
+        self.assertRaises(Killed, self.export,
+                          KilledWriter(self.pattern, 300, 750))
+        state = load_checkpoint(self.checkpoint)
+        self.assertEqual(state['rows'], 600)
+        self.assertEqual(state['last'], ['Email 599'])
+        self.assertEqual(len(state['files']), 2)
+        self.assertTrue(os.path.exists(self.pattern % 2))
+
+        metrics = self.export(CsvWriter(self.pattern, 300))
+
+        self.assertEqual(self.exported(),
+                         ['Email %d' % i for i in range(1050)])
+        self.assertEqual(metrics.pages, 11)
+        state = load_checkpoint(self.checkpoint)
+        self.assertTrue(state['done'])
+        self.assertEqual(state['files'],
+                         [self.pattern % i for i in range(4)])
+
+    def test_changed_extension_not_resumed(self):
+        self.assertRaises(Killed, self.export,
+                          KilledWriter(self.pattern, 300, 750))
+
+        # the rows have moved since the checkpoint
+        state = load_checkpoint(self.checkpoint)
+        state['last'] = ['Email 598']
+        save_checkpoint(self.checkpoint, state)
+        self.assertRaises(ResumeError, self.export,
+                          CsvWriter(self.pattern, 300))
+
+        # or some are gone
+        self.server.rows['DataExtensionObject[de]'] = 500
+        self.assertRaises(ResumeError, self.export,
+                          CsvWriter(self.pattern, 300))
+
+    def test_done_export_not_repeated(self):
+        self.export(CsvWriter(self.pattern, 300))
+        requests = self.server.requests
+        self.export(CsvWriter(self.pattern, 300))
+        self.assertEqual(self.server.requests, requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
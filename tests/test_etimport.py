@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from support import make_api
+
+import etapi
+from etimport import FileImporter, LocalDirectoryDrop
+from etjobs import JobTracker
+from mockserver import MockServer
+
+
+class Broken(Exception):
+    pass
+
+
+def rows(count, fail_at=None):
+    for i in xrange(count):
+        if i == fail_at:
+            raise Broken()
+        yield {'Email': 'user%d@example.com' % i, 'Name': u'User %d' % i}
+
+
+class FileImporterTest(unittest.TestCase):
+    def setUp(self):
+        self.drop_dir = tempfile.mkdtemp()
+        self.server = MockServer(import_time=0.1).start()
+        self.api = make_api(server=self.server)
+
+    def tearDown(self):
+        self.api.close()
+        self.server.stop()
+        shutil.rmtree(self.drop_dir)
+
+    def importer(self, **options):
+        return FileImporter(self.api, 'de', 'de_import',
+                            LocalDirectoryDrop(self.drop_dir), threshold=10,
+                            rows_per_file=40, poll_interval=0.05, **options)
+
+    def test_import(self):
+        load = self.importer().load(rows(100))
+
+        self.assertEqual((load.method, load.rows), ('import', 100))
+        self.assertEqual([job.status for job in load.results],
+                         ['Completed'] * 3)
+        self.assertEqual(len(os.listdir(self.drop_dir)), 3)
+
+    def test_tracker_started(self):
+        tracker = JobTracker(self.api, 0.05)
+        try:
+            load = self.importer(tracker=tracker).load(rows(50))
+        finally:
+            tracker.close()
+        self.assertEqual([job.status for job in load.results],
+                         ['Completed'] * 2)
+
+    def test_small_load_upserted(self):
+        load = self.importer().load(rows(5))
+        self.assertEqual((load.method, load.rows), ('soap', 5))
+
+    def test_write_error_fails_fast(self):
+        # imports that would take a minute aren't waited for
+        self.server.import_time = 60
+        start = time.time()
+        self.assertRaises(Broken, self.importer().load, rows(200, 90))
+        self.assertLess(time.time() - start, 5)
+
+    def test_no_task_id(self):
+        self.api.run_import = lambda key, **settings: None
+        self.assertRaises(etapi.ExactTargetError, self.importer().load,
+                          rows(100))
+
+    def test_concurrent_loads_keep_their_errors(self):
+        importer = self.importer()
+        outcomes = {}
+
+        def load(name, data):
+            try:
+                outcomes[name] = importer.load(data)
+            except Exception as e:
+                outcomes[name] = e
+
+        threads = [threading.Thread(target=load, args=('ok', rows(100))),
+                   threading.Thread(target=load,
+                                    args=('broken', rows(100, 50)))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertIsInstance(outcomes['broken'], Broken)
+        self.assertEqual(outcomes['ok'].rows, 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
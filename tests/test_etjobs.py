@@ -0,0 +1,51 @@
+import unittest
+
+from support import make_api
+
+import etjobs
+from mockserver import MockServer
+
+
+class JobTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MockServer(rows=10, import_time=0.2).start()
+        self.api = make_api(server=self.server)
+        self.tracker = etjobs.JobTracker(self.api, interval=0.05)
+
+    def tearDown(self):
+        self.tracker.close()
+        self.api.close()
+        self.server.stop()
+
+    def test_imports_complete(self):
+        tasks = [self.api.run_import('import-%d' % i) for i in range(3)]
+        pending = [self.tracker.track_import(t) for t in tasks]
+
+        # still running at first
+        self.assertEqual(self.tracker.sweep(), 0)
+        self.assertEqual(self.tracker.pending(), 3)
+
+        self.tracker.start()
+        jobs = [p.get(5) for p in pending]
+
+        self.assertEqual([job.id for job in jobs], [str(t) for t in tasks])
+        for job in jobs:
+            self.assertEqual(job.kind, etjobs.IMPORT)
+            self.assertEqual(job.status, 'Completed')
+            self.assertEqual((job.total, job.succeeded, job.errors),
+                             (10, 10, 0))
+        self.assertEqual(self.tracker.pending(), 0)
+
+    def test_unknown_import_times_out(self):
+        self.tracker.timeout = 0
+        pending = self.tracker.track_import(12345)
+        self.tracker.sweep()
+        self.assertEqual(pending.get(1).status, etjobs.TIMEOUT)
+
+    def test_none_rejected(self):
+        self.assertRaises(ValueError, self.tracker.track_import, None)
+        self.assertEqual(self.tracker.pending(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from support import make_api
+
+import etqueue
+from mockserver import MockServer
+
+
+class WriteQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.server = MockServer(record=True).start()
+        self.api = make_api(server=self.server)
+        self.queue = etqueue.WriteQueue(self.api,
+                                        os.path.join(self.dir, 'queue.db'),
+                                        retry_backoff=0)
+
+    def tearDown(self):
+        self.queue.close(drain=False)
+        self.api.close()
+        self.server.stop()
+        shutil.rmtree(self.dir)
+
+    def test_triggered_sends(self):
+        for i in range(5):
+            self.queue.put_triggered_send('welcome', 'u%d@example.com' % i,
+                                          'u%d' % i, {'First Name': 'U'})
+        self.assertEqual(self.queue.flush(), 5)
+
+        self.assertEqual(self.queue.pending(), 0)
+        self.assertEqual(len(self.server.received), 1)
+        self.assertEqual(self.server.received[0].count('<Subscribers>'), 5)
+        # delivered on the flushing thread, no batcher timer left running
+        self.assertIsNone(self.queue.batcher.timer)
+
+    def test_failed_batches_retried_then_dead_lettered(self):
+        self.queue.max_attempts = 2
+        self.server.fault_rate = 1.0
+        self.queue.put_rows('de', [{'Email': 'a@example.com'},
+                                   {'Email': 'b@example.com'}], key='Email')
+
+        self.assertEqual(self.queue.flush(), 2)
+        self.assertEqual(self.queue.pending(), 2)
+        self.assertEqual(self.queue.dead_letters(), [])
+
+        self.assertEqual(self.queue.flush(), 2)
+        dead = self.queue.dead_letters()
+        self.assertEqual([(d.key, d.attempts) for d in dead],
+                         [('a@example.com', 2), ('b@example.com', 2)])
+        self.assertIn('Mock fault', dead[0].error)
+        self.assertEqual(self.queue.flush(), 0)
+
+        # once the server recovers they can be sent again
+        self.server.fault_rate = 0.0
+        self.queue.retry_dead()
+        self.assertEqual(self.queue.flush(), 2)
+        self.assertEqual(self.queue.pending(), 0)
+        self.assertEqual(self.queue.dead_letters(), [])
+
+    def test_rejected_rows_dead_lettered_at_once(self):
+        self.server.error_rate = 1.0
+        self.queue.put_rows('de', [{'Email': 'a@example.com'}], key='Email')
+        self.queue.flush()
+
+        dead = self.queue.dead_letters(etqueue.ROWS)
+        self.assertEqual([(d.key, d.attempts, d.error) for d in dead],
+                         [('a@example.com', 1, 'Mock error')])
+        self.queue.discard_dead()
+        self.assertEqual(self.queue.dead_letters(), [])
+
+    def test_keyed_writes_replace_pending(self):
+        self.queue.put_rows('de', [{'Email': 'a@example.com', 'Name': 'A'}],
+                            key='Email')
+        self.queue.put_rows('de', [{'Email': 'a@example.com', 'Name': 'B'}],
+                            key='Email')
+        self.assertEqual(self.queue.pending(), 1)
+        self.queue.flush()
+
+        self.assertEqual(len(self.server.received), 1)
+        self.assertIn('<Value>B</Value>', self.server.received[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
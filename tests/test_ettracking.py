@@ -0,0 +1,69 @@
+import unittest
+
+from support import make_api
+
+from ettracking import EventExtractor
+from mockserver import MockServer
+
+
+class Broken(Exception):
+    pass
+
+
+class RepeatingExtractor(EventExtractor):
+    # each page starts with the last event of the one before, as ET
+    # sometimes returns them
+    def pages(self, event_type, rr):
+        last = []
+        for page in EventExtractor.pages(self, event_type, rr):
+            yield last + page
+            last = page[-1:]
+
+
+class FailingExtractor(EventExtractor):
+    def pages(self, event_type, rr):
+        for page in EventExtractor.pages(self, event_type, rr):
+            yield page
+            raise Broken()
+
+
+class EventExtractorTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MockServer(page_size=10).start()
+        self.server.rows['SentEvent'] = 35
+        self.server.rows['OpenEvent'] = 12
+        self.api = make_api(server=self.server, workers=2)
+
+    def tearDown(self):
+        self.api.close()
+        self.server.stop()
+
+    def events(self, extractor, **options):
+        return [e for events in extractor.by_sends([1], **options)
+                for e in events]
+
+    def test_pages_followed(self):
+        events = self.events(EventExtractor(self.api,
+                                            event_types=('SentEvent',)))
+
+        self.assertEqual([e.subscriber_key for e in events],
+                         ['SubscriberKey-%d' % i for i in range(35)])
+        self.assertEqual(self.server.requests, 4)
+        self.assertEqual(events[0].type, 'SentEvent')
+        self.assertEqual(events[0].event_date, '2015-06-01T10:00:00')
+
+    def test_duplicates_dropped(self):
+        events = self.events(RepeatingExtractor(
+            self.api, event_types=('SentEvent', 'OpenEvent')))
+
+        # the same subscriber in two event types isn't a duplicate
+        self.assertEqual(len(events), 35 + 12)
+        self.assertEqual(len(set(events)), 35 + 12)
+
+    def test_worker_error_raised(self):
+        extractor = FailingExtractor(self.api, event_types=('SentEvent',))
+        self.assertRaises(Broken, self.events, extractor)
+
+
+if __name__ == '__main__':
+    unittest.main()